@@ -1,32 +1,122 @@
+import argparse
+import csv
+import json
 import logging
-import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from os import path
 from pathlib import Path
 from requests.exceptions import ConnectionError
+from threading import Lock
+from weakref import WeakKeyDictionary
 from xml.etree.ElementTree import SubElement, Element, Comment, tostring
 from xml.dom.minidom import parseString
-from zipfile import ZipFile
 
 from jikanpy.exceptions import APIException
 
 from MangaTaggerLib._version import __version__
+from MangaTaggerLib.archive import write_comicinfo
 from MangaTaggerLib.api import MTJikan, AniList
-from MangaTaggerLib.database import MetadataTable, ProcFilesTable, ProcSeriesTable
+from MangaTaggerLib.database import MetadataTable, ProcFilesTable, ProcSeriesTable, SeriesAliasTable, \
+    UnresolvedSeriesTable
 from MangaTaggerLib.errors import FileAlreadyProcessedError, FileUpdateNotRequiredError, UnparsableFilenameError, \
-    MangaNotFoundError, MangaMatchedException
+    MangaNotFoundError, MangaMatchedException, ResponseNotCachedError
 from MangaTaggerLib.models import Metadata
 from MangaTaggerLib.task_queue import QueueWorker
-from MangaTaggerLib.utils import AppSettings, compare
+from MangaTaggerLib.utils import AppSettings, compare, compare_many
+
+
+class SingleFlight:
+    """
+    Coordinates concurrent calls for the same key: the first caller runs the function, while every other caller blocks
+    on a shared future and receives the same result or exception once the first caller finishes.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._futures = {}
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._futures
+
+    def do(self, key, function, *args):
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+
+            if leader:
+                future = Future()
+                self._futures[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+
+class KeyedLock:
+    """
+    Mutual exclusion per key, where the lock for a key only exists while some thread holds or waits for it.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._locks = {}
+
+    def locked(self, key):
+        with self._lock:
+            return key in self._locks
+
+    @contextmanager
+    def lock(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
 
 # Global Variable Declaration
 LOG = logging.getLogger('MangaTaggerLib.MangaTaggerLib')
 
-CURRENTLY_PENDING_DB_SEARCH = set()
-CURRENTLY_PENDING_RENAME = set()
+PENDING_SERIES_RESOLUTION = SingleFlight()
+PENDING_RENAME = KeyedLock()
+
+# Rendered ComicInfo.xml of each series, split around the chapter number. Kept outside of Metadata.__dict__ so that it
+# is never inserted into the database, and dropped along with the Metadata object.
+COMICINFO_TEMPLATES = WeakKeyDictionary()
+COMICINFO_TEMPLATES_LOCK = Lock()
+COMICINFO_NUMBER_PLACEHOLDER = 'MangaTaggerChapterNumber'
+
 
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+
+    if arguments.list_unresolved or arguments.clear_unresolved is not None or arguments.seed_aliases is not None:
+        AppSettings.load_database()
+        try:
+            run_admin_commands(arguments)
+        finally:
+            AppSettings.close_database()
+        return
 
-def main():
     AppSettings.load()
 
     LOG.info(f'Starting Manga Tagger - Version {__version__}')
@@ -41,6 +131,61 @@ def main():
     QueueWorker.run()
 
 
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(prog='MangaTagger')
+
+    admin = parser.add_argument_group('administration', 'Maintain the database and exit without processing chapters')
+    admin.add_argument('--list-unresolved', action='store_true',
+                       help='list the series that could not be matched and are skipped until their entry expires')
+    admin.add_argument('--clear-unresolved', nargs='*', metavar='DIRECTORY',
+                       help='search for the given unresolved series again, or for every unresolved series if no '
+                            'directory names are given; takes effect at the next start of Manga Tagger')
+    admin.add_argument('--seed-aliases', type=Path, metavar='FILE',
+                       help='record the directory names in a CSV file of "directory,mal_id" rows or a JSON object of '
+                            '{"directory": mal_id} as aliases of their MyAnimeList series')
+
+    return parser.parse_args(arguments)
+
+
+def load_aliases(alias_path: Path):
+    """
+    Reads directory name to MAL ID aliases from a JSON object, or from a CSV file of directory name and MAL ID rows
+    with an optional header row.
+    """
+    with open(alias_path, newline='', encoding='utf-8') as alias_file:
+        if alias_path.suffix.lower() == '.json':
+            return {directory: int(mal_id) for directory, mal_id in json.load(alias_file).items()}
+
+        aliases = {}
+        for row in csv.reader(alias_file):
+            if len(row) >= 2 and row[1].strip().isdigit():
+                aliases[row[0].strip()] = int(row[1])
+
+        return aliases
+
+
+def run_admin_commands(arguments):
+    if arguments.seed_aliases is not None:
+        aliases = load_aliases(arguments.seed_aliases)
+        added = SeriesAliasTable.seed(aliases)
+
+        # Seeded directories are searched for again, even if they could not be matched before
+        if aliases:
+            UnresolvedSeriesTable.remove(list(aliases))
+        print(f'Seeded {len(aliases)} aliases from "{arguments.seed_aliases}" ({added} new).')
+
+    if arguments.clear_unresolved is not None:
+        removed = UnresolvedSeriesTable.remove(arguments.clear_unresolved)
+        print(f'Removed {removed} unresolved series.')
+
+    if arguments.list_unresolved:
+        results = UnresolvedSeriesTable.find_all()
+
+        for result in results:
+            print(f'{result["_id"]}\t(until {result["expires_at"]:%Y-%m-%d @ %I:%M:%S %p} UTC)\t{result.get("reason")}')
+        print(f'{len(results)} unresolved series.')
+
+
 def process_manga_chapter(file_path: Path, event_id):
     filename = file_path.name
     directory_path = file_path.parent
@@ -80,53 +225,72 @@ def process_manga_chapter(file_path: Path, event_id):
     LOG.info(f'Checking for current and previously processed files with filename "{new_filename}"...',
              extra=logging_info)
 
-    if AppSettings.mode_settings is None or AppSettings.mode_settings['rename_file']:
+    rename_file = AppSettings.mode_settings is None or AppSettings.mode_settings['rename_file']
+    write_comicinfo = AppSettings.mode_settings is None or ('write_comicinfo' in AppSettings.mode_settings.keys()
+                                                            and AppSettings.mode_settings['write_comicinfo'])
+
+    # For libraries on another filesystem or a network share, the chapter is streamed into the library once with
+    # ComicInfo.xml already injected, rather than copied there and then read and written again to tag it
+    single_pass = rename_file and write_comicinfo and requires_transfer(file_path, manga_library_dir)
+    comicinfo_xml = None
+    api_error = None
+
+    if single_pass:
+        LOG.info(f'Resolving metadata before transferring "{file_path}" into the library...', extra=logging_info)
         try:
-            # Multithreading Optimization
-            if new_file_path in CURRENTLY_PENDING_RENAME:
-                LOG.info(f'A file is currently being renamed under the filename "{new_filename}". Locking '
-                         f'{file_path} from further processing until this rename action is complete...',
-                         extra=logging_info)
+            manga_metadata = get_manga_metadata(directory_name, logging_info)
+        except (APIException, ConnectionError) as e:
+            manga_metadata = None
+            api_error = e
 
-                while new_file_path in CURRENTLY_PENDING_RENAME:
-                    time.sleep(1)
+        if manga_metadata is not None:
+            try:
+                comicinfo_xml = construct_comicinfo_xml(manga_metadata, manga_details[1], logging_info)
+            except Exception as e:
+                LOG.exception(e, extra=logging_info)
+                LOG.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                            extra=logging_info)
 
-                LOG.info(f'The file being renamed to "{new_file_path}" has been completed. Unlocking '
-                         f'"{new_filename}" for file rename processing.', extra=logging_info)
-            else:
-                LOG.info(f'No files currently currently being processed under the filename '
-                         f'"{new_filename}". Locking new filename for processing...', extra=logging_info)
-                CURRENTLY_PENDING_RENAME.add(new_file_path)
+    if rename_file:
+        # Multithreading Optimization
+        if PENDING_RENAME.locked(new_file_path):
+            LOG.info(f'A file is currently being renamed under the filename "{new_filename}". Locking '
+                     f'{file_path} from further processing until this rename action is complete...',
+                     extra=logging_info)
+        else:
+            LOG.info(f'No files currently currently being processed under the filename '
+                     f'"{new_filename}". Locking new filename for processing...', extra=logging_info)
 
-            rename_action(file_path, new_file_path, directory_name, manga_details[1], logging_info)
+        try:
+            with PENDING_RENAME.lock(new_file_path):
+                rename_action(file_path, new_file_path, directory_name, manga_details[1], logging_info,
+                              comicinfo_xml)
         except (FileExistsError, FileUpdateNotRequiredError, FileAlreadyProcessedError) as e:
             LOG.exception(e, extra=logging_info)
-            CURRENTLY_PENDING_RENAME.remove(new_file_path)
             return
 
-    # More Multithreading Optimization
-    if directory_name in ProcSeriesTable.processed_series:
-        LOG.info(f'"{directory_name}" has been processed as a searched series and will continue processing.',
+        LOG.info(f'"{new_file_path.name}" has been unlocked for any pending processes.', extra=logging_info)
+
+    if not single_pass:
+        metadata_tagger(directory_name, manga_details[1], logging_info, new_file_path)
+    elif api_error is not None:
+        park_metadata_tagger(api_error, directory_name, manga_details[1], logging_info, new_file_path, 1)
+    elif comicinfo_xml is not None:
+        LOG.info(f'"{new_file_path}" was transferred into the library with ComicInfo.xml in a single pass.',
                  extra=logging_info)
-    else:
-        if directory_name in CURRENTLY_PENDING_DB_SEARCH:
-            LOG.info(f'"{directory_name}" has not been processed as a searched series but is currently pending '
-                     f'a database search. Suspending further processing until database search has finished...',
-                     extra=logging_info)
 
-            while directory_name in CURRENTLY_PENDING_DB_SEARCH:
-                time.sleep(1)
+    LOG.info(f'Processing on "{new_file_path}" has finished.', extra=logging_info)
+
 
-            LOG.info(f'"{directory_name}" has been processed as a searched series and will now be unlocked for '
-                     f'processing.', extra=logging_info)
-        else:
-            LOG.info(f'"{directory_name}" has not been processed as a searched series nor is it currently pending '
-                     f'a database search. Locking series from being processing until database has been searched...',
-                     extra=logging_info)
-            CURRENTLY_PENDING_DB_SEARCH.add(directory_name)
+def requires_transfer(file_path: Path, manga_library_dir: Path):
+    """
+    Returns True if moving file_path into the library has to copy its bytes, because the library is a network path or
+    on a different filesystem from the download directory.
+    """
+    if AppSettings.is_network_path:
+        return True
 
-    metadata_tagger(directory_name, manga_details[1], logging_info, new_file_path)
-    LOG.info(f'Processing on "{new_file_path}" has finished.', extra=logging_info)
+    return file_path.stat().st_dev != manga_library_dir.stat().st_dev
 
 
 def file_renamer(filename, logging_info):
@@ -224,8 +388,10 @@ def file_renamer(filename, logging_info):
     return filename, chapter_number
 
 
-def rename_action(current_file_path: Path, new_file_path: Path, manga_title, chapter_number, logging_info):
+def rename_action(current_file_path: Path, new_file_path: Path, manga_title, chapter_number, logging_info,
+                  comicinfo_xml=None):
     chapter_number = chapter_number.replace('.', '-')
+
     results = ProcFilesTable.search(manga_title, chapter_number)
     LOG.debug(f'Results: {results}')
 
@@ -234,7 +400,7 @@ def rename_action(current_file_path: Path, new_file_path: Path, manga_title, cha
         LOG.info(f'"{manga_title}" chapter {chapter_number} has not been processed before. '
                  f'Proceeding with file rename...', extra=logging_info)
         ProcFilesTable.insert_record_and_rename(current_file_path, new_file_path, manga_title, chapter_number,
-                                                logging_info)
+                                                logging_info, comicinfo_xml)
     else:
         versions = ['v2', 'v3', 'v4', 'v5']
 
@@ -252,7 +418,8 @@ def rename_action(current_file_path: Path, new_file_path: Path, manga_title, cha
                     new_file_path.unlink()
                     LOG.info(f'"{new_file_path.name}" has been deleted! Proceeding to rename new file...',
                              extra=logging_info)
-                    ProcFilesTable.update_record_and_rename(results, current_file_path, new_file_path, logging_info)
+                    ProcFilesTable.update_record_and_rename(results, current_file_path, new_file_path, logging_info,
+                                                            comicinfo_xml)
                 else:
                     LOG.warning(f'"{current_file_path.name}" was not renamed due being the exact same as the '
                                 f'existing chapter; file currently being processed will be deleted',
@@ -273,9 +440,6 @@ def rename_action(current_file_path: Path, new_file_path: Path, manga_title, cha
                 current_file_path.unlink()
                 raise FileAlreadyProcessedError(current_file_path.name)
 
-    LOG.info(f'"{new_file_path.name}" will be unlocked for any pending processes.', extra=logging_info)
-    CURRENTLY_PENDING_RENAME.remove(new_file_path)
-
 
 def compare_versions(old_filename: str, new_filename: str):
     old_version = 0
@@ -313,129 +477,322 @@ def compare_versions(old_filename: str, new_filename: str):
         return False
 
 
-def metadata_tagger(manga_title, manga_chapter_number, logging_info, manga_file_path=None):
+def retry_metadata_tagger(file_path: Path, manga_title, manga_chapter_number, attempt, event_id):
+    logging_info = {
+        'event_id': event_id,
+        'manga_title': manga_title,
+        'chapter_number': manga_chapter_number,
+        'attempt': attempt
+    }
+
+    if not file_path.exists():
+        LOG.warning(f'"{file_path}" no longer exists; dropping metadata retry.', extra=logging_info)
+        return
+
+    LOG.info(f'Retrying metadata tagging for "{file_path}" (attempt {attempt})...', extra=logging_info)
+    metadata_tagger(manga_title, manga_chapter_number, logging_info, file_path, attempt)
+    LOG.info(f'Processing on "{file_path}" has finished.', extra=logging_info)
+
+
+def metadata_tagger(manga_title, manga_chapter_number, logging_info, manga_file_path=None, attempt=0):
+    try:
+        manga_metadata = get_manga_metadata(manga_title, logging_info)
+    except (APIException, ConnectionError) as e:
+        park_metadata_tagger(e, manga_title, manga_chapter_number, logging_info, manga_file_path, attempt + 1)
+        return
+
+    if manga_metadata is None:
+        return
+
+    LOG.debug(f'Metadata cache statistics: {MetadataTable.cache.statistics()}', extra=logging_info)
+
+    if AppSettings.mode_settings is None or ('write_comicinfo' in AppSettings.mode_settings.keys()
+                                             and AppSettings.mode_settings['write_comicinfo']):
+        comicinfo_xml = construct_comicinfo_xml(manga_metadata, manga_chapter_number, logging_info)
+        reconstruct_manga_chapter(comicinfo_xml, manga_file_path, logging_info)
+
+    return manga_metadata
+
+
+def park_metadata_tagger(error, manga_title, manga_chapter_number, logging_info, manga_file_path, attempt):
+    # Every chapter waiting on the same series receives the error, so each one is parked on its own
+    LOG.warning(error, extra=logging_info)
+    parked = QueueWorker.retry_tagging(manga_file_path, manga_title, manga_chapter_number, attempt)
+
+    if parked:
+        LOG.warning(f'The APIs could not be reached for "{manga_title}"; parked chapter {manga_chapter_number} '
+                    f'for a delayed retry so the worker can move on.', extra=logging_info)
+    elif parked is None:
+        LOG.warning(f'The APIs could not be reached for "{manga_title}"; chapter {manga_chapter_number} will not be '
+                    f'tagged.', extra=logging_info)
+    else:
+        LOG.error(f'The APIs could not be reached for "{manga_title}" in {attempt - 1} attempts; chapter '
+                  f'{manga_chapter_number} will be left untagged.', extra=logging_info)
+
+
+def get_manga_metadata(manga_title, logging_info):
+    """
+    Returns the metadata for the series from the metadata cache, or resolves it once for every chapter waiting on the
+    series. API errors are raised to every waiting chapter.
+    """
+    manga_metadata = MetadataTable.cache.get(manga_title)
+
+    if manga_metadata is not None:
+        LOG.info(f'Found cached metadata for "{manga_title}".', extra=logging_info)
+        logging_info['metadata'] = manga_metadata.__dict__
+        return manga_metadata
+
+    if UnresolvedSeriesTable.is_unresolved(manga_title):
+        LOG.info(f'"{manga_title}" could not be matched recently; skipping the metadata search. Run Manga Tagger with '
+                 f'--clear-unresolved to search for it again.', extra=logging_info)
+        return None
+
+    # Multithreading Optimization
+    if PENDING_SERIES_RESOLUTION.in_flight(manga_title):
+        LOG.info(f'"{manga_title}" is currently pending a database search. Suspending further processing until '
+                 f'the database search has finished...', extra=logging_info)
+    else:
+        LOG.info(f'"{manga_title}" has not been resolved nor is it currently pending a database search. Locking '
+                 f'series from being processed until the database has been searched...', extra=logging_info)
+
+    return PENDING_SERIES_RESOLUTION.do(manga_title, resolve_and_cache_manga_metadata, manga_title, logging_info)
+
+
+def resolve_and_cache_manga_metadata(manga_title, logging_info):
+    try:
+        manga_metadata = resolve_manga_metadata(manga_title, logging_info)
+    except ResponseNotCachedError as rnce:
+        LOG.warning(rnce, extra=logging_info)
+        return None
+
+    if manga_metadata is not None:
+        MetadataTable.cache.put(manga_title, manga_metadata)
+
+    return manga_metadata
+
+
+def resolve_manga_metadata(manga_title, logging_info):
     manga_search = None
     db_exists = True
+    similar_title = False
     retries = 0
 
     LOG.info(f'Table search value is "{manga_title}"', extra=logging_info)
+
+    # Directory names resolved before go straight to their series, however far they are from its titles
+    mal_id = SeriesAliasTable.lookup(manga_title)
+    if mal_id is not None:
+        LOG.info(f'"{manga_title}" is an alias of MAL ID "{mal_id}"; searching manga_metadata by ID...',
+                 extra=logging_info)
+        manga_search = MetadataTable.search_by_id(mal_id)
+
+        if manga_search is None:
+            return resolve_manga_metadata_by_id(manga_title, mal_id, logging_info)
+
     while manga_search is None:
         if retries == 0:
-            LOG.info('Searching manga_metadata for manga title by search value...', extra=logging_info)
-            manga_search = MetadataTable.search_by_search_value(manga_title)
+            LOG.info('Searching manga_metadata for manga title by search value, regular and English title...',
+                     extra=logging_info)
+            manga_search = MetadataTable.lookup(manga_title)
             retries = 1
         elif retries == 1:
-            LOG.info('Searching manga_metadata for regular manga title...', extra=logging_info)
-            manga_search = MetadataTable.search_by_series_title(manga_title)
+            LOG.info('Searching manga_metadata title index for a similar manga title...', extra=logging_info)
+            manga_search = MetadataTable.search_by_similar_title(manga_title)
+            similar_title = manga_search is not None
             retries = 2
-        elif retries == 2:
-            LOG.info('Searching manga_metadata for English manga title...', extra=logging_info)
-            manga_search = MetadataTable.search_by_series_title_eng(manga_title)
-            retries = 3
         else:  # The manga is not in the database, so ping the API and create the database
             LOG.info('Manga was not found in the database; resorting to Jikan API.', extra=logging_info)
 
-            try:
-                manga_search = MTJikan().search('manga', manga_title)
-            except (APIException, ConnectionError) as e:
-                LOG.warning(e, extra=logging_info)
-                LOG.warning('Manga Tagger has unintentionally breached the API limits on Jikan. Waiting 60s to clear '
-                            'all rate limiting limits...')
-                time.sleep(60)
-                manga_search = MTJikan().search('manga', manga_title)
+            manga_search = MTJikan().search('manga', manga_title)
             db_exists = False
 
     if db_exists:
-        if manga_title in ProcSeriesTable.processed_series:
-            LOG.info(f'Found an entry in manga_metadata for "{manga_title}".', extra=logging_info)
-        else:
-            LOG.info(f'Found an entry in manga_metadata for "{manga_title}"; unlocking series for processing.',
-                     extra=logging_info)
-            ProcSeriesTable.processed_series.add(manga_title)
-            CURRENTLY_PENDING_DB_SEARCH.remove(manga_title)
+        LOG.info(f'Found an entry in manga_metadata for "{manga_title}"; unlocking series for processing.',
+                 extra=logging_info)
+        ProcSeriesTable.add(manga_title, logging_info)
 
         manga_metadata = Metadata(manga_title, logging_info, details=manga_search)
         logging_info['metadata'] = manga_metadata.__dict__
+
+        # A similar title is searched for again next time rather than made permanent, as aliases are never re-checked
+        if not similar_title:
+            SeriesAliasTable.add(manga_title, manga_metadata._id, logging_info, database_insert_enabled())
     else:
-        manga_found = False
+        results = [result for result in manga_search['results'] if result['type'].lower() == 'manga']
+
+        # Titles and staff for every candidate come back from AniList in as few requests as possible
+        anilist_media = AniList.search_by_mal_ids([result['mal_id'] for result in results], logging_info)
+
+        # API errors raised by either lookup park the chapter for a retry; the series is only recorded as unresolved
+        # once both APIs have answered and none of the candidates matched
+        match = evaluate_candidates(manga_title, results, anilist_media, logging_info)
+
         try:
-            for result in manga_search['results']:
-                if result['type'].lower() == 'manga':
-                    manga_id = result['mal_id']
-                    anilist_titles = construct_anilist_titles(
-                        AniList.search_for_manga_title_by_mal_id(manga_id, logging_info)['title'])
-                    logging_info['anilist_titles'] = anilist_titles
-
-                    try:
-                        jikan_details = MTJikan().manga(manga_id)
-                    except (APIException, ConnectionError) as e:
-                        LOG.warning(e, extra=logging_info)
-                        LOG.warning(
-                            'Manga Tagger has unintentionally breached the API limits on Jikan. Waiting 60s to clear '
-                            'all rate limiting limits...')
-                        time.sleep(60)
-                        jikan_details = MTJikan().manga(manga_id)
-
-                    jikan_titles = construct_jikan_titles(jikan_details)
-                    logging_info['jikan_titles'] = jikan_titles
-
-                    LOG.info(f'Comparing titles found for "{manga_title}"...', extra=logging_info)
-                    comparison_values = compare_titles(manga_title, jikan_titles, anilist_titles, logging_info)
-
-                    if comparison_values is None:
-                        continue
-                    elif any(value > .8 for value in comparison_values):
-                        LOG.info(f'Match found for {manga_title}', extra=logging_info)
-                        manga_found = True
-                        break
-                    elif any(value > .5 for value in comparison_values):
-                        jikan_details = MTJikan().manga(result['mal_id'])
-                        jikan_authors = jikan_details['authors']
-                        anilist_authors = AniList.search_staff_by_mal_id(result['mal_id'],
-                                                                         logging_info)['staff']['edges']
-
-                        logging_info['jikan_authors'] = jikan_authors
-                        logging_info['anilist_authors'] = anilist_authors
-
-                        LOG.info(f'Match found for {manga_title} with 50% likelihood; now checking '
-                                 f'authors for further veritifcation', extra=logging_info)
-
-                        if compare_authors(jikan_authors, anilist_authors, logging_info):
-                            LOG.info(f'Authors matched up for {manga_title}; proceeding with processing')
-                            manga_found = True
-                            break
-            if not manga_found:
+            if match is None:
                 raise MangaNotFoundError(manga_title)
+
+            manga_id, jikan_details = match
         except MangaNotFoundError as mnfe:
             LOG.exception(mnfe, extra=logging_info)
-            return
+            UnresolvedSeriesTable.add(manga_title, str(mnfe), logging_info, database_insert_enabled())
+            return None
 
         LOG.info(f'ID for "{manga_title}" found as "{manga_id}".', extra=logging_info)
+        manga_metadata = store_manga_metadata(manga_title, jikan_details, anilist_media[manga_id], logging_info)
 
-        anilist_details = AniList.search_staff_by_mal_id(manga_id, logging_info)
-        LOG.debug(f'jikan_details: {jikan_details}')
-        LOG.debug(f'anilist_details: {anilist_details}')
+    return manga_metadata
 
-        manga_metadata = Metadata(manga_title, logging_info, jikan_details, anilist_details)
-        logging_info['metadata'] = manga_metadata.__dict__
 
-        if AppSettings.mode_settings is None or ('database_insert' in AppSettings.mode_settings.keys()
-                                                 and AppSettings.mode_settings['database_insert']):
-            MetadataTable.insert(manga_metadata, logging_info)
+def evaluate_candidates(manga_title, results, anilist_media, logging_info):
+    """
+    Returns the MAL ID and Jikan details of the first search result matching manga_title, or None if none match.
 
-        LOG.info(f'Retrieved metadata for "{manga_title}" from the Anilist and MyAnimeList APIs; '
-                 f'now unlocking series for processing!', extra=logging_info)
-        ProcSeriesTable.processed_series.add(manga_title)
-        CURRENTLY_PENDING_DB_SEARCH.remove(manga_title)
+    Candidates are ranked by how close their search result and AniList titles are to manga_title, and their Jikan
+    details are fetched and compared in that order, several at a time. The first candidate in search result order
+    still wins, as when they were compared one by one: once a candidate matches, the candidates after it are cancelled,
+    while the ones before it are still compared.
+    """
+    candidates = []
+    for index, result in enumerate(results):
+        if anilist_media[result['mal_id']] is None:
+            LOG.info(f'MAL ID "{result["mal_id"]}" was not found on AniList; skipping candidate.', extra=logging_info)
+        else:
+            candidates.append((index, result['mal_id']))
+
+    if not candidates:
+        return None
+
+    ranking = sorted(candidates, key=lambda candidate: -rank_candidate(manga_title, results[candidate[0]],
+                                                                        anilist_media[candidate[1]]))
+    LOG.debug(f'Candidate ranking: {[manga_id for _, manga_id in ranking]}', extra=logging_info)
+
+    # Search result index of the first candidate known to match, and the number of candidates fetched from Jikan
+    match_index = [len(results)]
+    fetched = [0]
+    futures = {}
+    lock = Lock()
+
+    def evaluate(index, manga_id):
+        with lock:
+            if match_index[0] < index:
+                return None
+            fetched[0] += 1
+
+        # Candidates are compared concurrently, so each one logs to its own copy
+        candidate_logging_info = dict(logging_info)
+        jikan_details = MTJikan().manga(manga_id)
+
+        if not candidate_matches(manga_title, jikan_details, anilist_media[manga_id], candidate_logging_info):
+            return None
+
+        with lock:
+            if index < match_index[0]:
+                match_index[0] = index
+
+                for later_index, future in futures.items():
+                    if later_index > index:
+                        future.cancel()
+
+        return jikan_details, candidate_logging_info
+
+    executor = ThreadPoolExecutor(max_workers=min(AppSettings.candidate_threads, len(ranking)),
+                                  thread_name_prefix='MTT-Candidate')
+    try:
+        with lock:
+            for index, manga_id in ranking:
+                futures[index] = executor.submit(evaluate, index, manga_id)
+
+        # Waiting in search result order raises API errors only where comparing one by one would have reached them
+        for index, manga_id in candidates:
+            if futures[index].cancelled():
+                continue
+
+            evaluation = futures[index].result()
+            if evaluation is not None:
+                jikan_details, candidate_logging_info = evaluation
+                logging_info.update(candidate_logging_info)
+                LOG.info(f'Matched search result {index + 1} of {len(results)} for "{manga_title}" after fetching '
+                         f'{fetched[0]} of {len(candidates)} candidates.', extra=logging_info)
+                return manga_id, jikan_details
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return None
 
-    if AppSettings.mode_settings is None or ('write_comicinfo' in AppSettings.mode_settings.keys()
-                                             and AppSettings.mode_settings['write_comicinfo']):
-        comicinfo_xml = construct_comicinfo_xml(manga_metadata, manga_chapter_number, logging_info)
-        reconstruct_manga_chapter(comicinfo_xml, manga_file_path, logging_info)
+
+def rank_candidate(manga_title, result, anilist_media):
+    titles = [result.get('title'), result.get('title_english'), *anilist_media['title'].values()]
+    return max(compare_many(manga_title, [title for title in titles if title]), default=0)
+
+
+def candidate_matches(manga_title, jikan_details, anilist_details, logging_info):
+    anilist_titles = construct_anilist_titles(anilist_details['title'])
+    logging_info['anilist_titles'] = anilist_titles
+
+    jikan_titles = construct_jikan_titles(jikan_details)
+    logging_info['jikan_titles'] = jikan_titles
+
+    LOG.info(f'Comparing titles found for "{manga_title}"...', extra=logging_info)
+    comparison_values = compare_titles(manga_title, jikan_titles, anilist_titles, logging_info)
+
+    if comparison_values is None:
+        return False
+    elif any(value > .8 for value in comparison_values):
+        LOG.info(f'Match found for {manga_title}', extra=logging_info)
+        return True
+    elif any(value > .5 for value in comparison_values):
+        jikan_authors = jikan_details['authors']
+        anilist_authors = anilist_details['staff']['edges']
+
+        logging_info['jikan_authors'] = jikan_authors
+        logging_info['anilist_authors'] = anilist_authors
+
+        LOG.info(f'Match found for {manga_title} with 50% likelihood; now checking '
+                 f'authors for further veritifcation', extra=logging_info)
+
+        if compare_authors(jikan_authors, anilist_authors, logging_info):
+            LOG.info(f'Authors matched up for {manga_title}; proceeding with processing')
+            return True
+
+    return False
+
+
+def resolve_manga_metadata_by_id(manga_title, mal_id, logging_info):
+    LOG.info(f'MAL ID "{mal_id}" was not found in manga_metadata; resorting to Jikan and AniList APIs.',
+             extra=logging_info)
+    anilist_details = AniList.search_by_mal_ids([mal_id], logging_info)[mal_id]
+
+    if anilist_details is None:
+        LOG.warning(f'MAL ID "{mal_id}" of alias "{manga_title}" was not found on AniList; unable to retrieve '
+                    f'metadata.', extra=logging_info)
+        return None
+
+    return store_manga_metadata(manga_title, MTJikan().manga(mal_id), anilist_details, logging_info)
+
+
+def store_manga_metadata(manga_title, jikan_details, anilist_details, logging_info):
+    LOG.debug(f'jikan_details: {jikan_details}')
+    LOG.debug(f'anilist_details: {anilist_details}')
+
+    manga_metadata = Metadata(manga_title, logging_info, jikan_details, anilist_details)
+    logging_info['metadata'] = manga_metadata.__dict__
+
+    if database_insert_enabled():
+        MetadataTable.insert(manga_metadata, logging_info)
+
+    LOG.info(f'Retrieved metadata for "{manga_title}" from the Anilist and MyAnimeList APIs; '
+             f'now unlocking series for processing!', extra=logging_info)
+    ProcSeriesTable.add(manga_title, logging_info)
+    SeriesAliasTable.add(manga_title, manga_metadata._id, logging_info, database_insert_enabled())
 
     return manga_metadata
 
 
+def database_insert_enabled():
+    return AppSettings.mode_settings is None or ('database_insert' in AppSettings.mode_settings.keys()
+                                                 and AppSettings.mode_settings['database_insert'])
+
+
 def construct_jikan_titles(jikan_details):
     jikan_titles = {
         'title': jikan_details['title']
@@ -472,13 +829,7 @@ def construct_anilist_titles(anilist_details):
 
 
 def compare_titles(manga_title: str, jikan_titles: dict, anilist_titles: dict, logging_info):
-    comparison_values = []
-
-    for jikan_key in jikan_titles.keys():
-        comparison_values.append(compare(manga_title, jikan_titles[jikan_key]))
-
-    for anilist_key in anilist_titles.keys():
-        comparison_values.append(compare(manga_title, anilist_titles[anilist_key]))
+    comparison_values = compare_many(manga_title, [*jikan_titles.values(), *anilist_titles.values()])
 
     logging_info['pre_comparison_values'] = comparison_values
     LOG.debug(f'pre_comparison_values: {comparison_values}', extra=logging_info)
@@ -488,9 +839,8 @@ def compare_titles(manga_title: str, jikan_titles: dict, anilist_titles: dict, l
 
     comparison_values = []
 
-    for jikan_key in jikan_titles.keys():
-        for anilist_key in anilist_titles.keys():
-            comparison_values.append(compare(jikan_titles[jikan_key], anilist_titles[anilist_key]))
+    for jikan_title in jikan_titles.values():
+        comparison_values.extend(compare_many(jikan_title, anilist_titles.values()))
 
     logging_info['post_comparison_values'] = comparison_values
     LOG.debug(f'post_comparison_values: {comparison_values}', extra=logging_info)
@@ -516,6 +866,31 @@ def construct_comicinfo_xml(metadata, chapter_number, logging_info):
     LOG.info(f'Constructing comicinfo object for "{metadata.series_title}", chapter {chapter_number}...',
              extra=logging_info)
 
+    with COMICINFO_TEMPLATES_LOCK:
+        template = COMICINFO_TEMPLATES.get(metadata)
+
+    if template is None:
+        LOG.debug(f'Rendering ComicInfo template for "{metadata.series_title}"', extra=logging_info)
+        parts = render_comicinfo_xml(metadata, COMICINFO_NUMBER_PLACEHOLDER).split(COMICINFO_NUMBER_PLACEHOLDER)
+
+        # Metadata containing the placeholder itself cannot be split unambiguously
+        template = tuple(parts) if len(parts) == 2 else ()
+
+        with COMICINFO_TEMPLATES_LOCK:
+            COMICINFO_TEMPLATES[metadata] = template
+
+    LOG.info(f'Finished creating ComicInfo object for "{metadata.series_title}", chapter {chapter_number}.',
+             extra=logging_info)
+
+    # Chapter numbers needing XML escaping go through the full serializer, so the output never depends on the escaping
+    # rules of the running minidom version
+    if not template or any(character in f'{chapter_number}' for character in '&<>"'):
+        return render_comicinfo_xml(metadata, chapter_number)
+
+    return f'{template[0]}{chapter_number}{template[1]}'
+
+
+def render_comicinfo_xml(metadata, chapter_number):
     comicinfo = Element('ComicInfo')
 
     application_tag = Comment('Generated by Manga Tagger, an Endless Galaxy Studios project')
@@ -584,19 +959,19 @@ def construct_comicinfo_xml(metadata, chapter_number, logging_info):
     comicinfo.set('xmlns:xsd', 'http://www.w3.org/2001/XMLSchema')
     comicinfo.set('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance')
 
-    LOG.info(f'Finished creating ComicInfo object for "{metadata.series_title}", chapter {chapter_number}.',
-             extra=logging_info)
     return parseString(tostring(comicinfo)).toprettyxml(indent="   ")
 
 
 def reconstruct_manga_chapter(comicinfo_xml, manga_file_path, logging_info):
     try:
-        with ZipFile(manga_file_path, 'a') as zipfile:
-            zipfile.writestr('ComicInfo.xml', comicinfo_xml)
+        written = write_comicinfo(manga_file_path, comicinfo_xml)
     except Exception as e:
         LOG.exception(e, extra=logging_info)
         LOG.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
                     extra=logging_info)
         return
 
-    LOG.info(f'ComicInfo.xml has been created and appended to "{manga_file_path}".', extra=logging_info)
+    if written:
+        LOG.info(f'ComicInfo.xml has been written to "{manga_file_path}".', extra=logging_info)
+    else:
+        LOG.info(f'"{manga_file_path}" already contains an identical ComicInfo.xml; skipping.', extra=logging_info)
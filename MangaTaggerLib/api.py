@@ -1,40 +1,214 @@
 import logging
 import requests
 import time
-from datetime import datetime
+from collections import deque
+from threading import Lock
 from typing import Optional, Dict, Mapping, Union, Any
 
 from jikanpy import Jikan
+from jikanpy.exceptions import APIException
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException
+
+from MangaTaggerLib.errors import ResponseNotCachedError
+from MangaTaggerLib.response_cache import ResponseCache
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to requests made without one.
+    """
+    def __init__(self, timeout=None, *args, **kwargs):
+        self.timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+
+class HTTPSession:
+    """
+    Process-wide keep-alive session shared by the Jikan and AniList clients, so that connections (and their TLS
+    handshakes) are pooled and reused across calls and worker threads.
+    """
+    pool_connections = 4
+    pool_maxsize = 8
+    timeout = 30
+
+    _session: requests.Session = None
+    _lock = Lock()
+    _log = None
+
+    @classmethod
+    def initialize(cls):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+
+        with cls._lock:
+            if cls._session is not None:
+                cls._session.close()
+            cls._session = cls._create_session()
+
+        cls._log.debug(f'{cls.__name__} class has been initialized')
+
+    @classmethod
+    def _create_session(cls):
+        session = requests.Session()
+        adapter = TimeoutHTTPAdapter(cls.timeout, pool_connections=cls.pool_connections, pool_maxsize=cls.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.hooks['response'].append(cls._log_response)
+        return session
+
+    @classmethod
+    def get(cls) -> requests.Session:
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+                    cls._session = cls._create_session()
+        return cls._session
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._session is not None:
+                cls._log.info('Closing HTTP session...')
+                cls._session.close()
+                cls._session = None
+
+    @classmethod
+    def _log_response(cls, response, *args, **kwargs):
+        cls._log.debug(f'{response.request.method} {response.url} returned {response.status_code} in '
+                       f'{response.elapsed.total_seconds() * 1000:.0f} ms')
+
+    @classmethod
+    def print_debug_settings(cls):
+        cls._log.debug(f'HTTP Pool Connections: {cls.pool_connections}')
+        cls._log.debug(f'HTTP Pool Max Size: {cls.pool_maxsize}')
+        cls._log.debug(f'HTTP Timeout (s): {cls.timeout}')
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to capacity tokens, refilled continuously at rate tokens per second. Tokens are reserved
+    ahead of time, so the bucket can go into debt; the debt is how long the caller has to wait for its turn.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+
+    def reserve(self, now):
+        """
+        Takes one token and returns how many seconds from now the caller may proceed. Not thread-safe by itself.
+        """
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        self._tokens -= 1
+
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+
+class SlidingWindow:
+    """
+    Allows at most limit calls in any period seconds, by remembering when the last limit calls were scheduled to start.
+    Unlike a token bucket, a burst after an idle period cannot be followed by refilled tokens within the same period.
+    """
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._starts = deque(maxlen=limit)
+
+    def reserve(self, now, wait=0.0):
+        """
+        Schedules a call that may not start before wait seconds from now, and returns how many seconds from now it may
+        start. Not thread-safe by itself.
+        """
+        start = now + wait
+        if len(self._starts) == self.limit:
+            start = max(start, self._starts[0] + self.period)
+
+        self._starts.append(start)
+        return start - now
+
+
+class RateLimiter:
+    """
+    Process-wide, thread-safe rate limiter combining a per-second token bucket and a per-minute sliding window. Every
+    caller reserves its slot under a lock and then sleeps outside of it, so concurrent calls are scheduled back to back
+    as fast as the limits allow.
+    """
+    def __init__(self, name, requests_per_second=None, requests_per_minute=None):
+        self.name = name
+        self._lock = Lock()
+        self._buckets = []
+        self._window = None
+        self._calls = 0
+        self._delayed_calls = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self.configure(requests_per_second, requests_per_minute)
+
+    def configure(self, requests_per_second=None, requests_per_minute=None):
+        buckets = []
+        window = None
+
+        if requests_per_second:
+            buckets.append(TokenBucket(requests_per_second, requests_per_second))
+
+        if requests_per_minute:
+            window = SlidingWindow(requests_per_minute, 60)
+
+        with self._lock:
+            self._buckets = buckets
+            self._window = window
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max([bucket.reserve(now) for bucket in self._buckets], default=0.0)
+
+            # The window records when the call actually starts, after any wait for the per-second bucket
+            if self._window is not None:
+                wait = self._window.reserve(now, wait)
+
+            self._calls += 1
+            if wait > 0:
+                self._delayed_calls += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+    def statistics(self):
+        with self._lock:
+            return {
+                'calls': self._calls,
+                'delayed_calls': self._delayed_calls,
+                'total_wait_seconds': round(self._total_wait, 3),
+                'average_wait_seconds': round(self._total_wait / self._calls, 3) if self._calls else 0.0,
+                'max_wait_seconds': round(self._max_wait, 3)
+            }
 
 
 class MTJikan(Jikan):
+    # Shared by every instance, so that the limits hold across all callers and worker threads
+    limiter = RateLimiter('Jikan', requests_per_second=2, requests_per_minute=30)
+
     def __init__(
             self,
             selected_base: Optional[str] = None,
             session: Optional[requests.Session] = None,
     ) -> None:
-        super(MTJikan, self).__init__(selected_base, session)
-        self.calls_second = 0
-        self.calls_minute = 0
-        self.last_api_call = datetime.now()
-
-    # Rate Limit: 2 requests/second
-    def _check_rate_seconds(self):
-        last_api_call_delta = (datetime.now() - self.last_api_call).total_seconds()
-
-        if self.calls_second > 2 and last_api_call_delta < 1:
-            time.sleep(1)
-        elif last_api_call_delta > 1:
-            self.calls_second = 0
-
-    # Rate Limit: 30 requests/minute
-    def _check_rate_minutes(self):
-        last_api_call_delta = (datetime.now() - self.last_api_call).total_seconds()
-
-        if self.calls_minute > 30 and last_api_call_delta < 60:
-            time.sleep(61 - last_api_call_delta)
-        elif last_api_call_delta > 60:
-            self.calls_minute = 0
+        super(MTJikan, self).__init__(selected_base, session if session is not None else HTTPSession.get())
 
     def search(
             self,
@@ -43,99 +217,136 @@ class MTJikan(Jikan):
             page: Optional[int] = None,
             parameters: Optional[Mapping[str, Optional[Union[int, str, float]]]] = None,
     ) -> Dict[str, Any]:
-        self._check_rate_seconds()
-        self._check_rate_minutes()
+        return ResponseCache.fetch('jikan_search', [search_type, query, page, parameters],
+                                   lambda: self._search(search_type, query, page, parameters))
 
-        self.calls_second += 1
-        self.calls_minute += 1
-        self.last_api_call = datetime.now()
+    def _search(self, search_type, query, page, parameters):
+        self.limiter.acquire()
         search_results = super(MTJikan, self).search(search_type, query, page, parameters)
-        self.session.close()
         return search_results
 
     def manga(
             self, id: int, extension: Optional[str] = None, page: Optional[int] = None
     ) -> Dict[str, Any]:
-        self._check_rate_seconds()
-        self._check_rate_minutes()
+        return ResponseCache.fetch('jikan_manga', [id, extension, page], lambda: self._manga(id, extension, page))
 
-        self.calls_second += 1
-        self.calls_minute += 1
-        self.last_api_call = datetime.now()
+    def _manga(self, id, extension, page):
+        self.limiter.acquire()
         search_results = super(MTJikan, self).manga(id, extension, page)
-        self.session.close()
         return search_results
 
 
 class AniList:
     _log = None
 
+    limiter = RateLimiter('AniList', requests_per_minute=90)
+
+    # Number of aliased Media queries sent in one request by search_by_mal_ids
+    batch_size = 10
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
 
     @classmethod
-    def _post(cls, query, variables, logging_info):
+    def _request(cls, query, variables, logging_info):
+        """
+        Returns the data of the GraphQL response. Raises ConnectionError if AniList cannot be reached and APIException
+        if it answers without data (rate limits, server errors, malformed responses), so the chapter is retried
+        instead of being treated as not found.
+        """
+        cls.limiter.acquire()
+
         try:
-            response = requests.post('https://graphql.anilist.co', json={'query': query, 'variables': variables})
-        except Exception as e:
-            cls._log.exception(e, extra=logging_info)
-            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
-                             extra=logging_info)
-            return None
+            response = HTTPSession.get().post('https://graphql.anilist.co',
+                                              json={'query': query, 'variables': variables})
+        except RequestException as e:
+            raise ConnectionError(f'AniList could not be reached: {e}') from e
 
         cls._log.debug(f'Query: {query}')
         cls._log.debug(f'Variables: {variables}')
-        cls._log.debug(f'Response JSON: {response.json()}')
 
-        return response.json()['data']['Media']
+        try:
+            response_json = response.json()
+        except ValueError:
+            response_json = None
 
-    @classmethod
-    def search_staff_by_mal_id(cls, mal_id, logging_info):
-        query = '''
-        query search_staff_by_mal_id ($mal_id: Int) {
-          Media (idMal: $mal_id, type: MANGA) {
-            siteUrl
-            staff {
-              edges {
-                node{
-                  name {
-                    first
-                    last
-                    full
-                    alternative
-                  }
-                  siteUrl
-                }
-                role
-              }
-            }
-          }
-        }
-        '''
+        cls._log.debug(f'Response JSON: {response_json}')
 
-        variables = {
-            'mal_id': mal_id
-        }
+        # AniList reports ids it does not have as errors alongside the data, so errors only fail the request when
+        # there is no data at all
+        data = response_json.get('data') if isinstance(response_json, dict) else None
+        if data is None:
+            errors = response_json.get('errors') if isinstance(response_json, dict) else None
+            raise APIException(response.status_code, {'errors': errors} if errors else None)
 
-        return cls._post(query, variables, logging_info)
+        return data
 
     @classmethod
-    def search_for_manga_title_by_mal_id(cls, mal_id, logging_info):
-        query = '''
-        query search_manga_by_mal_id ($mal_id: Int) {
-          Media (idMal: $mal_id, type: MANGA) {
-            title {
-              romaji
-              english
-              native
-            }
-          }
-        }
-        '''
+    def search_by_mal_ids(cls, mal_ids, logging_info):
+        """
+        Returns a dict of every MAL id to its AniList title, siteUrl and staff, or to None if AniList does not have it.
+        The ids missing from the response cache are fetched with one request per batch_size ids, using an aliased Media
+        query for each id.
+        """
+        media = {}
+        missing = []
 
-        variables = {
-            'mal_id': mal_id
-        }
+        for mal_id in dict.fromkeys(mal_ids):
+            details = ResponseCache.get('anilist', mal_id)
+            if details is not None:
+                media[mal_id] = details
+            else:
+                missing.append(mal_id)
 
-        return cls._post(query, variables, logging_info)
+        if missing and ResponseCache.cache_only:
+            raise ResponseNotCachedError('anilist', missing)
+
+        for start in range(0, len(missing), cls.batch_size):
+            batch = missing[start:start + cls.batch_size]
+            data = cls._request(cls._batch_query(len(batch)),
+                                {f'mal_id_{index}': mal_id for index, mal_id in enumerate(batch)}, logging_info)
+
+            for index, mal_id in enumerate(batch):
+                details = data.get(f'media_{index}')
+                media[mal_id] = details
+
+                if details is not None:
+                    ResponseCache.put('anilist', mal_id, details)
+
+        return media
+
+    @staticmethod
+    def _batch_query(count):
+        variables = ', '.join(f'$mal_id_{index}: Int' for index in range(count))
+        aliases = '\n'.join(f'          media_{index}: Media (idMal: $mal_id_{index}, type: MANGA) {{ ...details }}'
+                            for index in range(count))
+
+        return f'''
+        query search_by_mal_ids ({variables}) {{
+{aliases}
+        }}
+
+        fragment details on Media {{
+          title {{
+            romaji
+            english
+            native
+          }}
+          siteUrl
+          staff {{
+            edges {{
+              node{{
+                name {{
+                  first
+                  last
+                  full
+                  alternative
+                }}
+                siteUrl
+              }}
+              role
+            }}
+          }}
+        }}
+        '''
@@ -0,0 +1,159 @@
+"""Rewriting of CBZ archives without recompressing their pages"""
+import copy
+import errno
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+from zipfile import ZipFile, ZipInfo
+
+COMICINFO_FILENAME = 'ComicInfo.xml'
+
+# General purpose flag bit signalling that the sizes and CRC follow the data in a data descriptor instead of being in
+# the local file header
+_FLAG_DATA_DESCRIPTOR = 0x08
+
+# Extra field header id of the zip64 extended information, which FileHeader() adds back when it is needed
+_EXTRA_ZIP64 = 0x0001
+
+
+def has_comicinfo(archive: ZipFile, data: bytes) -> bool:
+    """
+    Returns True if the archive holds exactly one ComicInfo.xml and it is identical to data. The size and CRC from the
+    central directory rule out almost every mismatch before the entry itself is read.
+    """
+    entries = [info for info in archive.infolist() if info.filename == COMICINFO_FILENAME]
+
+    if len(entries) != 1:
+        return False
+
+    entry = entries[0]
+    return entry.file_size == len(data) and entry.CRC == zlib.crc32(data) and archive.read(entry) == data
+
+
+def write_comicinfo(cbz_path: Path, comicinfo_xml: str) -> bool:
+    """
+    Makes ComicInfo.xml in the archive at cbz_path equal to comicinfo_xml, replacing every existing ComicInfo.xml
+    entry. Returns False without touching the archive if it already holds the same ComicInfo.xml.
+    """
+    data = comicinfo_xml.encode('utf-8')
+
+    with ZipFile(cbz_path) as archive:
+        if has_comicinfo(archive, data):
+            return False
+
+    copy_with_comicinfo(cbz_path, cbz_path, data)
+    return True
+
+
+def copy_with_comicinfo(source_path: Path, destination_path: Path, data: bytes):
+    """
+    Writes a copy of the archive at source_path to destination_path with data as its only ComicInfo.xml. The other
+    members are copied as stored, without being decompressed. The copy is written to a temporary file in the
+    destination directory, flushed to disk and then renamed over destination_path, so that a crash never leaves a
+    partially written archive behind.
+    """
+    def write(source_file, temp_file):
+        with ZipFile(source_file) as source, ZipFile(temp_file, 'w') as destination:
+            for info in source.infolist():
+                if info.filename != COMICINFO_FILENAME:
+                    _copy_member(source_file, info, destination)
+
+            destination.writestr(COMICINFO_FILENAME, data)
+
+    _replace_atomically(source_path, destination_path, write)
+
+
+def move_chapter(source_path: Path, destination_path: Path, comicinfo_xml: str = None):
+    """
+    Moves the archive at source_path to destination_path. With comicinfo_xml, the archive is streamed to the
+    destination once with ComicInfo.xml already injected, instead of being moved and then rewritten in place. Without
+    it, the archive is renamed, or copied when the destination is on another filesystem. The source is only removed once
+    the copy is safely on disk.
+
+    Raises FileExistsError if destination_path already exists, on every platform, so that an existing chapter is never
+    overwritten by a move.
+    """
+    if Path(destination_path).exists():
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(destination_path))
+
+    if comicinfo_xml is not None:
+        copy_with_comicinfo(source_path, destination_path, comicinfo_xml.encode('utf-8'))
+    else:
+        try:
+            os.rename(source_path, destination_path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        _replace_atomically(source_path, destination_path, shutil.copyfileobj)
+
+    Path(source_path).unlink()
+
+
+def _replace_atomically(source_path, destination_path, write):
+    destination_path = Path(destination_path)
+    descriptor, temp_path = tempfile.mkstemp(prefix=f'.{destination_path.name}.', suffix='.tmp',
+                                             dir=destination_path.parent)
+
+    try:
+        with os.fdopen(descriptor, 'wb') as temp_file:
+            with open(source_path, 'rb') as source_file:
+                write(source_file, temp_file)
+
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        shutil.copymode(source_path, temp_path)
+        os.replace(temp_path, destination_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+    _fsync_directory(destination_path.parent)
+
+
+def _copy_member(source_file, info: ZipInfo, destination: ZipFile):
+    source_file.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, source_file.read(zipfile.sizeFileHeader))
+    source_file.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    # The sizes and CRC are known from the central directory, so they go into the new local header and the data
+    # descriptor of the original (if any) is left behind
+    member = copy.copy(info)
+    member.flag_bits &= ~_FLAG_DATA_DESCRIPTOR
+    member.extra = zipfile._strip_extra(member.extra, (_EXTRA_ZIP64,))
+    member.header_offset = destination.fp.tell()
+
+    destination.fp.write(member.FileHeader())
+    _copy_bytes(source_file, destination.fp, info.compress_size)
+
+    destination.filelist.append(member)
+    destination.NameToInfo[member.filename] = member
+    destination.start_dir = destination.fp.tell()
+    destination._didModify = True
+
+
+def _copy_bytes(source, destination, length, chunk_size=1024 * 1024):
+    while length > 0:
+        chunk = source.read(min(chunk_size, length))
+        if not chunk:
+            raise zipfile.BadZipFile('Archive member is truncated')
+        destination.write(chunk)
+        length -= len(chunk)
+
+
+def _fsync_directory(directory: Path):
+    # Directories cannot be opened for syncing on Windows, where the rename is already durable
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+
+    descriptor = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
@@ -0,0 +1,153 @@
+"""In-process caches shared by Manga Tagger's worker threads"""
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe least-recently-used cache that keeps hit and miss counters.
+
+    Attributes:
+        max_size - Maximum number of entries held; a size of 0 disables the cache
+        ttl - Seconds an entry stays valid after it is put, or None for entries to never expire
+    """
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_values(self, predicate):
+        """
+        Removes every entry whose value satisfies predicate.
+        """
+        with self._lock:
+            for key in [key for key, (value, _) in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def configure(self, max_size, ttl=None):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+
+            while len(self._entries) > max(max_size, 0):
+                self._entries.popitem(last=False)
+
+    def resize(self, max_size):
+        self.configure(max_size, self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def statistics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+
+class BloomFilter:
+    """
+    Set membership test with no false negatives: a key that was added is always reported as present, while a key that
+    was not is reported as absent except for a false positive rate of about error_rate, as long as no more than
+    capacity keys are added.
+
+    Attributes:
+        capacity - Number of keys the filter is sized for
+        error_rate - False positive rate at capacity
+    """
+    def __init__(self, capacity=100000, error_rate=.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(round(self.size / self.capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _positions(self, key):
+        # Double hashing derives every position from the two halves of a single digest
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        with self._lock:
+            for position in self._positions(key):
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self._count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def clear(self):
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self._count = 0
+
+    def statistics(self):
+        return {
+            'keys': self._count,
+            'capacity': self.capacity,
+            'size_bytes': len(self._bits),
+            'hash_count': self.hash_count,
+            'expected_error_rate': (1 - math.exp(-self.hash_count * self._count / self.size)) ** self.hash_count
+        }
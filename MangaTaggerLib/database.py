@@ -1,12 +1,151 @@
 import logging
 import sys
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from queue import Queue
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
 
 from bson.errors import InvalidDocument
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
+from pymongo import MongoClient, ASCENDING, DeleteOne, InsertOne, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError, DuplicateKeyError
+
+from MangaTaggerLib.archive import move_chapter
+from MangaTaggerLib.cache import BloomFilter, LRUCache
+from MangaTaggerLib.similarity import TrigramIndex, same_title
+
+
+class BulkWriter:
+    """
+    Buffers write operations for a collection and sends them in bulk_write calls from a background thread, once
+    max_batch_size operations are pending or every flush_interval seconds.
+
+    Ordered writers keep the order operations were added in, including across batches, so a later operation on a
+    document always lands after an earlier one; an operation that fails is logged and skipped, and the rest of its
+    batch is still written. Every operation is numbered when it is added, and on_written (if given) is called with the
+    number of the last operation of every batch once the batch has been sent.
+    """
+    def __init__(self, name, collection, max_batch_size=500, flush_interval=.5, ordered=True, on_written=None):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.name = name
+        self.max_batch_size = max(max_batch_size, 1)
+        self.flush_interval = flush_interval
+        self.ordered = ordered
+
+        self._collection = collection
+        self._on_written = on_written
+        self._operations = []
+        self._sequence = 0
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name=f'MTT-{name}-Writer', daemon=True)
+
+        self._batches = 0
+        self._written = 0
+        self._errors = 0
+        self._max_pending = 0
+        self._flush_seconds = 0.0
+        self._max_flush_seconds = 0.0
+
+    def __len__(self):
+        return len(self._operations)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+        if self._thread.is_alive():
+            self._thread.join()
+
+        self.flush()
+
+    def write(self, operation) -> int:
+        """
+        Buffers the operation and returns its number.
+        """
+        with self._lock:
+            self._sequence += 1
+            self._operations.append((self._sequence, operation))
+            self._max_pending = max(self._max_pending, len(self._operations))
+            full = len(self._operations) >= self.max_batch_size
+            sequence = self._sequence
+
+        if full:
+            self._wake.set()
+
+        return sequence
+
+    def flush(self):
+        """
+        Writes every pending operation before returning.
+        """
+        # Holding the write lock while taking the pending operations keeps batches from overtaking each other
+        with self._write_lock:
+            with self._lock:
+                operations = self._operations
+                self._operations = []
+
+            for start in range(0, len(operations), self.max_batch_size):
+                batch = operations[start:start + self.max_batch_size]
+                self._bulk_write([operation for _, operation in batch])
+
+                if self._on_written is not None:
+                    self._on_written(batch[-1][0])
+
+    def _bulk_write(self, operations):
+        started = time.perf_counter()
+
+        while operations:
+            try:
+                self._collection.bulk_write(operations, ordered=self.ordered)
+                self._written += len(operations)
+                operations = []
+            except BulkWriteError as bwe:
+                errors = bwe.details['writeErrors']
+                self._errors += len(errors)
+                self._log.exception(bwe)
+                self._log.warning(f'{len(errors)} of {len(operations)} operations on "{self.name}" failed and were '
+                                  f'skipped.')
+
+                if self.ordered:
+                    # An ordered bulk write stops at the first error; everything before it was written
+                    self._written += errors[0]['index']
+                    operations = operations[errors[0]['index'] + 1:]
+                else:
+                    self._written += len(operations) - len(errors)
+                    operations = []
+            except Exception as e:
+                self._errors += len(operations)
+                self._log.exception(e)
+                self._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.')
+                operations = []
+
+        elapsed = time.perf_counter() - started
+        self._batches += 1
+        self._flush_seconds += elapsed
+        self._max_flush_seconds = max(self._max_flush_seconds, elapsed)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def statistics(self):
+        return {
+            'pending': len(self._operations),
+            'max_pending': self._max_pending,
+            'written': self._written,
+            'batches': self._batches,
+            'errors': self._errors,
+            'average_flush_ms': round(self._flush_seconds / self._batches * 1000, 1) if self._batches else 0.0,
+            'max_flush_ms': round(self._max_flush_seconds * 1000, 1)
+        }
 
 
 class Database:
@@ -18,6 +157,10 @@ class Database:
     auth_source = None
     server_selection_timeout_ms = None
 
+    # Batching of the write-behind buffers of manga_metadata and processed_files
+    write_behind_batch_size = 100
+    write_behind_flush_interval = 1
+
     _client = None
     _database = None
     _log = None
@@ -54,18 +197,47 @@ class Database:
         MetadataTable.initialize()
         ProcFilesTable.initialize()
         ProcSeriesTable.initialize()
+        UnresolvedSeriesTable.initialize()
+        SeriesAliasTable.initialize()
         TaskQueueTable.initialize()
+        DownloadManifestTable.initialize()
+
+        cls._create_indexes()
 
         cls._log.info('Database connection established!')
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @classmethod
+    def _create_indexes(cls):
+        cls._log.info('Ensuring database indexes exist...')
+
+        try:
+            MetadataTable.create_indexes()
+            ProcFilesTable.create_indexes()
+            UnresolvedSeriesTable.create_indexes()
+            TaskQueueTable.create_indexes()
+        except Exception as e:
+            cls._log.exception(e)
+            cls._log.warning('Unable to create database indexes; lookups will fall back to collection scans.')
+
     @classmethod
     def load_database_tables(cls):
+        MetadataTable.load()
+        ProcFilesTable.load()
         ProcSeriesTable.load()
+        UnresolvedSeriesTable.load()
+        SeriesAliasTable.load()
 
     @classmethod
-    def save_database_tables(cls):
-        ProcSeriesTable.save()
+    def flush_buffered_writes(cls):
+        """
+        Stops the write-behind buffers, writing every pending record.
+        """
+        for table in (MetadataTable, ProcFilesTable):
+            if table._writer is not None:
+                table._log.info(f'Flushing {len(table._writer)} buffered writes...')
+                table._writer.stop()
+                table._log.info(f'{table._writer.name} writer statistics: {table._writer.statistics()}')
 
     @classmethod
     def close_connection(cls):
@@ -81,6 +253,8 @@ class Database:
         cls._log.debug(f'Password: {Database.password}')
         cls._log.debug(f'Authentication Source: {Database.auth_source}')
         cls._log.debug(f'Server Selection Timeout (ms): {Database.server_selection_timeout_ms}')
+        cls._log.debug(f'Write-Behind Batch Size: {Database.write_behind_batch_size}')
+        cls._log.debug(f'Write-Behind Flush Interval: {Database.write_behind_flush_interval}')
 
     @classmethod
     def insert(cls, data, logging_info=None):
@@ -128,56 +302,301 @@ class Database:
 
         cls._log.info('Deletion was successful!', extra=logging_info)
 
+    @classmethod
+    def _start_writer(cls, ordered):
+        """
+        Starts the write-behind buffer of the table. Batches are journaled before they count as written, so a record
+        that has left the buffer survives a crash.
+        """
+        cls._pending = {}
+        cls._writer = BulkWriter(cls._database.name,
+                                 cls._database.with_options(write_concern=WriteConcern(j=True)),
+                                 cls.write_behind_batch_size,
+                                 cls.write_behind_flush_interval,
+                                 ordered,
+                                 cls._written)
+        cls._writer.start()
+
+    @classmethod
+    def _buffer(cls, key, record, operation):
+        """
+        Queues the operation and keeps record, the document as it will be once written, readable under key until then.
+        """
+        with cls._pending_lock:
+            cls._pending[key] = (cls._writer.write(operation), record)
+
+    @classmethod
+    def _pending_records(cls):
+        """
+        Returns the records not yet written. Records only leave the buffer once their batch has been written, so reads
+        that merge the buffer with a query take this snapshot before running the query.
+        """
+        with cls._pending_lock:
+            return [record for _, record in cls._pending.values()]
+
+    @classmethod
+    def _written(cls, sequence):
+        with cls._pending_lock:
+            cls._pending = {key: pending for key, pending in cls._pending.items() if pending[0] > sequence}
+
 
 class MetadataTable(Database):
+    """
+    Metadata of every resolved series. Records are written behind through a BulkWriter; until a record has been
+    written, lookups read it from the buffer.
+    """
+    title_index = TrigramIndex()
+
+    # Metadata models of recently resolved series, keyed by directory name
+    cache = LRUCache(256, 3600)
+
+    # Keys searched by lookup(), in order of priority
+    lookup_keys = ('search_value', 'series_title', 'series_title_eng')
+
+    # Fields required to construct a Metadata model from a record
+    projection = ('series_title', 'series_title_eng', 'series_title_jap', 'status', 'type', 'description', 'mal_url',
+                  'anilist_url', 'publish_date', 'genres', 'staff', 'serializations', 'scrape_date')
+
+    # Records not yet written, keyed by _id, with the number of their write
+    _pending = {}
+    _pending_lock = Lock()
+    _writer: BulkWriter = None
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['manga_metadata']
+
+        # Records are independent of one another, so a duplicate does not need to hold up the rest of its batch
+        cls._start_writer(ordered=False)
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
-    def search_by_search_value(cls, manga_title):
-        cls._log.debug(f'Searching manga_metadata cls by key "search_value" using value "{manga_title}"')
-        return cls._database.find_one({
-            'search_value': manga_title
-        })
+    def load(cls):
+        cls._log.info('Loading manga_metadata title index...')
+        cls.title_index.clear()
+
+        for result in cls._database.find({}, {'search_value': 1, 'series_title': 1, 'series_title_eng': 1}):
+            cls._index_titles(result)
+
+        cls._log.info(f'Indexed titles for {len(cls.title_index)} series')
 
     @classmethod
-    def search_by_series_title_eng(cls, manga_title):
-        cls._log.debug(
-            f'Searching manga_metadata cls by key "series_title_eng" using value "{manga_title}"')
-        return cls._database.find_one({
-            'series_title_eng': manga_title
-        })
+    def create_indexes(cls):
+        for key in cls.lookup_keys:
+            cls._database.create_index([(key, ASCENDING)])
+
+    @classmethod
+    def _index_titles(cls, record):
+        cls.title_index.add(record['_id'], (record.get('search_value'),
+                                            record.get('series_title'),
+                                            record.get('series_title_eng')))
+
+    @classmethod
+    def insert(cls, data, logging_info=None):
+        # The writer thread adds to the documents it writes, so it is given a copy of its own
+        record = dict(data if type(data) is dict else data.__dict__)
+
+        # Cached models of this series are stale once a newer record has been written
+        cls.cache.discard(record.get('search_value'))
+        cls.cache.discard_values(lambda metadata: metadata._id == record.get('_id'))
+
+        cls._log.info('Buffering record for insertion into the database...', extra=logging_info)
+        cls._buffer(record.get('_id'), record, InsertOne(dict(record)))
+        cls._index_titles(record)
 
     @classmethod
-    def search_by_series_title(cls, manga_title):
-        cls._log.debug(f'Searching manga_metadata cls by key "series_title" using value "{manga_title}"')
+    def lookup(cls, manga_title):
+        """
+        Searches by search_value, series_title and series_title_eng in a single query, returning the record matched by
+        the highest priority key.
+        """
+        # Records still in the buffer are taken before the query, as a record written in between would be in neither;
+        # they come first, as they are newer than anything written
+        results = [record for record in cls._pending_records()
+                   if any(record.get(key) == manga_title for key in cls.lookup_keys)]
+
+        cls._log.debug(f'Searching manga_metadata by keys {cls.lookup_keys} using value "{manga_title}"')
+        results += cls._database.find({
+            '$or': [{key: manga_title} for key in cls.lookup_keys]
+        }, dict.fromkeys(cls.lookup_keys + cls.projection, 1))
+
+        for key in cls.lookup_keys:
+            for result in results:
+                if result.get(key) == manga_title:
+                    return result
+
+        return None
+
+    @classmethod
+    def search_by_id(cls, mal_id):
+        cls._log.debug(f'Searching manga_metadata cls by key "_id" using value "{mal_id}"')
+        with cls._pending_lock:
+            if mal_id in cls._pending:
+                return cls._pending[mal_id][1]
+
         return cls._database.find_one({
-            'series_title': manga_title
+            '_id': mal_id
         })
 
+    @classmethod
+    def search_by_similar_title(cls, manga_title, min_score=.95):
+        """
+        Returns the record of a series with a title that is the same as manga_title up to case, punctuation and small
+        spelling differences, or None. The titles found in the title index are only candidates; one is accepted only
+        if same_title() confirms it, so a sequel is not matched to the series before it.
+        """
+        cls._log.debug(f'Searching manga_metadata title index for titles similar to "{manga_title}"')
+        candidates = cls.title_index.search(manga_title)
+        cls._log.debug(f'Title index candidates: {candidates}')
+
+        for score, key in candidates:
+            if score < min_score:
+                break
+
+            with cls._pending_lock:
+                record = cls._pending[key][1] if key in cls._pending else None
+
+            if record is None:
+                record = cls._database.find_one({
+                    '_id': key
+                })
+
+            if record is not None and any(same_title(manga_title, record.get(title_key), min_score)
+                                          for title_key in cls.lookup_keys if record.get(title_key)):
+                return record
+
+        return None
+
 
 class ProcFilesTable(Database):
+    """
+    Every processed chapter, keyed by series title and chapter number. Records are written behind through a
+    BulkWriter, in order, so an update always lands after the insert it updates.
+
+    Searches are answered from memory. A Bloom filter of every (series title, chapter number) rules out chapters that
+    were never processed without a query, and the chapters of a series are loaded in a single query the first time
+    the series is searched, into an index of chapter number to (old filename, new filename). Both are updated as
+    records are written, so they never lag behind the buffer.
+    """
+    # Lower bound on the number of chapters the Bloom filter is sized for
+    bloom_filter_capacity = 100000
+    bloom_filter_error_rate = .01
+    chapter_filter: BloomFilter = None
+
+    # Chapter number to (old filename, new filename), keyed by series title
+    series_index = LRUCache(256)
+
+    # Records not yet written, keyed by (series_title, chapter_number), with the number of their latest write
+    _pending = {}
+    _pending_lock = Lock()
+    _writer: BulkWriter = None
+
+    # Held while the index of a series is loaded or changed, so that a chapter processed during a load is not lost
+    _index_lock = Lock()
+    _filtered_searches = 0
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['processed_files']
+        cls._start_writer(ordered=True)
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @classmethod
+    def create_indexes(cls):
+        cls._database.create_index([('series_title', ASCENDING), ('chapter_number', ASCENDING)])
+
+    @classmethod
+    def load(cls):
+        cls._log.info('Loading processed_files chapter filter...')
+        pending = cls._pending_records()
+        results = list(cls._database.find({}, {'_id': 0, 'series_title': 1, 'chapter_number': 1}))
+
+        # Sized for twice the chapters processed so far, so the error rate holds while the library grows
+        chapter_filter = BloomFilter(max(cls.bloom_filter_capacity, 2 * len(results)), cls.bloom_filter_error_rate)
+        for result in results + pending:
+            chapter_filter.add((result['series_title'], result['chapter_number']))
+
+        cls.chapter_filter = chapter_filter
+        cls.series_index.clear()
+        cls._log.info(f'Added {len(chapter_filter)} processed chapters to the chapter filter')
+
     @classmethod
     def search(cls, manga_title, chapter_number):
         cls._log.debug(f'Searching processed_files cls by keys "series_title" and "chapter_number" '
                        f'using values "{manga_title}" and {chapter_number}')
-        return cls._database.find_one({
+        if cls.chapter_filter is not None and (manga_title, chapter_number) not in cls.chapter_filter:
+            cls._filtered_searches += 1
+            return None
+
+        filenames = cls._series_chapters(manga_title).get(chapter_number)
+        if filenames is None:
+            return None
+
+        return {
             'series_title': manga_title,
-            'chapter_number': chapter_number
-        })
+            'chapter_number': chapter_number,
+            'old_filename': filenames[0],
+            'new_filename': filenames[1]
+        }
+
+    @classmethod
+    def _series_chapters(cls, manga_title):
+        chapters = cls.series_index.get(manga_title)
+        if chapters is not None:
+            return chapters
+
+        with cls._index_lock:
+            # Another thread may have loaded the series while this one waited
+            if manga_title in cls.series_index:
+                return cls.series_index.get(manga_title)
+
+            # Buffered records are taken before the query, as a record written in between would be in neither;
+            # they are newer than the written records and replace them
+            pending = [record for record in cls._pending_records() if record['series_title'] == manga_title]
+
+            cls._log.debug(f'Loading processed_files cls by key "series_title" using value "{manga_title}"')
+            results = list(cls._database.find({
+                'series_title': manga_title
+            }, {'_id': 0, 'chapter_number': 1, 'old_filename': 1, 'new_filename': 1}))
+
+            chapters = {result['chapter_number']: (result['old_filename'], result['new_filename'])
+                        for result in results + pending}
+            cls.series_index.put(manga_title, chapters)
+            return chapters
+
+    @classmethod
+    def _index_chapter(cls, record):
+        with cls._index_lock:
+            if cls.chapter_filter is not None:
+                cls.chapter_filter.add((record['series_title'], record['chapter_number']))
+
+            if record['series_title'] in cls.series_index:
+                cls.series_index.get(record['series_title'])[record['chapter_number']] = (record['old_filename'],
+                                                                                          record['new_filename'])
+
+    @classmethod
+    def statistics(cls):
+        return {
+            'filtered_searches': cls._filtered_searches,
+            'chapter_filter': cls.chapter_filter.statistics() if cls.chapter_filter is not None else None,
+            'series_index': cls.series_index.statistics()
+        }
+
+    @classmethod
+    def processed_filenames(cls):
+        """
+        Returns the (series title, original filename) of every processed chapter.
+        """
+        pending = cls._pending_records()
+        results = list(cls._database.find({}, {'_id': 0, 'series_title': 1, 'old_filename': 1}))
+        return {(result['series_title'], result['old_filename']) for result in results + pending}
 
     @classmethod
-    def insert_record_and_rename(cls, old_file_path: Path, new_file_path: Path, manga_title, chapter, logging_info):
-        old_file_path.rename(new_file_path)
+    def insert_record_and_rename(cls, old_file_path: Path, new_file_path: Path, manga_title, chapter, logging_info,
+                                 comicinfo_xml=None):
+        move_chapter(old_file_path, new_file_path, comicinfo_xml)
         cls._log.info(f'"{new_file_path.name.strip(".cbz")}" has been renamed.', extra=logging_info)
 
         record = {
@@ -191,11 +610,14 @@ class ProcFilesTable(Database):
         cls._log.debug(f'Record: {record}')
 
         logging_info['inserted_processed_record'] = record
-        cls._database.insert(record, logging_info)
+        cls._buffer((manga_title, chapter), record, InsertOne(dict(record)))
+        cls._index_chapter(record)
+        return record
 
     @classmethod
-    def update_record_and_rename(cls, results, old_file_path: Path, new_file_path: Path, logging_info):
-        old_file_path.rename(new_file_path)
+    def update_record_and_rename(cls, results, old_file_path: Path, new_file_path: Path, logging_info,
+                                 comicinfo_xml=None):
+        move_chapter(old_file_path, new_file_path, comicinfo_xml)
         cls._log.info(f'"{new_file_path.name.strip(".cbz")}" has been renamed.', extra=logging_info)
 
         record = {
@@ -207,55 +629,275 @@ class ProcFilesTable(Database):
         cls._log.debug(f'Record: {record}')
 
         logging_info['updated_processed_record'] = record
-        cls._database.update(results, record, logging_info)
+        key = (results['series_title'], results['chapter_number'])
+        updated_record = {**results, **record['$set']}
+        cls._buffer(key, updated_record, UpdateOne({'series_title': key[0], 'chapter_number': key[1]}, record))
+        cls._index_chapter(updated_record)
 
 
 class ProcSeriesTable(Database):
+    """
+    Series that have been resolved, stored as one document per series keyed by the series title, so that recording a
+    series is a single upsert and never rewrites the others.
+    """
     processed_series = set()
 
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['processed_series']
-        cls._id = None
-        cls._last_save_time = None
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
-    def save(cls):
-        cls._log.info('Saving processed series...')
-        cls._database.delete_one({
-            '_id': cls._id
-        })
-        super(ProcSeriesTable, cls).insert(dict.fromkeys(cls.processed_series, True))
+    def add(cls, manga_title, logging_info=None):
+        if manga_title in cls.processed_series:
+            return
+
+        cls.processed_series.add(manga_title)
+
+        try:
+            cls._database.update_one({'_id': manga_title}, {'$setOnInsert': cls._record()}, upsert=True)
+        except Exception as e:
+            cls._log.exception(e, extra=logging_info)
+            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                             extra=logging_info)
 
     @classmethod
     def load(cls):
         cls._log.info('Loading processed series...')
-        results = cls._database.find_one()
-        if results is not None:
-            cls._id = results.pop('_id')
-            cls.processed_series = set(results.keys())
+        cls._migrate_legacy_documents()
+        cls.processed_series = {result['_id'] for result in cls._database.find({}, {'_id': 1})}
+
+    @classmethod
+    def _migrate_legacy_documents(cls):
+        # Older versions kept every processed series as a key of a single document with a generated ObjectId
+        for document in cls._database.find({'_id': {'$type': 'objectId'}}):
+            titles = [key for key in document.keys() if key != '_id']
+            cls._log.info(f'Migrating {len(titles)} processed series to one document per series...')
+
+            if titles:
+                record = cls._record()
+                cls._database.bulk_write([UpdateOne({'_id': title}, {'$setOnInsert': record}, upsert=True)
+                                          for title in titles], ordered=False)
+
+            cls._database.delete_one({'_id': document['_id']})
+
+    @staticmethod
+    def _record():
+        return {
+            'process_date': datetime.now().date().strftime('%Y-%m-%d @ %I:%M:%S %p')
+        }
+
+
+class UnresolvedSeriesTable(Database):
+    """
+    Series that could not be matched on MyAnimeList, keyed by directory name, so that their chapters skip the database
+    and API searches until ttl seconds have passed. Expired documents are removed by a TTL index on expires_at, and
+    are ignored in memory once expired.
+    """
+    ttl = 604800
+
+    # Expiry of every unresolved series as a POSIX timestamp, keyed by directory name
+    unresolved_series = {}
+    _lock = Lock()
+
+    @classmethod
+    def initialize(cls):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        cls._database = super()._database['unresolved_series']
+        cls._log.debug(f'{cls.__name__} class has been initialized')
+
+    @classmethod
+    def create_indexes(cls):
+        cls._database.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+
+    @classmethod
+    def load(cls):
+        cls._log.info('Loading unresolved series...')
+        results = cls._database.find({'expires_at': {'$gt': datetime.now(timezone.utc)}}, {'expires_at': 1})
+
+        with cls._lock:
+            cls.unresolved_series = {result['_id']: cls._timestamp(result['expires_at']) for result in results}
+
+        cls._log.info(f'Loaded {len(cls.unresolved_series)} unresolved series')
 
     @classmethod
-    def save_while_running(cls):
-        if cls._last_save_time is not None:
-            last_save_delta = (datetime.now() - cls._last_save_time).total_seconds()
+    def is_unresolved(cls, manga_title):
+        expires_at = cls.unresolved_series.get(manga_title)
+
+        if expires_at is None:
+            return False
+
+        if expires_at <= time.time():
+            with cls._lock:
+                cls.unresolved_series.pop(manga_title, None)
+            return False
+
+        return True
+
+    @classmethod
+    def add(cls, manga_title, reason, logging_info=None, persist=True):
+        if cls.ttl <= 0:
+            return
 
-            # Save every hour
-            if last_save_delta > 3600:
-                cls._last_save_time = datetime.now()
-                cls.save()
+        failed_at = datetime.now(timezone.utc)
+        expires_at = failed_at + timedelta(seconds=cls.ttl)
+
+        with cls._lock:
+            cls.unresolved_series[manga_title] = expires_at.timestamp()
+
+        cls._log.info(f'"{manga_title}" will not be searched for again until {expires_at:%Y-%m-%d @ %I:%M:%S %p} '
+                      f'UTC.', extra=logging_info)
+
+        if not persist:
+            return
+
+        try:
+            cls._database.update_one({'_id': manga_title}, {'$set': {
+                'reason': reason,
+                'failed_at': failed_at,
+                'expires_at': expires_at
+            }}, upsert=True)
+        except Exception as e:
+            cls._log.exception(e, extra=logging_info)
+            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                             extra=logging_info)
+
+    @classmethod
+    def remove(cls, manga_titles=None):
+        """
+        Removes the given series, or every series if none are given, and returns the number of documents removed.
+        """
+        if manga_titles:
+            result = cls._database.delete_many({'_id': {'$in': list(manga_titles)}})
+        else:
+            result = cls._database.delete_many({})
+
+        with cls._lock:
+            if manga_titles:
+                for manga_title in manga_titles:
+                    cls.unresolved_series.pop(manga_title, None)
+            else:
+                cls.unresolved_series = {}
+
+        return result.deleted_count
+
+    @classmethod
+    def find_all(cls):
+        return list(cls._database.find({'expires_at': {'$gt': datetime.now(timezone.utc)}}).sort('_id', ASCENDING))
+
+    @staticmethod
+    def _timestamp(value: datetime):
+        # Dates are returned by pymongo as naive datetimes in UTC
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+
+class SeriesAliasTable(Database):
+    """
+    MyAnimeList ID of every directory name that has been resolved, or seeded by hand, keyed by directory name. The
+    whole table is held in memory, so a known directory resolves to its series without searching by title.
+    """
+    # MAL ID keyed by directory name
+    aliases = {}
+    _lock = Lock()
+
+    @classmethod
+    def initialize(cls):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        cls._database = super()._database['series_aliases']
+        cls._log.debug(f'{cls.__name__} class has been initialized')
+
+    @classmethod
+    def load(cls):
+        cls._log.info('Loading series aliases...')
+        aliases = {result['_id']: result['mal_id'] for result in cls._database.find({}, {'mal_id': 1})}
+
+        with cls._lock:
+            cls.aliases = aliases
+
+        cls._log.info(f'Loaded {len(aliases)} series aliases')
+
+    @classmethod
+    def lookup(cls, manga_title):
+        return cls.aliases.get(manga_title)
+
+    @classmethod
+    def add(cls, manga_title, mal_id, logging_info=None, persist=True):
+        if cls.aliases.get(manga_title) == mal_id:
+            return
+
+        with cls._lock:
+            cls.aliases[manga_title] = mal_id
+
+        cls._log.info(f'Recorded "{manga_title}" as an alias of MAL ID "{mal_id}"', extra=logging_info)
+
+        if not persist:
+            return
+
+        try:
+            cls._database.update_one({'_id': manga_title}, {'$set': cls._record(mal_id, 'resolved')}, upsert=True)
+        except Exception as e:
+            cls._log.exception(e, extra=logging_info)
+            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                             extra=logging_info)
+
+    @classmethod
+    def seed(cls, aliases: dict):
+        """
+        Records every directory name in aliases as an alias of its MAL ID, replacing existing aliases, and returns the
+        number of directory names that had no alias before.
+        """
+        if not aliases:
+            return 0
+
+        result = cls._database.bulk_write([UpdateOne({'_id': manga_title}, {'$set': cls._record(mal_id, 'seeded')},
+                                                     upsert=True)
+                                           for manga_title, mal_id in aliases.items()], ordered=False)
+
+        with cls._lock:
+            cls.aliases.update(aliases)
+
+        return result.upserted_count
+
+    @staticmethod
+    def _record(mal_id, source):
+        return {
+            'mal_id': mal_id,
+            'source': source,
+            'alias_date': datetime.now().strftime('%Y-%m-%d @ %I:%M:%S %p')
+        }
 
 
 class TaskQueueTable(Database):
+    """
+    Pending events of the task queue. In durable mode every event is upserted as soon as it is queued and deleted once
+    it has been processed, through a BulkWriter, so the queue survives a crash as it was. Otherwise the queue is only
+    saved at shutdown.
+    """
+    durable = False
+    max_batch_size = 500
+    flush_interval = .5
+
+    _writer: BulkWriter = None
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['task_queue']
         cls.queue = Queue()
+
+        if cls.durable:
+            cls._writer = BulkWriter('task_queue', cls._database, cls.max_batch_size, cls.flush_interval)
+            cls._writer.start()
+
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @classmethod
+    def create_indexes(cls):
+        cls._database.create_index([('manga_chapter', ASCENDING)])
+
     @classmethod
     def load(cls, task_list: dict):
         cls._log.info('Loading task queue...')
@@ -263,16 +905,93 @@ class TaskQueueTable(Database):
 
         if results is not None:
             for result in results:
-                task_list[result['manga_chapter']] = result
+                task_list[result['_id']] = result
+
+    @classmethod
+    def enqueue(cls, event):
+        if cls._writer is not None:
+            cls._writer.write(UpdateOne({'_id': event.id}, {'$set': event.dictionary()}, upsert=True))
+
+    @classmethod
+    def acknowledge(cls, event):
+        if cls._writer is not None:
+            cls._writer.write(DeleteOne({'_id': event.id}))
+
+    @classmethod
+    def flush(cls):
+        if cls._writer is not None:
+            cls._writer.flush()
+
+    @classmethod
+    def close(cls):
+        if cls._writer is not None:
+            cls._writer.stop()
+            cls._log.info(f'Task queue writer statistics: {cls._writer.statistics()}')
 
     @classmethod
     def save(cls, queue):
         if not queue.empty():
             cls._log.info('Saving task queue...')
-            while not queue.empty():
-                event = queue.get()
+
+        # Worker threads may still take events off the queue, so it is drained without blocking
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Empty:
+                break
+
+            # Series batching queues hand out lists of events
+            for event in item if isinstance(item, list) else [item]:
+                super(TaskQueueTable, cls).insert(event.dictionary())
+                queue.task_done()
+
+    @classmethod
+    def save_events(cls, events):
+        if events:
+            cls._log.info('Saving events pending download completion...')
+            for event in events:
                 super(TaskQueueTable, cls).insert(event.dictionary())
 
+    @classmethod
+    def saved_paths(cls):
+        """
+        Returns the paths of every event saved in the task queue.
+        """
+        results = cls._database.find({}, {'_id': 0, 'src_path': 1, 'dest_path': 1})
+        return {path for result in results for path in (result['src_path'], result.get('dest_path')) if path}
+
     @classmethod
     def delete_all(cls):
         super(TaskQueueTable, cls).delete_all(None)
+
+
+class DownloadManifestTable(Database):
+    """
+    Modification times of the series directories in the download directory at the last clean shutdown, keyed by
+    directory name. Unless the task queue is durable, the manifest is deleted once loaded, so after a crash the next
+    start scans every directory.
+    """
+    @classmethod
+    def initialize(cls):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        cls._database = super()._database['download_manifest']
+        cls._log.debug(f'{cls.__name__} class has been initialized')
+
+    @classmethod
+    def load(cls):
+        cls._log.info('Loading download directory manifest...')
+        manifest = {result['_id']: result['mtime'] for result in cls._database.find()}
+
+        # A durable task queue keeps every chapter queued since the manifest was saved, even across a crash
+        if not TaskQueueTable.durable:
+            super(DownloadManifestTable, cls).delete_all(None)
+
+        return manifest
+
+    @classmethod
+    def save(cls, manifest):
+        cls._log.info('Saving download directory manifest...')
+        super(DownloadManifestTable, cls).delete_all(None)
+
+        if manifest:
+            cls._database.insert_many([{'_id': directory, 'mtime': mtime} for directory, mtime in manifest.items()])
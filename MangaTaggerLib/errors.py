@@ -60,4 +60,17 @@ class FileUpdateNotRequiredError(FileExistsError):
 class MangaMatchedException(Exception):
     """
     Exception raised to bypass try...except when comparing manga titles.
-    """
\ No newline at end of file
+    """
+
+
+class ResponseNotCachedError(Exception):
+    """
+    Exception raised when the API response cache is in cache-only mode and does not hold the requested response.
+
+    Attributes:
+        endpoint - Name of the cached endpoint
+        parameters - Parameters of the request
+    """
+    def __init__(self, endpoint, parameters):
+        super().__init__(f'No cached "{endpoint}" response for {parameters} and the API response cache is in '
+                         f'cache-only mode; skipping')
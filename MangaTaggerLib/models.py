@@ -3,7 +3,7 @@ from datetime import datetime
 from pytz import timezone
 
 from MangaTaggerLib.errors import MetadataNotCompleteError
-from MangaTaggerLib.utils import AppSettings, compare
+from MangaTaggerLib.utils import AppSettings, compare_many
 
 
 class Metadata:
@@ -117,8 +117,8 @@ class Metadata:
                     names_to_compare.append(name)
 
             for j_staff in jikan_staff:
-                for a_name in names_to_compare:
-                    if compare(a_name, j_staff['name']) > .7:
+                for a_name, value in zip(names_to_compare, compare_many(j_staff['name'], names_to_compare)):
+                    if value > .7:
                         Metadata._log.debug(f'Staff Member (MyAnimeList): {j_staff}')
 
                         role = a_staff['role'].lower()
@@ -0,0 +1,158 @@
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+
+from MangaTaggerLib.errors import ResponseNotCachedError
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of API responses, keyed by endpoint and request parameters, so that repeated lookups
+    survive restarts and do not count against the API rate limits.
+    """
+    enabled = True
+    path = Path('cache', 'api_responses.sqlite')
+    max_entries = 10000
+    cache_only = False
+    ttl = {
+        'jikan_search': 86400,
+        'jikan_manga': 604800,
+        'anilist': 604800
+    }
+    default_ttl = 86400
+
+    hits = 0
+    misses = 0
+
+    _connection: sqlite3.Connection = None
+    _lock = Lock()
+    _log = None
+    _puts_since_eviction = 0
+
+    @classmethod
+    def initialize(cls):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+
+        if not cls.enabled:
+            cls._log.info('API response cache is disabled')
+            return
+
+        Path(cls.path).parent.mkdir(parents=True, exist_ok=True)
+
+        with cls._lock:
+            cls._connection = sqlite3.connect(str(cls.path), check_same_thread=False, isolation_level=None)
+            cls._connection.execute('PRAGMA journal_mode=WAL')
+            cls._connection.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            cls._connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+
+        cls._log.debug(f'{cls.__name__} class has been initialized')
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._connection is not None:
+                cls._log.info(f'API response cache statistics: {cls.statistics()}')
+                cls._connection.close()
+                cls._connection = None
+
+    @staticmethod
+    def _key(endpoint, parameters):
+        return f'{endpoint}:{json.dumps(parameters, sort_keys=True, default=str)}'
+
+    @classmethod
+    def get(cls, endpoint, parameters):
+        if cls._connection is None:
+            return None
+
+        key = cls._key(endpoint, parameters)
+        now = time.time()
+
+        with cls._lock:
+            row = cls._connection.execute('SELECT value, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+
+            if row is None or row[1] <= now:
+                cls.misses += 1
+                return None
+
+            cls.hits += 1
+            cls._connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+
+        return json.loads(row[0])
+
+    @classmethod
+    def put(cls, endpoint, parameters, value):
+        if cls._connection is None:
+            return
+
+        now = time.time()
+        ttl = cls.ttl.get(endpoint, cls.default_ttl)
+
+        with cls._lock:
+            cls._connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                    (cls._key(endpoint, parameters), endpoint, json.dumps(value), now + ttl, now))
+
+            # Counting rows on every insert would be wasteful; trim the table every so often instead
+            cls._puts_since_eviction += 1
+            if cls._puts_since_eviction >= max(cls.max_entries // 100, 1):
+                cls._puts_since_eviction = 0
+                cls._evict(now)
+
+    @classmethod
+    def _evict(cls, now):
+        # Only called while holding the lock
+        cls._connection.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+        cls._connection.execute('''
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+        ''', (cls.max_entries,))
+
+    @classmethod
+    def fetch(cls, endpoint, parameters, request):
+        """
+        Returns the cached response for the endpoint and parameters, or calls request() and caches its result. In
+        cache-only mode, a missing response raises ResponseNotCachedError instead of calling the API.
+        """
+        value = cls.get(endpoint, parameters)
+
+        if value is not None:
+            cls._log.debug(f'Serving {endpoint} {parameters} from the API response cache')
+            return value
+
+        if cls.cache_only:
+            raise ResponseNotCachedError(endpoint, parameters)
+
+        value = request()
+
+        if value is not None:
+            cls.put(endpoint, parameters, value)
+
+        return value
+
+    @classmethod
+    def statistics(cls):
+        entries = cls._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0] if cls._connection else 0
+        return {
+            'entries': entries,
+            'hits': cls.hits,
+            'misses': cls.misses
+        }
+
+    @classmethod
+    def print_debug_settings(cls):
+        cls._log.debug(f'API Response Cache Enabled: {cls.enabled}')
+        cls._log.debug(f'API Response Cache Path: {cls.path}')
+        cls._log.debug(f'API Response Cache Max Entries: {cls.max_entries}')
+        cls._log.debug(f'API Response Cache Only: {cls.cache_only}')
+        cls._log.debug(f'API Response Cache TTLs (s): {cls.ttl}')
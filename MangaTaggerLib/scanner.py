@@ -0,0 +1,96 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+
+class DownloadScanner:
+    """
+    Finds the chapters in the download directory that still need processing. Series directories are listed in
+    parallel with os.scandir, which pays off when the download directory is on a network share where every call is a
+    round-trip.
+
+    A manifest of directory modification times lets later starts skip the series directories that have not changed
+    since the last clean shutdown. Only directories whose chapters were all accounted for at shutdown are recorded, so
+    a skipped directory never hides a chapter that still needs processing.
+    """
+    def __init__(self, download_dir: Path, threads=8):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self.download_dir = Path(download_dir)
+        self.threads = max(threads, 1)
+
+        # Manifest as of the last scan, with every listed directory at the modification time it was listed at
+        self.manifest = {}
+
+    def _series_directories(self) -> List[os.DirEntry]:
+        with os.scandir(self.download_dir) as entries:
+            return [entry for entry in entries if entry.is_dir()]
+
+    @staticmethod
+    def _list_chapters(entry: os.DirEntry) -> Tuple[int, List[str]]:
+        # The modification time is taken before listing, so a chapter added during the listing changes it again
+        mtime = entry.stat().st_mtime_ns
+
+        with os.scandir(entry.path) as chapters:
+            return mtime, [chapter.name for chapter in chapters if chapter.name.endswith('.cbz') and chapter.is_file()]
+
+    def _list_series(self, manifest: Dict[str, int]):
+        def list_series(entry):
+            mtime = entry.stat().st_mtime_ns
+            if manifest.get(entry.name) == mtime:
+                return entry.name, mtime, None
+            return (entry.name, *self._list_chapters(entry))
+
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='MTT-Scan') as executor:
+            return list(executor.map(list_series, self._series_directories()))
+
+    def scan(self, manifest: Dict[str, int], queued_paths: Set[str], processed_files: Set[Tuple[str, str]]) \
+            -> List[Path]:
+        """
+        Returns the chapters in the changed series directories that are neither queued nor already processed.
+
+        Attributes:
+            manifest - Directory name to modification time (ns) of the directories unchanged since the last shutdown
+            queued_paths - Absolute paths of the chapters already in the task queue
+            processed_files - (series title, original filename) of every chapter processed before
+        """
+        chapters = []
+        skipped_series = 0
+        skipped_processed = 0
+        self.manifest = {}
+
+        for series, mtime, filenames in self._list_series(manifest):
+            self.manifest[series] = mtime
+
+            if filenames is None:
+                skipped_series += 1
+                continue
+
+            for filename in filenames:
+                path = Path(self.download_dir, series, filename)
+
+                if (series, filename) in processed_files:
+                    skipped_processed += 1
+                elif str(path.absolute()) not in queued_paths:
+                    chapters.append(path)
+
+        self._log.info(f'Found {len(chapters)} chapters to process in "{self.download_dir}"; skipped {skipped_series} '
+                       f'unchanged series directories and {skipped_processed} already processed chapters')
+        return chapters
+
+    def snapshot(self, accounted_paths: Set[str]) -> Dict[str, int]:
+        """
+        Returns the manifest of the series directories in which every chapter is accounted for by accounted_paths.
+        """
+        manifest = {}
+
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='MTT-Scan') as executor:
+            directories = self._series_directories()
+
+            for entry, (mtime, filenames) in zip(directories, executor.map(self._list_chapters, directories)):
+                if all(str(Path(self.download_dir, entry.name, filename).absolute()) in accounted_paths
+                       for filename in filenames):
+                    manifest[entry.name] = mtime
+
+        return manifest
@@ -0,0 +1,185 @@
+"""String similarity engine used for matching manga titles and staff names"""
+import re
+from collections import Counter
+from threading import Lock
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+# Characters trimmed from both ends of a string before it is compared
+_STRIP_CHARACTERS = '/[^a-zA-Z ]/g", '
+
+# Runs of punctuation and whitespace, which are folded into a single space before trigrams are taken
+_SEPARATORS = re.compile(r'[\W_]+')
+
+# Numbers and Roman numerals, which tell the parts, seasons and volumes of a series apart. A lone "i" or "x" is left
+# out, as it is far more often a word ("I", "Hunter x Hunter") than a numeral
+_NUMBERING = re.compile(r'\d+|\b(?:ii|iii|iv|v|vi|vii|viii|ix|xi|xii)\b')
+
+
+def normalize(s: str) -> str:
+    return s.lower().strip(_STRIP_CHARACTERS)
+
+
+def _match_masks(s: str) -> Dict[str, int]:
+    """
+    Builds the bit-vector of positions for every character in s, where bit i is set if s[i] is that character.
+    """
+    masks = {}
+    bit = 1
+    for character in s:
+        masks[character] = masks.get(character, 0) | bit
+        bit <<= 1
+    return masks
+
+
+def _lcs_length(masks: Dict[str, int], length: int, s: str) -> int:
+    """
+    Bit-parallel longest common subsequence (Allison-Dix/Hyyrö), processing one character of s per iteration with the
+    whole column of the DP matrix packed into a single integer.
+    """
+    all_bits = (1 << length) - 1
+    v = all_bits
+    for character in s:
+        u = v & masks.get(character, 0)
+        v = ((v + u) | (v - u)) & all_bits
+    return length - bin(v).count('1')
+
+
+def _score(masks: Dict[str, int], s1: str, s2: str) -> float:
+    total_length = len(s1) + len(s2)
+
+    if s1 == s2:
+        return 1.0
+    elif not s1 or not s2:
+        return 0.0
+
+    # With insertions and deletions costing 1 and substitutions costing 2, a substitution is never cheaper than a
+    # deletion followed by an insertion, so the edit distance reduces to len(s1) + len(s2) - 2 * LCS(s1, s2).
+    return 2 * _lcs_length(masks, len(s1), s2) / total_length
+
+
+def compare_normalized(s1: str, s2: str) -> float:
+    """
+    Same as compare(), but expects both strings to have already been passed through normalize().
+    """
+    return _score(_match_masks(s1), s1, s2)
+
+
+def compare(s1: str, s2: str) -> float:
+    """
+    Returns the similarity of two strings as a value between 0 and 1, derived from the Levenshtein distance with
+    insertions and deletions costing 1 and substitutions costing 2.
+    """
+    return compare_normalized(normalize(s1), normalize(s2))
+
+
+def compare_many_normalized(query: str, candidates: Iterable[str]) -> List[float]:
+    """
+    Same as compare_many(), but expects the query and candidates to have already been passed through normalize().
+    """
+    masks = _match_masks(query)
+    return [_score(masks, query, candidate) for candidate in candidates]
+
+
+def compare_many(query: str, candidates: Iterable[str]) -> List[float]:
+    """
+    Compares query against every candidate, building the character masks for query only once.
+    """
+    return compare_many_normalized(normalize(query), [normalize(candidate) for candidate in candidates])
+
+
+def numbering(s: str) -> List[str]:
+    """
+    Returns the numbers and Roman numerals in s, in order, with leading zeros dropped.
+    """
+    return [token.lstrip('0') or '0' if token.isdigit() else token for token in _NUMBERING.findall(s.lower())]
+
+
+def same_title(s1: str, s2: str, min_score: float) -> bool:
+    """
+    Returns True if s1 and s2 are the same title up to case and punctuation, or if they score at least min_score and
+    carry the same numbers, so that the title of a sequel is never taken for the title of the series before it.
+    """
+    s1 = normalize(s1)
+    s2 = normalize(s2)
+
+    if _SEPARATORS.sub(' ', s1).strip() == _SEPARATORS.sub(' ', s2).strip():
+        return True
+
+    return numbering(s1) == numbering(s2) and compare_normalized(s1, s2) >= min_score
+
+
+def trigrams(s: str) -> set:
+    """
+    Returns the set of character trigrams of s with case and punctuation folded away.
+    """
+    s = f' {_SEPARATORS.sub(" ", s.lower()).strip()} '
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class TrigramIndex:
+    """
+    Thread-safe in-memory inverted index from title trigrams to keys, used to find the stored titles most similar to a
+    query without comparing the query against every title.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._postings = {}
+        self._titles = {}
+
+    def __len__(self):
+        return len(self._titles)
+
+    def add(self, key: Hashable, titles: Iterable[str]):
+        titles = [normalize(title) for title in titles if title]
+
+        with self._lock:
+            self._remove(key)
+
+            if not titles:
+                return
+
+            self._titles[key] = titles
+
+            for title in titles:
+                for trigram in trigrams(title):
+                    self._postings.setdefault(trigram, set()).add(key)
+
+    def remove(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        for title in self._titles.pop(key, []):
+            for trigram in trigrams(title):
+                postings = self._postings.get(trigram)
+                if postings is not None:
+                    postings.discard(key)
+                    if not postings:
+                        del self._postings[trigram]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._titles.clear()
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[float, Hashable]]:
+        """
+        Returns up to limit (score, key) pairs, best first, where score is the highest compare() value between the
+        query and any of the titles stored for that key.
+        """
+        query = normalize(query)
+        shared = Counter()
+
+        with self._lock:
+            for trigram in trigrams(query):
+                shared.update(self._postings.get(trigram, ()))
+
+            # Only the keys sharing the most trigrams with the query are worth scoring with the full comparison
+            candidates = [(key, self._titles[key]) for key, _ in shared.most_common(limit * 4)]
+
+        results = []
+        for key, titles in candidates:
+            results.append((max(compare_many_normalized(query, titles)), key))
+
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:limit]
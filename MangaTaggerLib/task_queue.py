@@ -1,10 +1,13 @@
+import heapq
 import logging
+import random
 import time
 import uuid
+from collections import OrderedDict, deque
 from enum import Enum
 from pathlib import Path
-from queue import Queue
-from threading import Thread
+from queue import Queue, Empty
+from threading import Thread, Lock, Event, Condition
 from typing import List
 
 from watchdog.events import PatternMatchingEventHandler
@@ -19,10 +22,15 @@ class QueueEventOrigin(Enum):
     WATCHDOG = 1
     FROM_DB = 2
     SCAN = 3
+    RETRY = 4
 
 
 class QueueEvent:
     def __init__(self, event, origin=QueueEventOrigin.WATCHDOG):
+        # Identifies the event in the durable task queue; events loaded from the database keep the id they were saved
+        # under
+        self.id = event.get('_id', uuid.uuid4().hex) if origin == QueueEventOrigin.FROM_DB else uuid.uuid4().hex
+
         if origin == QueueEventOrigin.WATCHDOG:
             self.event_type = event.event_type
             self.src_path = Path(event.src_path)
@@ -30,13 +38,20 @@ class QueueEvent:
                 self.dest_path = Path(event.dest_path)
             except AttributeError:
                 pass
-        elif origin == QueueEventOrigin.FROM_DB:
+        elif origin in (QueueEventOrigin.FROM_DB, QueueEventOrigin.RETRY):
             self.event_type = event['event_type']
             self.src_path = Path(event['src_path'])
             try:
                 self.dest_path = Path(event['dest_path'])
             except KeyError:
                 pass
+
+            # Tag events retry the metadata lookup of a chapter that has already been moved into the library
+            if self.event_type == 'tag':
+                self.manga_title = event['manga_title']
+                self.chapter_number = event['chapter_number']
+                self.attempt = event['attempt']
+                self.retry_at = event.get('retry_at')
         elif origin == QueueEventOrigin.SCAN:
             self.event_type = 'existing'
             self.src_path = event
@@ -46,6 +61,14 @@ class QueueEvent:
             return f'File {self.event_type} event at {self.src_path.absolute()}'
         elif self.event_type == 'modified':
             return f'File {self.event_type} event at {self.dest_path.absolute()}'
+        elif self.event_type == 'tag':
+            return f'Metadata retry event (attempt {self.attempt}) at {self.src_path.absolute()}'
+
+    @property
+    def path(self) -> Path:
+        if self.event_type == 'moved':
+            return self.dest_path
+        return self.src_path
 
     def dictionary(self):
         ret_dict = {
@@ -59,11 +82,295 @@ class QueueEvent:
         except AttributeError:
             pass
 
+        if self.event_type == 'tag':
+            ret_dict['manga_title'] = self.manga_title
+            ret_dict['chapter_number'] = self.chapter_number
+            ret_dict['attempt'] = self.attempt
+            ret_dict['retry_at'] = self.retry_at
+
         return ret_dict
 
 
+class SeriesBatchQueue(Queue):
+    """
+    Worker queue that groups events by series (the parent directory of the chapter) and hands out up to
+    max_batch_size events of a single series per get(), so one worker processes those chapters back to back.
+
+    Series take turns in round-robin order: a series with events left over after a batch goes to the back of the line,
+    so a large backlog of one series cannot starve fresh downloads of other series.
+    """
+    def __init__(self, maxsize=0, max_batch_size=10):
+        self.max_batch_size = max(max_batch_size, 1)
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queue = OrderedDict()
+        self._events = 0
+        self._sentinels = 0
+
+    def _qsize(self):
+        return self._events + self._sentinels
+
+    def _put(self, event):
+        # Shutdown sentinels are handed out one per get() once no events are left
+        if event is None:
+            self._sentinels += 1
+            return
+
+        self.queue.setdefault(event.path.parent, deque()).append(event)
+        self._events += 1
+
+    def _get(self):
+        if not self.queue:
+            self._sentinels -= 1
+            return None
+
+        series, events = self.queue.popitem(last=False)
+        batch = [events.popleft() for _ in range(min(self.max_batch_size, len(events)))]
+
+        if events:
+            self.queue[series] = events
+
+        self._events -= len(batch)
+        return batch
+
+
+class DownloadSettler:
+    """
+    Holds events for files that may still be downloading and hands them to the worker queue only once they are fully
+    written, so that worker threads never wait on a download themselves.
+
+    A file is promoted as soon as it is closed after writing (inotify on Linux), as soon as it is added if it has not
+    been modified for settle_seconds, or otherwise once its size is unchanged between two checks settle_seconds apart.
+    Pending files are kept on a timer wheel, so each tick only touches the files due to be checked on that tick.
+    """
+    tick_seconds = .25
+    settle_seconds = 1
+    wheel_size = 64
+
+    def __init__(self, ready_queue: Queue, journal=None):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self._ready_queue = ready_queue
+        self._journal = journal
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name='MTT-Settler', daemon=True)
+
+        self._wheel = [{} for _ in range(self.wheel_size)]
+        self._pending = {}
+        self._tick = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> List[QueueEvent]:
+        """
+        Stops checking pending files and returns the events that have not been handed to the worker queue.
+        """
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+        with self._lock:
+            events = [event for event, _ in self._pending.values()]
+            self._pending.clear()
+            for slot in self._wheel:
+                slot.clear()
+
+        return events
+
+    def put(self, event: QueueEvent):
+        path = event.path
+
+        try:
+            stat = path.stat()
+        except FileNotFoundError as fnfe:
+            self._log.exception(fnfe)
+            self._acknowledge(event)
+            return
+
+        if self._journal is not None:
+            self._journal.enqueue(event)
+
+        if time.time() - stat.st_mtime >= self.settle_seconds:
+            self._log.debug(f'"{path}" has not been modified for {self.settle_seconds}s; promoting to the queue')
+            self._promote(event)
+            return
+
+        with self._lock:
+            self._schedule(path, event, stat.st_size)
+
+    def file_closed(self, path: Path):
+        with self._lock:
+            entry = self._pending.pop(path, None)
+            if entry is not None:
+                self._wheel[entry[1]].pop(path, None)
+
+        if entry is not None:
+            self._log.debug(f'"{path}" has been closed after writing; promoting to the queue')
+            self._promote(entry[0])
+
+    def _schedule(self, path, event, size):
+        # Only called while holding the lock
+        previous = self._pending.get(path)
+        if previous is not None:
+            self._wheel[previous[1]].pop(path, None)
+
+        settle_ticks = min(max(round(self.settle_seconds / self.tick_seconds), 1), self.wheel_size - 1)
+        slot = (self._tick + settle_ticks) % self.wheel_size
+        self._wheel[slot][path] = size
+        self._pending[path] = (event, slot)
+
+    def _promote(self, event):
+        self._log.info(f'{event} has been added to the task queue')
+        self._ready_queue.put(event)
+
+    def _acknowledge(self, event):
+        if self._journal is not None:
+            self._journal.acknowledge(event)
+
+    def _run(self):
+        while not self._stopped.wait(self.tick_seconds):
+            with self._lock:
+                self._tick = (self._tick + 1) % self.wheel_size
+                due = self._wheel[self._tick]
+                self._wheel[self._tick] = {}
+
+            settled = []
+            for path, last_size in due.items():
+                try:
+                    size = path.stat().st_size
+                except FileNotFoundError:
+                    size = None
+
+                with self._lock:
+                    entry = self._pending.get(path)
+
+                    # Promoted or rescheduled since this slot was taken off the wheel
+                    if entry is None or entry[1] != self._tick:
+                        continue
+
+                    if size is None:
+                        self._log.warning(f'"{path}" was removed before it finished downloading')
+                        del self._pending[path]
+                        self._acknowledge(entry[0])
+                    elif size == last_size:
+                        del self._pending[path]
+                        settled.append(entry[0])
+                    else:
+                        self._schedule(path, entry[0], size)
+
+            for event in settled:
+                self._promote(event)
+
+
+class DelayedRetryQueue:
+    """
+    Parks events that failed on a transient API error until their retry time and then hands them back to the worker
+    queue, so that worker threads move on to other chapters instead of sleeping through the backoff.
+
+    The delay doubles with every attempt, starting at base_delay and capped at max_delay, and half of it is randomized
+    so that events parked during the same rate-limit storm do not all retry at once.
+    """
+    base_delay = 30
+    max_delay = 900
+    max_attempts = 8
+
+    def __init__(self, ready_queue: Queue, journal=None):
+        self._log = logging.getLogger(f'{self.__module__}.{self.__class__.__name__}')
+        self._ready_queue = ready_queue
+        self._journal = journal
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, name='MTT-Retry', daemon=True)
+
+        self._heap = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> List[QueueEvent]:
+        """
+        Stops retrying and returns the parked events, which keep their retry time.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread.is_alive():
+            self._thread.join()
+
+        with self._condition:
+            events = [event for _, _, event in sorted(self._heap)]
+            self._heap.clear()
+
+        return events
+
+    def delay(self, attempt):
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def put(self, event: QueueEvent) -> bool:
+        """
+        Schedules the event for its next attempt, or returns False if it has already used up max_attempts.
+        """
+        if event.attempt > self.max_attempts:
+            self._log.error(f'{event} has failed {self.max_attempts} times; giving up')
+            return False
+
+        event.retry_at = time.time() + self.delay(event.attempt)
+        self._park(event)
+
+        if self._journal is not None:
+            self._journal.enqueue(event)
+
+        self._log.info(f'{event} will be retried in {event.retry_at - time.time():.0f}s')
+        return True
+
+    def restore(self, event: QueueEvent):
+        """
+        Parks an event loaded from the database until the retry time it was saved with.
+        """
+        if event.retry_at is None:
+            event.retry_at = time.time()
+        self._park(event)
+
+    def _park(self, event):
+        with self._condition:
+            # The sequence number keeps events with the same retry time in order without comparing the events
+            heapq.heappush(self._heap, (event.retry_at, self._sequence, event))
+            self._sequence += 1
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    self._condition.wait(self._heap[0][0] - time.time() if self._heap else None)
+
+                if self._stopped:
+                    return
+
+                due = []
+                while self._heap and self._heap[0][0] <= time.time():
+                    due.append(heapq.heappop(self._heap)[2])
+
+            for event in due:
+                self._log.info(f'{event} has been added to the task queue')
+                self._ready_queue.put(event)
+
+
 class QueueWorker:
     _queue: Queue = None
+    _settler: DownloadSettler = None
+    _retry_queue: DelayedRetryQueue = None
     _observer: Observer = None
     _log: logging = None
     _worker_list: List[Thread] = None
@@ -72,6 +379,8 @@ class QueueWorker:
 
     max_queue_size = None
     threads = None
+    scheduler = 'fifo'
+    max_batch_size = 10
     is_library_network_path = False
     download_dir: Path = None
     task_list = {}
@@ -79,7 +388,10 @@ class QueueWorker:
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
-        cls._queue = Queue(maxsize=cls.max_queue_size)
+        if cls.scheduler == 'series':
+            cls._queue = SeriesBatchQueue(maxsize=cls.max_queue_size, max_batch_size=cls.max_batch_size)
+        else:
+            cls._queue = Queue(maxsize=cls.max_queue_size)
         cls._worker_list = []
         cls._running = True
 
@@ -96,7 +408,11 @@ class QueueWorker:
         else:
             cls._observer = Observer()
 
-        cls._observer.schedule(SeriesHandler(cls._queue), cls.download_dir, True)
+        # Events only reach the worker queue once the settler has seen the download finish
+        cls._settler = DownloadSettler(cls._queue, TaskQueueTable)
+        cls._observer.schedule(SeriesHandler(cls._settler), cls.download_dir, True)
+
+        cls._retry_queue = DelayedRetryQueue(cls._queue, TaskQueueTable)
 
     @classmethod
     def load_task_queue(cls):
@@ -104,22 +420,61 @@ class QueueWorker:
 
         for task in cls.task_list.values():
             event = QueueEvent(task, QueueEventOrigin.FROM_DB)
-            cls._log.info(f'{event} has been added to the task queue')
-            cls._queue.put(event)
 
-        TaskQueueTable.delete_all()
+            if event.event_type == 'tag':
+                cls._retry_queue.restore(event)
+            else:
+                cls._settler.put(event)
+
+        # A durable task queue only deletes events once they have been processed
+        if not TaskQueueTable.durable:
+            TaskQueueTable.delete_all()
 
     @classmethod
     def save_task_queue(cls):
-        TaskQueueTable.save(cls._queue)
-        with cls._queue.mutex:
-            cls._queue.queue.clear()
+        pending_downloads = cls._settler.stop()
+        parked_retries = cls._retry_queue.stop()
+
+        # Events of a durable task queue are already in the database
+        if not TaskQueueTable.durable:
+            TaskQueueTable.save(cls._queue)
+            TaskQueueTable.save_events(pending_downloads)
+            TaskQueueTable.save_events(parked_retries)
+
+        # Drain through get_nowait() rather than clearing the underlying container, so the queue's own size
+        # bookkeeping stays consistent and the shutdown sentinels can still be put on a bounded queue
+        while True:
+            try:
+                item = cls._queue.get_nowait()
+            except Empty:
+                break
+
+            for _ in item if isinstance(item, list) else [item]:
+                cls._queue.task_done()
 
     @classmethod
     def add_to_task_queue(cls, manga_chapter):
-        event = QueueEvent(manga_chapter, QueueEventOrigin.SCAN)
-        cls._log.info(f'{event} has been added to the task queue')
-        cls._queue.put(event)
+        cls._settler.put(QueueEvent(manga_chapter, QueueEventOrigin.SCAN))
+
+    @classmethod
+    def retry_tagging(cls, library_path: Path, manga_title, chapter_number, attempt):
+        """
+        Parks the metadata lookup for a chapter that has already been moved into the library, to be retried after a
+        backoff. Returns False if the chapter has run out of attempts, and None if it cannot be parked because there is
+        no file to come back to or the worker queue is not running.
+        """
+        if library_path is None or cls._retry_queue is None:
+            return None
+
+        event = QueueEvent({
+            'event_type': 'tag',
+            'src_path': str(library_path),
+            'manga_title': manga_title,
+            'chapter_number': chapter_number,
+            'attempt': attempt
+        }, QueueEventOrigin.RETRY)
+
+        return cls._retry_queue.put(event)
 
     @classmethod
     def exit(cls):
@@ -137,6 +492,17 @@ class QueueWorker:
 
         # Finish current running jobs and stop worker threads
         cls._log.info('Stopping worker threads...')
+        cls.stop_workers()
+
+        # Write the acknowledgements of the jobs that were still running
+        TaskQueueTable.close()
+
+    @classmethod
+    def stop_workers(cls):
+        # One sentinel per worker; each worker exits after pulling one, once its current job has finished
+        for _ in cls._worker_list:
+            cls._queue.put(None)
+
         for worker in cls._worker_list:
             worker.join()
             cls._log.debug(f'Worker thread {worker.name} has been shut down')
@@ -146,6 +512,8 @@ class QueueWorker:
         for worker in cls._worker_list:
             worker.start()
 
+        cls._settler.start()
+        cls._retry_queue.start()
         cls._observer.start()
 
         cls._log.info(f'Watching "{cls.download_dir}" for new downloads')
@@ -159,39 +527,78 @@ class QueueWorker:
 
     @classmethod
     def process(cls):
-        while cls._running:
-            if not cls._queue.empty():
-                event = cls._queue.get()
-
-                if event.event_type in ('created', 'existing'):
-                    cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.src_path}"')
-                    path = Path(event.src_path)
-                elif event.event_type == 'moved':
-                    cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.dest_path}"')
-                    path = Path(event.dest_path)
+        while True:
+            # Block until an event, a batch of events or a shutdown sentinel is available, so idle workers do not use
+            # any CPU
+            item = cls._queue.get()
+            events = item if isinstance(item, list) else [item]
+
+            # Once shutdown has begun, events are left for the next start instead of being processed
+            if item is not None and not cls._running:
+                cls._defer(events)
+                continue
+
+            try:
+                if item is None:
+                    return
+
+                if len(events) > 1:
+                    cls._process_batch(events)
                 else:
-                    cls._log.error('Event was passed, but Manga Tagger does not know how to handle it. Please open an '
-                                   'issue for further investigation.')
+                    cls._process_event(events[0])
+            finally:
+                for event in events:
+                    if event is not None:
+                        TaskQueueTable.acknowledge(event)
                     cls._queue.task_done()
-                    return
 
-                current_size = -1
-                try:
-                    destination_size = path.stat().st_size
-                    while current_size != destination_size:
-                        current_size = destination_size
-                        time.sleep(1)
-                except FileNotFoundError as fnfe:
-                    cls._log.exception(fnfe)
+    @classmethod
+    def _defer(cls, events):
+        # Events of a durable task queue stay in the database until they are acknowledged
+        if not TaskQueueTable.durable:
+            TaskQueueTable.save_events(events)
 
-                try:
-                    MangaTaggerLib.process_manga_chapter(path, uuid.uuid1())
-                except Exception as e:
-                    cls._log.exception(e)
-                    cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
-                                     'investigation.')
+        for _ in events:
+            cls._queue.task_done()
 
-                cls._queue.task_done()
+    @classmethod
+    def _process_batch(cls, events):
+        directory_name = events[0].path.parent.name
+        cls._log.info(f'Pulling a batch of {len(events)} events from the queue for "{directory_name}"')
+
+        for event in events:
+            cls._process_event(event)
+
+    @classmethod
+    def _process_event(cls, event):
+        if event.event_type in ('created', 'existing'):
+            cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.src_path}"')
+            path = Path(event.src_path)
+        elif event.event_type == 'moved':
+            cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.dest_path}"')
+            path = Path(event.dest_path)
+        elif event.event_type == 'tag':
+            cls._log.info(f'Pulling "metadata retry" event from the queue for "{event.src_path}"')
+
+            try:
+                MangaTaggerLib.retry_metadata_tagger(event.src_path, event.manga_title, event.chapter_number,
+                                                     event.attempt, uuid.uuid1())
+            except Exception as e:
+                cls._log.exception(e)
+                cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
+                                 'investigation.')
+            return
+        else:
+            cls._log.error('Event was passed, but Manga Tagger does not know how to handle it. Please open an '
+                           'issue for further investigation.')
+            return
+
+        try:
+            MangaTaggerLib.process_manga_chapter(path, uuid.uuid1())
+        except Exception as e:
+            cls._log.exception(e)
+            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
+                             'investigation.')
 
 
 class SeriesHandler(PatternMatchingEventHandler):
@@ -205,17 +612,17 @@ class SeriesHandler(PatternMatchingEventHandler):
     def fully_qualified_class_name(cls):
         return f'{cls.__module__}.{cls.__name__}'
 
-    def __init__(self, queue):
+    def __init__(self, settler):
         self._log = logging.getLogger(self.fully_qualified_class_name())
         super().__init__(patterns=['*.cbz'])
-        self.queue = queue
+        self.settler = settler
         self._log.debug(f'{self.class_name()} class has been initialized')
 
     def on_created(self, event):
         self._log.debug(f'Event Type: {event.event_type}')
         self._log.debug(f'Event Path: {event.src_path}')
 
-        self.queue.put(QueueEvent(event, QueueEventOrigin.WATCHDOG))
+        self.settler.put(QueueEvent(event, QueueEventOrigin.WATCHDOG))
         self._log.info(f'Creation event for "{event.src_path}" will be added to the queue')
 
     def on_moved(self, event):
@@ -224,5 +631,12 @@ class SeriesHandler(PatternMatchingEventHandler):
         self._log.debug(f'Event Destination Path: {event.dest_path}')
 
         if Path(event.src_path) == Path(event.dest_path) and '-.-' in event.dest_path:
-            self.queue.put(QueueEvent(event, QueueEventOrigin.WATCHDOG))
+            self.settler.put(QueueEvent(event, QueueEventOrigin.WATCHDOG))
         self._log.info(f'Moved event for "{event.dest_path}" will be added to the queue')
+
+    def on_closed(self, event):
+        self._log.debug(f'Event Type: {event.event_type}')
+        self._log.debug(f'Event Path: {event.src_path}')
+
+        # Only emitted by the inotify observer; other platforms rely on the settler's size checks
+        self.settler.file_closed(Path(event.src_path))
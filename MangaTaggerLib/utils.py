@@ -7,13 +7,20 @@ from logging.handlers import RotatingFileHandler, SocketHandler
 from pathlib import Path
 from tkinter import filedialog, messagebox, Tk
 
-import numpy
 import psutil
 from pythonjsonlogger import jsonlogger
 
-from MangaTaggerLib.database import Database
-from MangaTaggerLib.task_queue import QueueWorker
-from MangaTaggerLib.api import AniList
+from MangaTaggerLib.database import Database, MetadataTable, ProcFilesTable, TaskQueueTable, DownloadManifestTable, \
+    UnresolvedSeriesTable
+from MangaTaggerLib.task_queue import DelayedRetryQueue, QueueWorker
+from MangaTaggerLib.api import AniList, HTTPSession, MTJikan
+from MangaTaggerLib.cache import LRUCache
+from MangaTaggerLib.response_cache import ResponseCache
+from MangaTaggerLib.scanner import DownloadScanner
+from MangaTaggerLib.similarity import normalize, compare_normalized, compare_many_normalized
+
+# Scores of previously compared normalized string pairs
+SIMILARITY_CACHE = LRUCache(4096)
 
 
 class AppSettings:
@@ -26,36 +33,16 @@ class AppSettings:
 
     processed_series = None
 
+    scan_threads = 8
+    candidate_threads = 4
+
     _log = None
+    _scanner: DownloadScanner = None
 
     @classmethod
     def load(cls):
-        settings_location = Path(Path.cwd(), 'settings.json')
-        if Path(settings_location).exists():
-            with open(settings_location, 'r') as settings_json:
-                settings = json.load(settings_json)
-        else:
-            with open(settings_location, 'w+') as settings_json:
-                settings = cls._create_settings()
-                json.dump(settings, settings_json, indent=4)
-
-        cls._initialize_logger(settings['logger'])
-        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
-
-        # Database Configuration
-        cls._log.debug('Now setting database configuration...')
-
-        Database.database_name = settings['database']['database_name']
-        Database.host_address = settings['database']['host_address']
-        Database.port = settings['database']['port']
-        Database.username = settings['database']['username']
-        Database.password = settings['database']['password']
-        Database.auth_source = settings['database']['auth_source']
-        Database.server_selection_timeout_ms = settings['database']['server_selection_timeout_ms']
-
-        cls._log.debug('Database settings configured!')
-        Database.initialize()
-        Database.print_debug_settings()
+        settings = cls._load_settings()
+        cls._initialize_database(settings)
 
         # Free Manga Downloader Configuration
         cls._initialize_fmd_settings(settings['fmd']['fmd_dir'], settings['fmd']['download_dir'])
@@ -86,6 +73,43 @@ class AppSettings:
 
         cls._log.debug(f'Max Queue Size: {QueueWorker.max_queue_size}')
 
+        # Series batching groups queued chapters by series; max_batch_size bounds how many chapters of one series are
+        # processed before other series get a turn
+        if settings['application']['multithreading']['scheduler'] not in ('fifo', 'series'):
+            cls._log.critical('Scheduler not of expected values "fifo" or "series". Double check the configuration '
+                              'in settings.json and try again.')
+            sys.exit(1)
+
+        QueueWorker.scheduler = settings['application']['multithreading']['scheduler']
+        QueueWorker.max_batch_size = max(settings['application']['multithreading']['max_batch_size'], 1)
+
+        cls._log.debug(f'Scheduler: {QueueWorker.scheduler}')
+        cls._log.debug(f'Max Batch Size: {QueueWorker.max_batch_size}')
+
+        cls.scan_threads = max(settings['application']['multithreading']['scan_threads'], 1)
+        cls._log.debug(f'Scan Threads: {cls.scan_threads}')
+
+        cls.candidate_threads = max(settings['application']['multithreading']['candidate_threads'], 1)
+        cls._log.debug(f'Candidate Threads: {cls.candidate_threads}')
+
+        # Retry Configuration
+        DelayedRetryQueue.base_delay = settings['application']['retry']['base_delay']
+        DelayedRetryQueue.max_delay = settings['application']['retry']['max_delay']
+        DelayedRetryQueue.max_attempts = settings['application']['retry']['max_attempts']
+
+        cls._log.debug(f'Retry Base Delay (s): {DelayedRetryQueue.base_delay}')
+        cls._log.debug(f'Retry Max Delay (s): {DelayedRetryQueue.max_delay}')
+        cls._log.debug(f'Retry Max Attempts: {DelayedRetryQueue.max_attempts}')
+
+        # Cache Configuration
+        SIMILARITY_CACHE.resize(settings['application']['cache']['similarity_cache_size'])
+        cls._log.debug(f'Similarity Cache Size: {SIMILARITY_CACHE.max_size}')
+
+        MetadataTable.cache.configure(settings['application']['cache']['metadata_cache_size'],
+                                      settings['application']['cache']['metadata_cache_ttl'])
+        cls._log.debug(f'Metadata Cache Size: {MetadataTable.cache.max_size}')
+        cls._log.debug(f'Metadata Cache TTL (s): {MetadataTable.cache.ttl}')
+
         # Debug Mode - Prevent application from processing files
         if settings['application']['debug_mode']:
             QueueWorker._debug_mode = True
@@ -118,12 +142,89 @@ class AppSettings:
         cls._scan_download_dir()
 
         # Initialize API
+        HTTPSession.pool_connections = settings['api']['pool_connections']
+        HTTPSession.pool_maxsize = settings['api']['pool_maxsize']
+        HTTPSession.timeout = settings['api']['timeout']
+        HTTPSession.initialize()
+        HTTPSession.print_debug_settings()
         AniList.initialize()
 
+        MTJikan.limiter.configure(settings['api']['jikan']['requests_per_second'],
+                                  settings['api']['jikan']['requests_per_minute'])
+        AniList.limiter.configure(settings['api']['anilist']['requests_per_second'],
+                                  settings['api']['anilist']['requests_per_minute'])
+        cls._log.debug(f'Jikan Rate Limits: {settings["api"]["jikan"]}')
+        cls._log.debug(f'AniList Rate Limits: {settings["api"]["anilist"]}')
+        AniList.batch_size = settings['api']['anilist']['batch_size']
+
+        ResponseCache.enabled = settings['api']['cache']['enabled']
+        ResponseCache.path = Path(settings['api']['cache']['path'])
+        ResponseCache.max_entries = settings['api']['cache']['max_entries']
+        ResponseCache.cache_only = settings['api']['cache']['cache_only']
+        ResponseCache.ttl = settings['api']['cache']['ttl']
+        ResponseCache.initialize()
+        ResponseCache.print_debug_settings()
+
         # Register function to be run prior to application termination
         atexit.register(cls._exit_handler)
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @classmethod
+    def load_database(cls):
+        """
+        Loads only the settings and the database connection, for administrative commands that do not process chapters.
+        """
+        cls._initialize_database(cls._load_settings())
+
+    @classmethod
+    def close_database(cls):
+        Database.flush_buffered_writes()
+        TaskQueueTable.close()
+        Database.close_connection()
+
+    @classmethod
+    def _load_settings(cls):
+        settings_location = Path(Path.cwd(), 'settings.json')
+        if Path(settings_location).exists():
+            with open(settings_location, 'r') as settings_json:
+                # Settings added since the file was created fall back to their defaults
+                settings = cls._merge_settings(cls._default_settings(), json.load(settings_json))
+        else:
+            with open(settings_location, 'w+') as settings_json:
+                settings = cls._create_settings()
+                json.dump(settings, settings_json, indent=4)
+
+        cls._initialize_logger(settings['logger'])
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        return settings
+
+    @classmethod
+    def _initialize_database(cls, settings):
+        # Database Configuration
+        cls._log.debug('Now setting database configuration...')
+
+        Database.database_name = settings['database']['database_name']
+        Database.host_address = settings['database']['host_address']
+        Database.port = settings['database']['port']
+        Database.username = settings['database']['username']
+        Database.password = settings['database']['password']
+        Database.auth_source = settings['database']['auth_source']
+        Database.server_selection_timeout_ms = settings['database']['server_selection_timeout_ms']
+
+        TaskQueueTable.durable = settings['database']['task_queue']['durable']
+        TaskQueueTable.max_batch_size = settings['database']['task_queue']['max_batch_size']
+        TaskQueueTable.flush_interval = settings['database']['task_queue']['flush_interval']
+        Database.write_behind_batch_size = settings['database']['write_behind']['max_batch_size']
+        Database.write_behind_flush_interval = settings['database']['write_behind']['flush_interval']
+        ProcFilesTable.bloom_filter_capacity = settings['database']['processed_files']['bloom_filter_capacity']
+        ProcFilesTable.bloom_filter_error_rate = settings['database']['processed_files']['bloom_filter_error_rate']
+        ProcFilesTable.series_index.resize(settings['database']['processed_files']['series_index_size'])
+        UnresolvedSeriesTable.ttl = settings['database']['unresolved_series']['ttl']
+
+        cls._log.debug('Database settings configured!')
+        Database.initialize()
+        Database.print_debug_settings()
+
     @classmethod
     def _initialize_fmd_settings(cls, fmd_dir, download_dir):
         cls._log.info('Now setting Free Manga Downloader configuration settings...')
@@ -278,12 +379,23 @@ class AppSettings:
         # Stop worker threads
         QueueWorker.exit()
 
-        # Save necessary database tables
-        Database.save_database_tables()
+        cls._log.info(f'Similarity cache statistics: {SIMILARITY_CACHE.statistics()}')
+        cls._log.info(f'Metadata cache statistics: {MetadataTable.cache.statistics()}')
+        cls._log.info(f'Processed chapters index statistics: {ProcFilesTable.statistics()}')
 
-        # Close MongoDB connection
+        # Save the download directory manifest for the next start
+        cls._save_download_manifest()
+
+        # Write the buffered metadata and processed file records, then close MongoDB connection
+        Database.flush_buffered_writes()
         Database.close_connection()
 
+        # Close pooled API connections
+        cls._log.info(f'Jikan rate limiter statistics: {MTJikan.limiter.statistics()}')
+        cls._log.info(f'AniList rate limiter statistics: {AniList.limiter.statistics()}')
+        HTTPSession.close()
+        ResponseCache.close()
+
         cls._log.info('Now exiting Manga Tagger')
 
     @classmethod
@@ -291,6 +403,25 @@ class AppSettings:
         Tk().withdraw()
         fmd_dir = filedialog.askdirectory(title='Select the folder that Free Manga Downloader is installed in')
 
+        return cls._default_settings(fmd_dir)
+
+    @classmethod
+    def _merge_settings(cls, defaults, settings):
+        """
+        Returns settings with every key it is missing, at any depth, filled in from defaults.
+        """
+        merged = dict(defaults)
+
+        for key, value in settings.items():
+            if isinstance(value, dict) and isinstance(defaults.get(key), dict):
+                merged[key] = cls._merge_settings(defaults[key], value)
+            else:
+                merged[key] = value
+
+        return merged
+
+    @staticmethod
+    def _default_settings(fmd_dir=None):
         return {
             "application": {
                 "debug_mode": False,
@@ -307,7 +438,21 @@ class AppSettings:
                 },
                 "multithreading": {
                     "threads": 8,
-                    "max_queue_size": 0
+                    "max_queue_size": 0,
+                    "scheduler": "fifo",
+                    "max_batch_size": 10,
+                    "scan_threads": 8,
+                    "candidate_threads": 4
+                },
+                "retry": {
+                    "base_delay": 30,
+                    "max_delay": 900,
+                    "max_attempts": 8
+                },
+                "cache": {
+                    "similarity_cache_size": 4096,
+                    "metadata_cache_size": 256,
+                    "metadata_cache_ttl": 3600
                 }
             },
             "database": {
@@ -317,7 +462,49 @@ class AppSettings:
                 "username": "manga_tagger",
                 "password": "Manga4LYFE",
                 "auth_source": "admin",
-                "server_selection_timeout_ms": 1
+                "server_selection_timeout_ms": 1,
+                "task_queue": {
+                    "durable": False,
+                    "max_batch_size": 500,
+                    "flush_interval": 0.5
+                },
+                "write_behind": {
+                    "max_batch_size": 100,
+                    "flush_interval": 1
+                },
+                "processed_files": {
+                    "series_index_size": 256,
+                    "bloom_filter_capacity": 100000,
+                    "bloom_filter_error_rate": 0.01
+                },
+                "unresolved_series": {
+                    "ttl": 604800
+                }
+            },
+            "api": {
+                "pool_connections": 4,
+                "pool_maxsize": 8,
+                "timeout": 30,
+                "jikan": {
+                    "requests_per_second": 2,
+                    "requests_per_minute": 30
+                },
+                "anilist": {
+                    "requests_per_second": None,
+                    "requests_per_minute": 90,
+                    "batch_size": 10
+                },
+                "cache": {
+                    "enabled": True,
+                    "path": "cache/api_responses.sqlite",
+                    "max_entries": 10000,
+                    "cache_only": False,
+                    "ttl": {
+                        "jikan_search": 86400,
+                        "jikan_manga": 604800,
+                        "anilist": 604800
+                    }
+                }
             },
             "logger": {
                 "logging_level": "info",
@@ -357,35 +544,61 @@ class AppSettings:
 
     @classmethod
     def _scan_download_dir(cls):
-        for directory in QueueWorker.download_dir.iterdir():
-            for manga_chapter in directory.glob('*.cbz'):
-                if manga_chapter.name.strip('.cbz') not in QueueWorker.task_list.keys():
-                    QueueWorker.add_to_task_queue(manga_chapter)
+        cls._scanner = DownloadScanner(QueueWorker.download_dir, cls.scan_threads)
+
+        queued_paths = {path for task in QueueWorker.task_list.values()
+                        for path in (task['src_path'], task.get('dest_path')) if path}
+
+        for manga_chapter in cls._scanner.scan(DownloadManifestTable.load(), queued_paths,
+                                               ProcFilesTable.processed_filenames()):
+            QueueWorker.add_to_task_queue(manga_chapter)
+
+        # Every chapter found is now in the durable task queue, so the directories just listed can be skipped on the
+        # next start, even after a crash
+        if TaskQueueTable.durable:
+            TaskQueueTable.flush()
+            DownloadManifestTable.save(cls._scanner.manifest)
+
+    @classmethod
+    def _save_download_manifest(cls):
+        if cls._scanner is None:
+            return
+
+        try:
+            DownloadManifestTable.save(cls._scanner.snapshot(TaskQueueTable.saved_paths()))
+        except Exception as e:
+            cls._log.exception(e)
+            cls._log.warning('Unable to save the download directory manifest; the next start will scan every series '
+                             'directory.')
+
+
+def _similarity_key(s1, s2):
+    # Scores are symmetric, so both orderings of a pair share one cache entry
+    return (s1, s2) if s1 <= s2 else (s2, s1)
 
 
 def compare(s1, s2):
-    s1 = s1.lower().strip('/[^a-zA-Z ]/g", ')
-    s2 = s2.lower().strip('/[^a-zA-Z ]/g", ')
+    s1 = normalize(s1)
+    s2 = normalize(s2)
+    key = _similarity_key(s1, s2)
 
-    rows = len(s1) + 1
-    cols = len(s2) + 1
-    distance = numpy.zeros((rows, cols), int)
+    score = SIMILARITY_CACHE.get(key)
+    if score is None:
+        score = compare_normalized(s1, s2)
+        SIMILARITY_CACHE.put(key, score)
 
-    for i in range(1, rows):
-        distance[i][0] = i
+    return score
 
-    for i in range(1, cols):
-        distance[0][i] = i
 
-    for col in range(1, cols):
-        for row in range(1, rows):
-            if s1[row - 1] == s2[col - 1]:
-                cost = 0
-            else:
-                cost = 2
+def compare_many(query, candidates):
+    query = normalize(query)
+    candidates = [normalize(candidate) for candidate in candidates]
+    scores = [SIMILARITY_CACHE.get(_similarity_key(query, candidate)) for candidate in candidates]
 
-            distance[row][col] = min(distance[row - 1][col] + 1,
-                                     distance[row][col - 1] + 1,
-                                     distance[row - 1][col - 1] + cost)
+    misses = [i for i, score in enumerate(scores) if score is None]
+    if misses:
+        for i, score in zip(misses, compare_many_normalized(query, [candidates[i] for i in misses])):
+            scores[i] = score
+            SIMILARITY_CACHE.put(_similarity_key(query, candidates[i]), score)
 
-    return ((len(s1) + len(s2)) - distance[row][col]) / (len(s1) + len(s2))
+    return scores
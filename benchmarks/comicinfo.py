@@ -0,0 +1,71 @@
+"""
+Measures the per-chapter cost of building ComicInfo.xml from the cached series template against rendering it in full
+through ElementTree and minidom, and checks that both produce the same bytes.
+
+Run from the repository root with:
+    python -m benchmarks.comicinfo
+"""
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+from MangaTaggerLib import MangaTaggerLib  # Imported first to resolve the circular import with task_queue
+from MangaTaggerLib.models import Metadata
+from MangaTaggerLib.utils import AppSettings
+
+DATA_DIR = Path('tests', 'data')
+TITLES = ['Absolute Boyfriend', 'Peach Girl Next [EN]', 'G-Maru Edition']
+CHAPTERS = 2000
+
+MIN_SPEEDUP = 10
+
+
+def load_metadata(title):
+    with open(Path(DATA_DIR, title, 'data.json'), encoding='utf-8') as data:
+        jikan_details = json.load(data)
+
+    with open(Path(DATA_DIR, title, 'staff.json'), encoding='utf-8') as data:
+        anilist_details = json.load(data)
+
+    return Metadata(title, {}, jikan_details, anilist_details)
+
+
+def measure(function, metadata, chapter_numbers):
+    start = time.perf_counter()
+    for chapter_number in chapter_numbers:
+        function(metadata, chapter_number)
+    return (time.perf_counter() - start) / len(chapter_numbers) * 1e6
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    AppSettings.timezone = 'America/New_York'
+    chapter_numbers = [f'{chapter:03}' for chapter in range(1, CHAPTERS + 1)]
+
+    def template(metadata, chapter_number):
+        return MangaTaggerLib.construct_comicinfo_xml(metadata, chapter_number, {})
+
+    passed = True
+    for title in TITLES:
+        metadata = load_metadata(title)
+
+        for chapter_number in chapter_numbers[:50]:
+            if template(metadata, chapter_number) != MangaTaggerLib.render_comicinfo_xml(metadata, chapter_number):
+                print(f'{title}: template output differs from the full render for chapter {chapter_number}')
+                passed = False
+
+        full_render = measure(MangaTaggerLib.render_comicinfo_xml, metadata, chapter_numbers)
+        templated = measure(template, metadata, chapter_numbers)
+        speedup = full_render / templated
+
+        print(f'{title}: full render {full_render:.1f} us/chapter, template {templated:.1f} us/chapter '
+              f'({speedup:.0f}x)')
+        passed = passed and speedup >= MIN_SPEEDUP
+
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Measures the CPU used by idle QueueWorker threads and the latency between an event being queued and a worker picking
+it up.
+
+Run from the repository root with:
+    python -m benchmarks.queue_worker
+"""
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from unittest.mock import patch
+
+from MangaTaggerLib import MangaTaggerLib  # Imported first to resolve the circular import with task_queue
+from MangaTaggerLib.task_queue import QueueWorker, QueueEvent, QueueEventOrigin
+
+THREADS = 8
+IDLE_SECONDS = 3
+EVENTS = 2000
+
+MAX_IDLE_CPU_PERCENT = 2.0
+MAX_MEDIAN_LATENCY_MS = 1.0
+
+
+def start_workers():
+    QueueWorker._log = logging.getLogger('benchmarks.queue_worker')
+    QueueWorker._queue = Queue()
+    QueueWorker._running = True
+    QueueWorker._worker_list = [Thread(target=QueueWorker.process, name=f'MTT-{i}', daemon=True)
+                                for i in range(THREADS)]
+
+    for worker in QueueWorker._worker_list:
+        worker.start()
+
+
+def measure_idle_cpu():
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    time.sleep(IDLE_SECONDS)
+    return (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+
+
+def measure_dequeue_latency():
+    queued_at = {}
+    latencies = []
+
+    def process_manga_chapter(path, event_id):
+        latencies.append(time.perf_counter() - queued_at[path])
+
+    with patch('MangaTaggerLib.MangaTaggerLib.process_manga_chapter', process_manga_chapter):
+        for i in range(EVENTS):
+            path = Path(f'Absolute Boyfriend -.- Chapter {i}.cbz')
+            queued_at[path] = time.perf_counter()
+            QueueWorker._queue.put(QueueEvent(path, QueueEventOrigin.SCAN))
+
+            # Space the events out so the latency measured is that of a waiting worker, not of a backlog
+            time.sleep(.0005)
+
+        QueueWorker._queue.join()
+
+    return [latency * 1000 for latency in latencies]
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    start_workers()
+
+    idle_cpu = measure_idle_cpu()
+    latencies = measure_dequeue_latency()
+    median_latency = statistics.median(latencies)
+    p99_latency = sorted(latencies)[int(len(latencies) * .99)]
+
+    QueueWorker.stop_workers()
+
+    print(f'Idle CPU with {THREADS} workers: {idle_cpu:.2f}%')
+    print(f'Dequeue latency over {len(latencies)} events: median {median_latency:.3f} ms, p99 {p99_latency:.3f} ms')
+
+    if idle_cpu > MAX_IDLE_CPU_PERCENT or median_latency > MAX_MEDIAN_LATENCY_MS:
+        print('FAILED')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import patch
+
+from jikanpy.exceptions import APIException
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from MangaTaggerLib.api import AniList, RateLimiter
+from MangaTaggerLib.errors import ResponseNotCachedError
+
+
+@patch('MangaTaggerLib.api.time')
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_scheduled_at_rate(self, time):
+        """
+        Tests that a burst beyond the per-second capacity is scheduled back to back at the configured rate.
+        """
+        time.monotonic.return_value = 0
+        limiter = RateLimiter('Jikan', requests_per_second=2, requests_per_minute=30)
+
+        self.assertEqual([0, 0, .5, 1, 1.5], [limiter.acquire() for _ in range(5)])
+        self.assertEqual([.5, 1, 1.5], [call.args[0] for call in time.sleep.call_args_list])
+
+        statistics = limiter.statistics()
+        self.assertEqual(5, statistics['calls'])
+        self.assertEqual(3, statistics['delayed_calls'])
+        self.assertEqual(1.5, statistics['max_wait_seconds'])
+
+    def test_per_minute_limit(self, time):
+        """
+        Tests that once the per-minute limit is used up, the next call waits for the oldest call to leave the window.
+        """
+        time.monotonic.return_value = 0
+        limiter = RateLimiter('Jikan', requests_per_minute=30)
+
+        waits = [limiter.acquire() for _ in range(31)]
+        self.assertEqual([0] * 30, waits[:30])
+        self.assertAlmostEqual(60, waits[30])
+
+    def test_per_minute_window(self, time):
+        """
+        Tests that no 60 second window holds more than the per-minute limit, including after an idle period.
+        """
+        clock = [0.0]
+        time.monotonic.side_effect = lambda: clock[0]
+        time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        limiter = RateLimiter('Jikan', requests_per_second=2, requests_per_minute=30)
+
+        starts = []
+        for call in range(200):
+            if call == 100:
+                clock[0] += 120
+            limiter.acquire()
+            starts.append(clock[0])
+
+        for index, start in enumerate(starts):
+            self.assertLessEqual(len([other for other in starts[index:] if other < start + 60]), 30)
+
+    def test_shared_between_instances(self, time):
+        """
+        Tests that the limiter state lives on the class, not on each MTJikan instance.
+        """
+        from MangaTaggerLib.api import MTJikan
+        self.assertIs(MTJikan().limiter, MTJikan().limiter)
+
+    def test_unlimited(self, time):
+        time.monotonic.return_value = 0
+        limiter = RateLimiter('AniList')
+        self.assertEqual([0] * 100, [limiter.acquire() for _ in range(100)])
+
+
+class TestAniListBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        patch1 = patch('MangaTaggerLib.api.ResponseCache')
+        self.ResponseCache = patch1.start()
+        self.addCleanup(patch1.stop)
+        self.ResponseCache.cache_only = False
+        self.ResponseCache.get.side_effect = lambda endpoint, mal_id: {'title': {'romaji': 'Cached'}} \
+            if mal_id == 1 else None
+
+        patch2 = patch.object(AniList, '_request')
+        self._request = patch2.start()
+        self.addCleanup(patch2.stop)
+
+        patch3 = patch.object(AniList, 'batch_size', 2)
+        patch3.start()
+        self.addCleanup(patch3.stop)
+
+    def test_search_by_mal_ids(self):
+        """
+        Tests that only uncached ids are requested, batch_size ids per request, and that ids missing from AniList map
+        to None.
+        """
+        self._request.side_effect = [
+            {'media_0': {'title': {'romaji': 'Two'}}, 'media_1': None},
+            {'media_0': {'title': {'romaji': 'Four'}}}
+        ]
+
+        media = AniList.search_by_mal_ids([1, 2, 3, 4, 2], {})
+
+        self.assertEqual(2, self._request.call_count)
+        self.assertEqual({'mal_id_0': 2, 'mal_id_1': 3}, self._request.call_args_list[0].args[1])
+        self.assertEqual({'mal_id_0': 4}, self._request.call_args_list[1].args[1])
+        self.assertEqual({1: 'Cached', 2: 'Two', 3: None, 4: 'Four'},
+                         {mal_id: details and details['title']['romaji'] for mal_id, details in media.items()})
+        self.assertEqual(2, self.ResponseCache.put.call_count)
+
+    def test_search_by_mal_ids_cache_only(self):
+        self.ResponseCache.cache_only = True
+
+        with self.assertRaises(ResponseNotCachedError):
+            AniList.search_by_mal_ids([1, 2], {})
+        self._request.assert_not_called()
+
+
+@patch.object(AniList, 'limiter')
+@patch('MangaTaggerLib.api.HTTPSession')
+class TestAniListRequest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        AniList.initialize()
+
+    def test_data_returned(self, HTTPSession, limiter):
+        HTTPSession.get.return_value.post.return_value.json.return_value = {
+            'data': {'media_0': None},
+            'errors': [{'message': 'Not Found.', 'status': 404}]
+        }
+
+        self.assertEqual({'media_0': None}, AniList._request('', {}, {}))
+
+    def test_transport_failure(self, HTTPSession, limiter):
+        HTTPSession.get.return_value.post.side_effect = ReadTimeout()
+
+        with self.assertRaises(ConnectionError):
+            AniList._request('', {}, {})
+
+    def test_response_without_data(self, HTTPSession, limiter):
+        """
+        Tests that rate limit, error and non-JSON responses raise instead of looking like ids missing from AniList.
+        """
+        response = HTTPSession.get.return_value.post.return_value
+        response.status_code = 429
+
+        for response_json in ({'data': None, 'errors': [{'message': 'Too Many Requests.', 'status': 429}]},
+                              {'errors': [{'message': 'Internal Server Error', 'status': 500}]}, ['data']):
+            response.json.return_value = response_json
+            with self.assertRaises(APIException):
+                AniList._request('', {}, {})
+
+        response.json.side_effect = ValueError()
+        with self.assertRaises(APIException):
+            AniList._request('', {}, {})
@@ -0,0 +1,149 @@
+import errno
+import io
+import os
+import shutil
+import unittest
+import warnings
+from pathlib import Path
+from unittest.mock import patch
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from MangaTaggerLib.archive import write_comicinfo, copy_with_comicinfo, move_chapter
+
+
+class UnseekableWriter(io.RawIOBase):
+    """
+    Write-only stream that cannot seek, which makes ZipFile write data descriptors after every member.
+    """
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.buffer.write(b)
+
+
+class TestArchive(unittest.TestCase):
+    archive_dir = Path('archives')
+    pages = {
+        'Page 001.jpg': os.urandom(4096),
+        'Page 002.jpg': b'page' * 4096
+    }
+
+    def setUp(self) -> None:
+        self.archive_dir.mkdir()
+        self.path = Path(self.archive_dir, 'Absolute Boyfriend 001.cbz')
+
+        with ZipFile(self.path, 'w') as archive:
+            archive.writestr('Page 001.jpg', self.pages['Page 001.jpg'], ZIP_STORED)
+            archive.writestr('Page 002.jpg', self.pages['Page 002.jpg'], ZIP_DEFLATED)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.archive_dir)
+
+    def _entries(self):
+        with ZipFile(self.path) as archive:
+            self.assertIsNone(archive.testzip())
+            return [(info.filename, archive.read(info), info.compress_size) for info in archive.infolist()]
+
+    def test_comicinfo_written_once(self):
+        """
+        Tests that writing the same ComicInfo.xml twice leaves a single entry and does not rewrite the archive.
+        """
+        self.assertTrue(write_comicinfo(self.path, '<ComicInfo/>'))
+        modified = self.path.stat().st_mtime_ns
+
+        self.assertFalse(write_comicinfo(self.path, '<ComicInfo/>'))
+        self.assertEqual(modified, self.path.stat().st_mtime_ns)
+        self.assertEqual(['Page 001.jpg', 'Page 002.jpg', 'ComicInfo.xml'], [name for name, _, _ in self._entries()])
+
+    def test_comicinfo_replaced(self):
+        """
+        Tests that a different ComicInfo.xml replaces the existing one, and that pages keep their compressed bytes.
+        """
+        write_comicinfo(self.path, '<ComicInfo><Number>1</Number></ComicInfo>')
+        pages_before = self._entries()[:2]
+
+        self.assertTrue(write_comicinfo(self.path, '<ComicInfo><Number>2</Number></ComicInfo>'))
+
+        entries = self._entries()
+        self.assertEqual(pages_before, entries[:2])
+        self.assertEqual([('ComicInfo.xml', b'<ComicInfo><Number>2</Number></ComicInfo>')],
+                         [(name, data) for name, data, _ in entries[2:]])
+        self.assertEqual([], [path.name for path in self.archive_dir.iterdir() if path != self.path])
+
+    def test_duplicate_entries_removed(self):
+        """
+        Tests that archives tagged by appending ComicInfo.xml more than once are left with a single entry.
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            for _ in range(2):
+                with ZipFile(self.path, 'a') as archive:
+                    archive.writestr('ComicInfo.xml', '<ComicInfo/>')
+
+        self.assertTrue(write_comicinfo(self.path, '<ComicInfo/>'))
+        self.assertEqual(1, [name for name, _, _ in self._entries()].count('ComicInfo.xml'))
+
+    def test_data_descriptors(self):
+        """
+        Tests that members written with data descriptors are copied into a valid archive.
+        """
+        stream = UnseekableWriter()
+        with ZipFile(stream, 'w') as archive:
+            for name, data in self.pages.items():
+                archive.writestr(name, data, ZIP_DEFLATED)
+        self.path.write_bytes(stream.buffer.getvalue())
+
+        destination = Path(self.archive_dir, 'Absolute Boyfriend 002.cbz')
+        copy_with_comicinfo(self.path, destination, b'<ComicInfo/>')
+
+        with ZipFile(destination) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(self.pages['Page 002.jpg'], archive.read('Page 002.jpg'))
+            self.assertFalse(any(info.flag_bits & 0x08 for info in archive.infolist()))
+
+    def test_move_with_comicinfo(self):
+        """
+        Tests that a chapter is moved and tagged in one pass, leaving nothing behind in the source directory.
+        """
+        destination = Path(self.archive_dir, 'library', 'Absolute Boyfriend 001.cbz')
+        destination.parent.mkdir()
+
+        move_chapter(self.path, destination, '<ComicInfo/>')
+
+        self.assertFalse(self.path.exists())
+        self.assertEqual(['library'], [path.name for path in self.archive_dir.iterdir()])
+        with ZipFile(destination) as archive:
+            self.assertEqual(b'<ComicInfo/>', archive.read('ComicInfo.xml'))
+            self.assertEqual(self.pages['Page 001.jpg'], archive.read('Page 001.jpg'))
+
+    def test_move_across_filesystems(self):
+        """
+        Tests that a chapter that cannot be renamed onto another filesystem is copied and then removed.
+        """
+        destination = Path(self.archive_dir, 'Absolute Boyfriend 002.cbz')
+        original = self.path.read_bytes()
+
+        with patch('MangaTaggerLib.archive.os.rename', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+            move_chapter(self.path, destination)
+
+        self.assertFalse(self.path.exists())
+        self.assertEqual(original, destination.read_bytes())
+
+    def test_move_onto_existing_chapter(self):
+        """
+        Tests that moving onto an existing chapter raises FileExistsError and leaves both files untouched.
+        """
+        destination = Path(self.archive_dir, 'Absolute Boyfriend 002.cbz')
+        destination.write_bytes(b'existing')
+        original = self.path.read_bytes()
+
+        for comicinfo_xml in (None, '<ComicInfo/>'):
+            with self.assertRaises(FileExistsError):
+                move_chapter(self.path, destination, comicinfo_xml)
+
+        self.assertEqual(original, self.path.read_bytes())
+        self.assertEqual(b'existing', destination.read_bytes())
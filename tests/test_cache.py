@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import patch
+
+from MangaTaggerLib.cache import BloomFilter, LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_least_recently_used_evicted(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+    @patch('MangaTaggerLib.cache.time')
+    def test_ttl_expiry(self, time):
+        """
+        Tests that an entry is treated as a miss and dropped once its time to live has passed.
+        """
+        cache = LRUCache(2, ttl=60)
+
+        time.monotonic.return_value = 0
+        cache.put('a', 1)
+
+        time.monotonic.return_value = 59
+        self.assertEqual(1, cache.get('a'))
+
+        time.monotonic.return_value = 60
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual({'hits': 1, 'misses': 1}, {key: cache.statistics()[key] for key in ('hits', 'misses')})
+        self.assertEqual(0, len(cache))
+
+    def test_discard_values(self):
+        cache = LRUCache(4)
+        cache.put('Absolute Boyfriend', 1)
+        cache.put('Zettai Kareshi', 1)
+        cache.put('Peach Girl', 2)
+        cache.discard_values(lambda value: value == 1)
+
+        self.assertEqual(1, len(cache))
+        self.assertEqual(2, cache.get('Peach Girl'))
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        """
+        Tests that every added key is found, and that keys that were not added are almost always reported missing.
+        """
+        bloom_filter = BloomFilter(1000, .01)
+        for chapter in range(1000):
+            bloom_filter.add(('Absolute Boyfriend', f'{chapter:03}'))
+
+        self.assertTrue(all(('Absolute Boyfriend', f'{chapter:03}') in bloom_filter for chapter in range(1000)))
+
+        false_positives = sum(('Peach Girl', f'{chapter:03}') in bloom_filter for chapter in range(1000))
+        self.assertLess(false_positives, 50)
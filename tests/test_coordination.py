@@ -0,0 +1,306 @@
+import logging
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from jikanpy.exceptions import APIException
+from requests.exceptions import ConnectionError
+
+from MangaTaggerLib.MangaTaggerLib import SingleFlight, KeyedLock, metadata_tagger, evaluate_candidates, \
+    resolve_manga_metadata
+from MangaTaggerLib.cache import LRUCache
+from MangaTaggerLib.database import UnresolvedSeriesTable
+from MangaTaggerLib.errors import MangaNotFoundError
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self) -> None:
+        self.single_flight = SingleFlight()
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _resolve(self, result):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _run_concurrently(self, result, waiters=4):
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(self.single_flight.do('Absolute Boyfriend', self._resolve, result))
+            except Exception as e:
+                outcomes.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        self.started.wait(5)
+
+        threads = [threading.Thread(target=call) for _ in range(waiters)]
+        for thread in threads:
+            thread.start()
+
+        while len([t for t in threads if t.is_alive()]) != waiters:
+            time.sleep(.01)
+        time.sleep(.05)
+        self.release.set()
+
+        for thread in [leader, *threads]:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+        return outcomes
+
+    def test_result_shared(self):
+        """
+        Tests that concurrent callers for the same key run the function once and all receive its result.
+        """
+        outcomes = self._run_concurrently('metadata')
+
+        self.assertEqual(1, self.calls)
+        self.assertEqual(['metadata'] * 5, outcomes)
+        self.assertFalse(self.single_flight.in_flight('Absolute Boyfriend'))
+
+    def test_exception_shared(self):
+        """
+        Tests that an exception raised by the first caller is delivered to every waiter instead of leaving them blocked.
+        """
+        error = MangaNotFoundError('Absolute Boyfriend')
+        outcomes = self._run_concurrently(error)
+
+        self.assertEqual(1, self.calls)
+        self.assertEqual([error] * 5, outcomes)
+
+    def test_sequential_calls_rerun(self):
+        self.release.set()
+        self.single_flight.do('Absolute Boyfriend', self._resolve, 1)
+        self.single_flight.do('Absolute Boyfriend', self._resolve, 2)
+
+        self.assertEqual(2, self.calls)
+
+
+class TestKeyedLock(unittest.TestCase):
+    def test_lock_released(self):
+        keyed_lock = KeyedLock()
+
+        with keyed_lock.lock('Absolute Boyfriend 001.cbz'):
+            self.assertTrue(keyed_lock.locked('Absolute Boyfriend 001.cbz'))
+            self.assertFalse(keyed_lock.locked('Absolute Boyfriend 002.cbz'))
+
+        self.assertFalse(keyed_lock.locked('Absolute Boyfriend 001.cbz'))
+
+    def test_lock_released_on_error(self):
+        keyed_lock = KeyedLock()
+
+        with self.assertRaises(FileExistsError):
+            with keyed_lock.lock('Absolute Boyfriend 001.cbz'):
+                raise FileExistsError()
+
+        self.assertFalse(keyed_lock.locked('Absolute Boyfriend 001.cbz'))
+
+
+class TestMetadataRetry(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        patch1 = patch('MangaTaggerLib.MangaTaggerLib.MetadataTable')
+        self.MetadataTable = patch1.start()
+        self.addCleanup(patch1.stop)
+        self.MetadataTable.cache = LRUCache(0)
+
+        patch2 = patch('MangaTaggerLib.MangaTaggerLib.QueueWorker')
+        self.QueueWorker = patch2.start()
+        self.addCleanup(patch2.stop)
+
+        patch3 = patch('MangaTaggerLib.MangaTaggerLib.resolve_manga_metadata')
+        self.resolve_manga_metadata = patch3.start()
+        self.addCleanup(patch3.stop)
+
+    def test_api_error_parks_chapter(self):
+        """
+        Tests that an unreachable API parks the chapter for its next attempt instead of blocking the worker.
+        """
+        self.resolve_manga_metadata.side_effect = ConnectionError('Connection refused')
+        path = Path('library', 'Absolute Boyfriend', 'Absolute Boyfriend 001.cbz')
+
+        self.assertIsNone(metadata_tagger('Absolute Boyfriend', '001', {}, path, attempt=2))
+        self.QueueWorker.retry_tagging.assert_called_once_with(path, 'Absolute Boyfriend', '001', 3)
+
+    def test_retries_used_up(self):
+        """
+        Tests that a chapter out of attempts is reported as left untagged rather than as parked.
+        """
+        self.resolve_manga_metadata.side_effect = ConnectionError('Connection refused')
+        self.QueueWorker.retry_tagging.return_value = False
+        path = Path('library', 'Absolute Boyfriend', 'Absolute Boyfriend 001.cbz')
+
+        with patch('MangaTaggerLib.MangaTaggerLib.LOG') as log:
+            self.assertIsNone(metadata_tagger('Absolute Boyfriend', '001', {}, path, attempt=8))
+
+        self.assertIn('left untagged', log.error.call_args.args[0])
+        self.assertNotIn('parked', ' '.join(call.args[0] for call in log.warning.call_args_list[1:]))
+
+    def test_unresolved_series_skipped(self):
+        """
+        Tests that a series that recently failed to resolve is skipped without searching the database or the APIs.
+        """
+        with patch.dict(UnresolvedSeriesTable.unresolved_series, {'Absolute Boyfriend': time.time() + 60}):
+            self.assertIsNone(metadata_tagger('Absolute Boyfriend', '001', {}))
+
+        self.resolve_manga_metadata.assert_not_called()
+
+
+class TestUnresolvedSeries(unittest.TestCase):
+    results = {'results': [{'mal_id': 11, 'type': 'Manga', 'title': 'Absolute Boyfriend'}]}
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        for name in ('MetadataTable', 'SeriesAliasTable', 'UnresolvedSeriesTable', 'MTJikan', 'AniList', 'QueueWorker'):
+            patcher = patch(f'MangaTaggerLib.MangaTaggerLib.{name}')
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+        self.MetadataTable.cache = LRUCache(0)
+        self.MetadataTable.lookup.return_value = None
+        self.MetadataTable.search_by_similar_title.return_value = None
+        self.SeriesAliasTable.lookup.return_value = None
+        self.UnresolvedSeriesTable.is_unresolved.return_value = False
+        self.MTJikan.return_value.search.return_value = self.results
+
+    def test_api_error_not_recorded(self):
+        """
+        Tests that a failed or rate-limited AniList request parks the chapter without marking the series unresolved.
+        """
+        path = Path('library', 'Absolute Boyfriend', 'Absolute Boyfriend 001.cbz')
+
+        for error in (APIException(429), ConnectionError('Connection refused')):
+            self.AniList.search_by_mal_ids.side_effect = error
+            self.assertIsNone(metadata_tagger('Absolute Boyfriend', '001', {}, path))
+
+        self.assertEqual(2, self.QueueWorker.retry_tagging.call_count)
+        self.UnresolvedSeriesTable.add.assert_not_called()
+
+    def test_not_found_recorded(self):
+        """
+        Tests that a series is recorded as unresolved once AniList has answered that none of the candidates exist.
+        """
+        self.AniList.search_by_mal_ids.return_value = {11: None}
+
+        self.assertIsNone(resolve_manga_metadata('Absolute Boyfriend', {}))
+        self.UnresolvedSeriesTable.add.assert_called_once()
+
+
+class TestSeriesAliases(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        for name in ('MetadataTable', 'SeriesAliasTable', 'ProcSeriesTable', 'Metadata'):
+            patcher = patch(f'MangaTaggerLib.MangaTaggerLib.{name}')
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+        self.SeriesAliasTable.lookup.return_value = None
+        self.MetadataTable.lookup.return_value = None
+        self.MetadataTable.search_by_similar_title.return_value = None
+        self.Metadata.return_value._id = 11
+
+    def test_exact_lookup_recorded(self):
+        self.MetadataTable.lookup.return_value = {'_id': 11}
+
+        resolve_manga_metadata('Absolute Boyfriend', {})
+        self.SeriesAliasTable.add.assert_called_once()
+
+    def test_similar_title_not_recorded(self):
+        """
+        Tests that a series found through the title index is not made a permanent alias of the directory name.
+        """
+        self.MetadataTable.search_by_similar_title.return_value = {'_id': 11}
+
+        self.assertIs(self.Metadata.return_value, resolve_manga_metadata('Absolute Boyfriend!', {}))
+        self.SeriesAliasTable.add.assert_not_called()
+
+
+class TestCandidateEvaluation(unittest.TestCase):
+    results = [{'mal_id': mal_id, 'title': f'Title {mal_id}'} for mal_id in (11, 12, 13, 14, 15)]
+    anilist_media = {mal_id: {'title': {}} for mal_id in (11, 12, 13, 14, 15)}
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        patch1 = patch('MangaTaggerLib.MangaTaggerLib.MTJikan')
+        self.MTJikan = patch1.start()
+        self.addCleanup(patch1.stop)
+        self.MTJikan.return_value.manga.side_effect = lambda mal_id: {'mal_id': mal_id}
+
+        patch2 = patch('MangaTaggerLib.MangaTaggerLib.candidate_matches')
+        self.candidate_matches = patch2.start()
+        self.addCleanup(patch2.stop)
+
+        patch3 = patch('MangaTaggerLib.MangaTaggerLib.rank_candidate')
+        self.rank_candidate = patch3.start()
+        self.addCleanup(patch3.stop)
+
+    def _fetched(self):
+        return [call.args[0] for call in self.MTJikan.return_value.manga.call_args_list]
+
+    def test_first_search_result_wins(self):
+        """
+        Tests that the earliest matching search result is chosen, even when a later one is ranked first and matches
+        sooner.
+        """
+        self.rank_candidate.side_effect = lambda title, result, media: result['mal_id']
+
+        def matches(title, jikan_details, anilist_details, logging_info):
+            if jikan_details['mal_id'] == 12:
+                time.sleep(.2)
+                return True
+            return jikan_details['mal_id'] == 15
+
+        self.candidate_matches.side_effect = matches
+
+        with patch('MangaTaggerLib.MangaTaggerLib.AppSettings.candidate_threads', 5):
+            self.assertEqual((12, {'mal_id': 12}),
+                             evaluate_candidates('Absolute Boyfriend', self.results, self.anilist_media, {}))
+
+    def test_later_candidates_cancelled(self):
+        """
+        Tests that once a candidate matches, the candidates after it in search result order are never fetched.
+        """
+        self.rank_candidate.side_effect = lambda title, result, media: 1 if result['mal_id'] == 13 else 0
+        self.candidate_matches.side_effect = lambda title, jikan_details, *args: jikan_details['mal_id'] == 13
+
+        with patch('MangaTaggerLib.MangaTaggerLib.AppSettings.candidate_threads', 1):
+            self.assertEqual(13, evaluate_candidates('Absolute Boyfriend', self.results, self.anilist_media, {})[0])
+
+        self.assertEqual([13, 11, 12], self._fetched())
+
+    def test_api_error_before_match_raised(self):
+        """
+        Tests that an API error is raised when it comes from a candidate before the match, as it would have been when
+        comparing candidates one by one, and ignored when it comes from a candidate after it.
+        """
+        self.rank_candidate.return_value = 0
+        self.candidate_matches.side_effect = lambda title, jikan_details, *args: jikan_details['mal_id'] == 12
+
+        def manga(mal_id):
+            if mal_id == error_id:
+                raise ConnectionError('Connection refused')
+            return {'mal_id': mal_id}
+
+        self.MTJikan.return_value.manga.side_effect = manga
+
+        error_id = 11
+        with self.assertRaises(ConnectionError):
+            evaluate_candidates('Absolute Boyfriend', self.results, self.anilist_media, {})
+
+        error_id = 13
+        self.assertEqual(12, evaluate_candidates('Absolute Boyfriend', self.results, self.anilist_media, {})[0])
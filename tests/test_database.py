@@ -0,0 +1,393 @@
+import logging
+import threading
+import time
+import unittest
+from pathlib import Path
+from queue import Queue
+from unittest.mock import MagicMock, patch
+
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from MangaTaggerLib.database import BulkWriter, MetadataTable, ProcFilesTable, ProcSeriesTable, SeriesAliasTable, \
+    TaskQueueTable, UnresolvedSeriesTable
+
+
+class TestProcSeriesTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        ProcSeriesTable._log = logging.getLogger('tests.ProcSeriesTable')
+        ProcSeriesTable._database = MagicMock()
+        ProcSeriesTable.processed_series = set()
+        self.addCleanup(setattr, ProcSeriesTable, '_database', None)
+
+    def test_add_upserts_once(self):
+        """
+        Tests that a series is written as its own document the first time it is added, and never again.
+        """
+        ProcSeriesTable.add('Absolute Boyfriend')
+        ProcSeriesTable.add('Absolute Boyfriend')
+
+        ProcSeriesTable._database.update_one.assert_called_once()
+        search_filter, update = ProcSeriesTable._database.update_one.call_args.args
+        self.assertEqual({'_id': 'Absolute Boyfriend'}, search_filter)
+        self.assertIn('$setOnInsert', update)
+        self.assertTrue(ProcSeriesTable._database.update_one.call_args.kwargs['upsert'])
+
+    def test_load_migrates_legacy_document(self):
+        """
+        Tests that the single document of earlier versions is split into one document per series and then removed.
+        """
+        legacy_id = ObjectId()
+        ProcSeriesTable._database.find.side_effect = [
+            [{'_id': legacy_id, 'Absolute Boyfriend': True, 'Peach Girl': True}],
+            [{'_id': 'Absolute Boyfriend'}, {'_id': 'Peach Girl'}, {'_id': 'G-Maru Edition'}]
+        ]
+
+        ProcSeriesTable.load()
+
+        operations = ProcSeriesTable._database.bulk_write.call_args.args[0]
+        self.assertEqual([{'_id': 'Absolute Boyfriend'}, {'_id': 'Peach Girl'}],
+                         [operation._filter for operation in operations])
+        ProcSeriesTable._database.delete_one.assert_called_once_with({'_id': legacy_id})
+        self.assertEqual({'Absolute Boyfriend', 'Peach Girl', 'G-Maru Edition'}, ProcSeriesTable.processed_series)
+        self.assertEqual({'_id': 1}, ProcSeriesTable._database.find.call_args_list[1].args[1])
+
+
+class TestUnresolvedSeriesTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        UnresolvedSeriesTable._log = logging.getLogger('tests.UnresolvedSeriesTable')
+        UnresolvedSeriesTable._database = MagicMock()
+        UnresolvedSeriesTable.unresolved_series = {}
+        self.addCleanup(setattr, UnresolvedSeriesTable, 'unresolved_series', {})
+        self.addCleanup(setattr, UnresolvedSeriesTable, '_database', None)
+
+    def test_add_persists_with_expiry(self):
+        UnresolvedSeriesTable.add('Absolute Boyfriend', 'Not found')
+
+        self.assertTrue(UnresolvedSeriesTable.is_unresolved('Absolute Boyfriend'))
+        self.assertFalse(UnresolvedSeriesTable.is_unresolved('Peach Girl'))
+
+        search_filter, update = UnresolvedSeriesTable._database.update_one.call_args.args
+        self.assertEqual({'_id': 'Absolute Boyfriend'}, search_filter)
+        expiry = update['$set']['expires_at'] - update['$set']['failed_at']
+        self.assertEqual(UnresolvedSeriesTable.ttl, expiry.total_seconds())
+
+    def test_expired_entry_ignored(self):
+        UnresolvedSeriesTable.unresolved_series['Absolute Boyfriend'] = time.time() - 1
+
+        self.assertFalse(UnresolvedSeriesTable.is_unresolved('Absolute Boyfriend'))
+        self.assertNotIn('Absolute Boyfriend', UnresolvedSeriesTable.unresolved_series)
+
+    def test_remove(self):
+        """
+        Tests that only the given series are removed, and that every series is removed when none are given.
+        """
+        UnresolvedSeriesTable.add('Absolute Boyfriend', 'Not found')
+        UnresolvedSeriesTable.add('Peach Girl', 'Not found')
+
+        UnresolvedSeriesTable.remove(['Absolute Boyfriend'])
+        UnresolvedSeriesTable._database.delete_many.assert_called_with({'_id': {'$in': ['Absolute Boyfriend']}})
+        self.assertEqual(['Peach Girl'], list(UnresolvedSeriesTable.unresolved_series))
+
+        UnresolvedSeriesTable.remove()
+        UnresolvedSeriesTable._database.delete_many.assert_called_with({})
+        self.assertEqual({}, UnresolvedSeriesTable.unresolved_series)
+
+
+class TestSeriesAliasTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        SeriesAliasTable._log = logging.getLogger('tests.SeriesAliasTable')
+        SeriesAliasTable._database = MagicMock()
+        SeriesAliasTable.aliases = {}
+        self.addCleanup(setattr, SeriesAliasTable, 'aliases', {})
+        self.addCleanup(setattr, SeriesAliasTable, '_database', None)
+
+    def test_add_writes_once(self):
+        """
+        Tests that an alias is written when it is learned or changes, and not when it is already known.
+        """
+        SeriesAliasTable.add('Zettai Kareshi', 11)
+        SeriesAliasTable.add('Zettai Kareshi', 11)
+
+        self.assertEqual(11, SeriesAliasTable.lookup('Zettai Kareshi'))
+        SeriesAliasTable._database.update_one.assert_called_once()
+        self.assertEqual({'_id': 'Zettai Kareshi'}, SeriesAliasTable._database.update_one.call_args.args[0])
+
+        SeriesAliasTable.add('Zettai Kareshi', 12)
+        self.assertEqual(2, SeriesAliasTable._database.update_one.call_count)
+
+    def test_seed(self):
+        SeriesAliasTable._database.bulk_write.return_value.upserted_count = 2
+
+        self.assertEqual(2, SeriesAliasTable.seed({'Zettai Kareshi': 11, 'Peach Girl Next [EN]': 21541}))
+        self.assertEqual(21541, SeriesAliasTable.lookup('Peach Girl Next [EN]'))
+        self.assertEqual(2, len(SeriesAliasTable._database.bulk_write.call_args.args[0]))
+
+
+class TestTaskQueueTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        TaskQueueTable._log = logging.getLogger('tests.TaskQueueTable')
+        TaskQueueTable._database = MagicMock()
+        self.addCleanup(setattr, TaskQueueTable, '_database', None)
+
+    def test_save_drains_without_blocking(self):
+        """
+        Tests that saving the queue inserts every event and returns once the queue is empty, even if another consumer
+        takes the last event first.
+        """
+        queue = Queue()
+        for chapter in range(1, 3):
+            event = MagicMock()
+            event.dictionary.return_value = {'src_path': f'Absolute Boyfriend -.- Chapter {chapter}.cbz'}
+            queue.put(event)
+
+        # As if a worker took the last event between the check for an empty queue and the get
+        queue.empty = lambda: False
+
+        saver = threading.Thread(target=TaskQueueTable.save, args=(queue,), daemon=True)
+        saver.start()
+        saver.join(5)
+
+        self.assertFalse(saver.is_alive())
+        self.assertEqual(2, TaskQueueTable._database.insert_one.call_count)
+        self.assertEqual(0, queue.unfinished_tasks)
+
+
+class TestBulkWriter(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+        self.writer = BulkWriter('task_queue', self.collection, max_batch_size=3, flush_interval=60)
+
+    def _written(self):
+        return [operation for call in self.collection.bulk_write.call_args_list for operation in call.args[0]]
+
+    def test_flush_batches_in_order(self):
+        """
+        Tests that pending operations are written in order, in ordered batches of at most max_batch_size.
+        """
+        operations = [InsertOne({'_id': i}) for i in range(4)] + [DeleteOne({'_id': 0})]
+        for operation in operations:
+            self.writer.write(operation)
+
+        self.writer.flush()
+
+        self.assertEqual([3, 2], [len(call.args[0]) for call in self.collection.bulk_write.call_args_list])
+        self.assertTrue(all(call.kwargs['ordered'] for call in self.collection.bulk_write.call_args_list))
+        self.assertEqual(operations, self._written())
+        statistics = self.writer.statistics()
+        self.assertEqual({'pending': 0, 'max_pending': 5, 'written': 5, 'batches': 2, 'errors': 0},
+                         {key: statistics[key] for key in ('pending', 'max_pending', 'written', 'batches', 'errors')})
+        self.assertGreaterEqual(statistics['max_flush_ms'], statistics['average_flush_ms'])
+
+    def test_full_batch_written_in_background(self):
+        """
+        Tests that the writer thread sends a batch as soon as it is full, without waiting for the flush interval.
+        """
+        written = threading.Event()
+        self.collection.bulk_write.side_effect = lambda operations, ordered: written.set()
+        self.writer.start()
+        self.addCleanup(self.writer.stop)
+
+        for i in range(3):
+            self.writer.write(InsertOne({'_id': i}))
+
+        self.assertTrue(written.wait(5))
+
+    def test_stop_flushes(self):
+        self.writer.start()
+        self.writer.write(InsertOne({'_id': 1}))
+        self.writer.stop()
+
+        self.assertEqual(1, len(self._written()))
+
+    def test_bulk_write_error(self):
+        self.collection.bulk_write.side_effect = BulkWriteError({'writeErrors': [{'index': 0}]})
+        self.writer.write(InsertOne({'_id': 1}))
+        self.writer.flush()
+
+        self.assertEqual(1, self.writer.statistics()['errors'])
+        self.assertEqual(0, len(self.writer))
+
+    def test_ordered_error_skips_failed_operation(self):
+        """
+        Tests that the operations after a failed one in an ordered batch are still written.
+        """
+        self.collection.bulk_write.side_effect = [BulkWriteError({'writeErrors': [{'index': 1}]}), None]
+        operations = [InsertOne({'_id': i}) for i in range(3)]
+        for operation in operations:
+            self.writer.write(operation)
+
+        self.writer.flush()
+
+        self.assertEqual(operations[2:], self.collection.bulk_write.call_args_list[1].args[0])
+        self.assertEqual(2, self.writer.statistics()['written'])
+        self.assertEqual(1, self.writer.statistics()['errors'])
+
+    def test_on_written(self):
+        written = []
+        writer = BulkWriter('processed_files', self.collection, max_batch_size=2, on_written=written.append)
+        sequences = [writer.write(InsertOne({'_id': i})) for i in range(3)]
+
+        writer.flush()
+
+        self.assertEqual([1, 2, 3], sequences)
+        self.assertEqual([2, 3], written)
+
+
+class TestWriteBehind(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+        for table in (MetadataTable, ProcFilesTable):
+            table._log = logging.getLogger(f'tests.{table.__name__}')
+            table._database = MagicMock()
+            table._database.with_options.return_value = table._database
+            table._database.find.return_value = []
+            table._database.find_one.return_value = None
+            table.write_behind_flush_interval = 60
+            table._start_writer(table is ProcFilesTable)
+            self.addCleanup(setattr, table, '_writer', None)
+            self.addCleanup(table._writer.stop)
+
+        self.addCleanup(MetadataTable.title_index.clear)
+        self.addCleanup(ProcFilesTable.series_index.clear)
+        self.addCleanup(setattr, ProcFilesTable, 'chapter_filter', None)
+        self.logging_info = {}
+
+    def test_processed_files_read_your_writes(self):
+        """
+        Tests that a processed file can be found before it has been written.
+        """
+        with patch('MangaTaggerLib.database.move_chapter'):
+            ProcFilesTable.insert_record_and_rename(Path('Absolute Boyfriend -.- Chapter 1.cbz'),
+                                                    Path('Absolute Boyfriend 001.cbz'), 'Absolute Boyfriend', '001',
+                                                    self.logging_info)
+
+        self.assertEqual('Absolute Boyfriend 001.cbz',
+                         ProcFilesTable.search('Absolute Boyfriend', '001')['new_filename'])
+        self.assertIn(('Absolute Boyfriend', 'Absolute Boyfriend -.- Chapter 1.cbz'),
+                      ProcFilesTable.processed_filenames())
+
+        ProcFilesTable._writer.flush()
+
+        self.assertEqual({}, ProcFilesTable._pending)
+        self.assertIsInstance(ProcFilesTable._database.bulk_write.call_args.args[0][0], InsertOne)
+
+    def test_series_index_loaded_once(self):
+        """
+        Tests that the chapters of a series are loaded in one query, and that chapters processed afterwards are added.
+        """
+        ProcFilesTable._database.find.return_value = [
+            {'chapter_number': '001', 'old_filename': 'Absolute Boyfriend -.- Chapter 1.cbz',
+             'new_filename': 'Absolute Boyfriend 001.cbz'}
+        ]
+
+        self.assertEqual('Absolute Boyfriend 001.cbz',
+                         ProcFilesTable.search('Absolute Boyfriend', '001')['new_filename'])
+        self.assertIsNone(ProcFilesTable.search('Absolute Boyfriend', '002'))
+
+        with patch('MangaTaggerLib.database.move_chapter'):
+            ProcFilesTable.insert_record_and_rename(Path('Absolute Boyfriend -.- Chapter 2.cbz'),
+                                                    Path('Absolute Boyfriend 002.cbz'), 'Absolute Boyfriend', '002',
+                                                    self.logging_info)
+
+        self.assertEqual('Absolute Boyfriend 002.cbz',
+                         ProcFilesTable.search('Absolute Boyfriend', '002')['new_filename'])
+        ProcFilesTable._database.find.assert_called_once()
+        ProcFilesTable._database.find_one.assert_not_called()
+
+    def test_series_index_written_during_load(self):
+        """
+        Tests that a chapter written while its series is being loaded is still found.
+        """
+        with patch('MangaTaggerLib.database.move_chapter'):
+            ProcFilesTable.insert_record_and_rename(Path('Absolute Boyfriend -.- Chapter 1.cbz'),
+                                                    Path('Absolute Boyfriend 001.cbz'), 'Absolute Boyfriend', '001',
+                                                    self.logging_info)
+
+        # The query sees the collection as it was before the writer flushed the chapter
+        ProcFilesTable._database.find.side_effect = lambda *args: ProcFilesTable._writer.flush() or []
+
+        self.assertEqual('Absolute Boyfriend 001.cbz',
+                         ProcFilesTable.search('Absolute Boyfriend', '001')['new_filename'])
+        self.assertEqual({}, ProcFilesTable._pending)
+
+    def test_chapter_filter_skips_database(self):
+        """
+        Tests that chapters missing from the chapter filter are never looked up, while processed chapters are.
+        """
+        ProcFilesTable._database.find.return_value = [{'series_title': 'Absolute Boyfriend', 'chapter_number': '001'}]
+        ProcFilesTable.load()
+        ProcFilesTable._database.find.reset_mock()
+        ProcFilesTable._database.find.return_value = []
+
+        self.assertIsNone(ProcFilesTable.search('Absolute Boyfriend', '002'))
+        ProcFilesTable._database.find.assert_not_called()
+
+        ProcFilesTable.search('Absolute Boyfriend', '001')
+        ProcFilesTable._database.find.assert_called_once()
+
+    def test_processed_files_update_follows_insert(self):
+        """
+        Tests that an update is written after the insert it updates, and is readable merged into the inserted record.
+        """
+        with patch('MangaTaggerLib.database.move_chapter'):
+            record = ProcFilesTable.insert_record_and_rename(Path('Absolute Boyfriend -.- Chapter 1.cbz'),
+                                                             Path('Absolute Boyfriend 001.cbz'), 'Absolute Boyfriend',
+                                                             '001', self.logging_info)
+            ProcFilesTable.update_record_and_rename(record, Path('Absolute Boyfriend -.- Chapter 1 v2.cbz'),
+                                                    Path('Absolute Boyfriend 001.cbz'), self.logging_info)
+
+        self.assertEqual('Absolute Boyfriend -.- Chapter 1 v2.cbz',
+                         ProcFilesTable.search('Absolute Boyfriend', '001')['old_filename'])
+
+        ProcFilesTable._writer.flush()
+
+        operations = ProcFilesTable._database.bulk_write.call_args.args[0]
+        self.assertEqual([InsertOne, UpdateOne], [type(operation) for operation in operations])
+        self.assertTrue(ProcFilesTable._database.bulk_write.call_args.kwargs['ordered'])
+
+    def test_metadata_read_your_writes(self):
+        record = {'_id': 11, 'search_value': 'Absolute Boyfriend', 'series_title': 'Zettai Kareshi',
+                  'series_title_eng': 'Absolute Boyfriend'}
+        MetadataTable.insert(record)
+
+        self.assertEqual(record, MetadataTable.lookup('Zettai Kareshi'))
+        self.assertEqual(record, MetadataTable.search_by_similar_title('Absolute Boyfriend'))
+
+        MetadataTable._writer.flush()
+
+        self.assertIsNone(MetadataTable.lookup('Zettai Kareshi'))
+        self.assertFalse(MetadataTable._database.bulk_write.call_args.kwargs['ordered'])
+
+    def test_similar_title_sequel_rejected(self):
+        """
+        Tests that the title index does not match a sequel to the series before it, while a spelling variant of the
+        stored title is still matched.
+        """
+        record = {'_id': 12, 'search_value': 'JoJo no Kimyou na Bouken Part 4',
+                  'series_title': 'JoJo no Kimyou na Bouken Part 4: Diamond wa Kudakenai'}
+        MetadataTable.insert(record)
+
+        self.assertIsNone(MetadataTable.search_by_similar_title('JoJo no Kimyou na Bouken Part 5'))
+        self.assertEqual(record, MetadataTable.search_by_similar_title('JoJo no Kimyou na Bouken - Part 4'))
+        self.assertEqual(record, MetadataTable.search_by_similar_title('JoJo no Kimyou na Bouken Prt 4'))
+
+    def test_metadata_written_during_lookup(self):
+        """
+        Tests that a record written while it is being looked up is still found.
+        """
+        record = {'_id': 11, 'search_value': 'Absolute Boyfriend', 'series_title': 'Zettai Kareshi'}
+        MetadataTable.insert(record)
+
+        # The query sees the collection as it was before the writer flushed the record
+        MetadataTable._database.find.side_effect = lambda *args: MetadataTable._writer.flush() or []
+
+        self.assertEqual(record, MetadataTable.lookup('Absolute Boyfriend'))
+        self.assertEqual({}, MetadataTable._pending)
@@ -5,7 +5,9 @@ from pathlib import Path
 from unittest.mock import patch
 
 from MangaTaggerLib.api import AniList
-from MangaTaggerLib.MangaTaggerLib import metadata_tagger, construct_comicinfo_xml
+from MangaTaggerLib.cache import LRUCache
+from MangaTaggerLib.MangaTaggerLib import metadata_tagger, construct_comicinfo_xml, render_comicinfo_xml, \
+    COMICINFO_TEMPLATES
 from MangaTaggerLib.models import Metadata
 from tests.database import MetadataTable as MetadataTableTest
 
@@ -30,18 +32,14 @@ class TestMetadata(unittest.TestCase):
         patch2 = patch('MangaTaggerLib.MangaTaggerLib.MetadataTable')
         self.MetadataTable = patch2.start()
         self.addCleanup(patch2.stop)
-        self.MetadataTable.search_by_search_value = MetadataTableTest.search_return_no_results
-        self.MetadataTable.search_by_series_title = MetadataTableTest.search_return_no_results
-        self.MetadataTable.search_by_series_title_eng = MetadataTableTest.search_return_no_results
+        self.MetadataTable.lookup = MetadataTableTest.search_return_no_results
+        self.MetadataTable.search_by_similar_title = MetadataTableTest.search_return_no_results
+        self.MetadataTable.cache = LRUCache(0)
 
-        patch3 = patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_DB_SEARCH', new_callable=list)
-        self.CURRENTLY_PENDING_DB_SEARCH = patch3.start()
+        patch3 = patch('MangaTaggerLib.MangaTaggerLib.AppSettings')
+        self.MangaTaggerLib_AppSettings = patch3.start()
         self.addCleanup(patch3.stop)
 
-        patch4 = patch('MangaTaggerLib.MangaTaggerLib.AppSettings')
-        self.MangaTaggerLib_AppSettings = patch4.start()
-        self.addCleanup(patch4.stop)
-
     def test_comicinfo_xml_creation_case_1(self):
         title = 'Absolute Boyfriend'
 
@@ -87,11 +85,29 @@ class TestMetadata(unittest.TestCase):
 
         self.assertTrue(construct_comicinfo_xml(manga_metadata, '001', {}))
 
+    def test_comicinfo_xml_template(self):
+        """
+        Tests that chapters filled into the cached series template are byte-for-byte identical to a full render.
+        """
+        for title in ('Absolute Boyfriend', 'Peach Girl Next [EN]', 'G-Maru Edition'):
+            with open(Path(self.data_dir, title, self.data_file), encoding='utf-8') as data:
+                jikan_details = json.load(data)
+
+            with open(Path(self.data_dir, title, self.staff_file), encoding='utf-8') as data:
+                anilist_details = json.load(data)
+
+            manga_metadata = Metadata(title, {}, jikan_details, anilist_details)
+
+            for chapter_number in ('001', '010.5', 'oneshot', '1 & 2'):
+                self.assertEqual(render_comicinfo_xml(manga_metadata, chapter_number),
+                                 construct_comicinfo_xml(manga_metadata, chapter_number, {}))
+
+            self.assertIn(manga_metadata, COMICINFO_TEMPLATES)
+            self.assertNotIn('MangaTaggerChapterNumber', str(manga_metadata.__dict__))
+
     def test_metadata_case_1(self):
         title = 'Absolute Boyfriend'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(title)
-
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
         with open(Path(self.data_dir, title, self.data_file), encoding='utf-8') as data:
@@ -108,8 +124,6 @@ class TestMetadata(unittest.TestCase):
     def test_metadata_case_2(self):
         title = 'Peach Girl Next [EN]'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(title)
-
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
         with open(Path(self.data_dir, title, self.data_file), encoding='utf-8') as data:
@@ -127,8 +141,6 @@ class TestMetadata(unittest.TestCase):
         actual_title = 'G-Maru Edition'
         downloaded_title = '(G) Edition'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(downloaded_title)
-
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
         with open(Path(self.data_dir, actual_title, self.data_file), encoding='utf-8') as data:
@@ -146,8 +158,6 @@ class TestMetadata(unittest.TestCase):
         actual_title = 'Absolute Boyfriend'
         downloaded_title = 'Boyfriend'
 
-        self.CURRENTLY_PENDING_DB_SEARCH.append(downloaded_title)
-
         self.MangaTaggerLib_AppSettings.mode_settings = { 'write_comicinfo': False }
 
         with open(Path(self.data_dir, actual_title, self.data_file), encoding='utf-8') as data:
@@ -2,10 +2,9 @@ import logging
 import shutil
 import unittest
 from pathlib import Path
-from typing import List
 from unittest.mock import patch
 
-from MangaTaggerLib.MangaTaggerLib import file_renamer, rename_action
+from MangaTaggerLib.MangaTaggerLib import file_renamer, rename_action, load_aliases, resolve_manga_metadata
 from MangaTaggerLib.errors import FileAlreadyProcessedError, FileUpdateNotRequiredError
 from tests.database import ProcFilesTable as ProcFilesTableTest
 
@@ -100,16 +99,13 @@ class TestMangaRenameAction(unittest.TestCase):
         shutil.rmtree(self.library_dir)
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
-    @patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_RENAME', new_callable=list)
-    def test_rename_action_initial(self, CURRENTLY_PENDING_RENAME: List, ProcFilesTable):
+    def test_rename_action_initial(self, ProcFilesTable):
         """
         Tests for initial file rename when no results are returned from the database. Test should execute without error.
         """
         self.current_file.touch()
         ProcFilesTable.search = ProcFilesTableTest.search_return_no_results
 
-        CURRENTLY_PENDING_RENAME.append(self.new_file)
-
         self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
@@ -151,8 +147,7 @@ class TestMangaRenameAction(unittest.TestCase):
             rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {})
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
-    @patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_RENAME', new_callable=list)
-    def test_rename_action_upgrade(self, CURRENTLY_PENDING_RENAME: List, ProcFilesTable):
+    def test_rename_action_upgrade(self, ProcFilesTable):
         """
         Tests for version in file rename when results are returned from the database. Since the current file is a
         higher version than the exisitng file, test should execute without error.
@@ -161,8 +156,49 @@ class TestMangaRenameAction(unittest.TestCase):
         self.current_file.touch()
 
         self.new_file.touch()
-        CURRENTLY_PENDING_RENAME.append(self.new_file)
 
         ProcFilesTable.search = ProcFilesTableTest.search_return_results_version
 
-        self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
\ No newline at end of file
+        self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
+
+
+class TestSeriesAliases(unittest.TestCase):
+    alias_dir = Path('aliases')
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.alias_dir.mkdir()
+        self.addCleanup(shutil.rmtree, self.alias_dir)
+
+    def test_load_aliases_csv(self):
+        """
+        Tests that aliases are read from CSV rows, skipping the header row.
+        """
+        alias_path = Path(self.alias_dir, 'aliases.csv')
+        alias_path.write_text('directory,mal_id\nAbsolute Boyfriend,11\n"Peach Girl Next [EN]",21541\n')
+
+        self.assertEqual({'Absolute Boyfriend': 11, 'Peach Girl Next [EN]': 21541}, load_aliases(alias_path))
+
+    def test_load_aliases_json(self):
+        alias_path = Path(self.alias_dir, 'aliases.json')
+        alias_path.write_text('{"Absolute Boyfriend": 11}')
+
+        self.assertEqual({'Absolute Boyfriend': 11}, load_aliases(alias_path))
+
+    @patch('MangaTaggerLib.MangaTaggerLib.MTJikan')
+    @patch('MangaTaggerLib.MangaTaggerLib.Metadata')
+    @patch('MangaTaggerLib.MangaTaggerLib.ProcSeriesTable')
+    @patch('MangaTaggerLib.MangaTaggerLib.MetadataTable')
+    @patch('MangaTaggerLib.MangaTaggerLib.SeriesAliasTable')
+    def test_alias_resolved_by_id(self, SeriesAliasTable, MetadataTable, ProcSeriesTable, Metadata, MTJikan):
+        """
+        Tests that a known alias is resolved by its MAL ID, without searching by title or calling the APIs.
+        """
+        SeriesAliasTable.lookup.return_value = 11
+        MetadataTable.search_by_id.return_value = {'_id': 11}
+
+        self.assertIs(Metadata.return_value, resolve_manga_metadata('Zettai Kareshi', {}))
+
+        MetadataTable.search_by_id.assert_called_once_with(11)
+        MetadataTable.lookup.assert_not_called()
+        MTJikan.assert_not_called()
@@ -0,0 +1,76 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from MangaTaggerLib.errors import ResponseNotCachedError
+from MangaTaggerLib.response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        ResponseCache.path = Path(self.directory.name, 'api_responses.sqlite')
+        ResponseCache.max_entries = 10000
+        ResponseCache.cache_only = False
+        ResponseCache.hits = 0
+        ResponseCache.misses = 0
+        ResponseCache.initialize()
+        self.addCleanup(ResponseCache.close)
+
+    def test_fetch_persists_across_restarts(self):
+        """
+        Tests that a response fetched once is served from disk after the cache is reopened, without calling the API.
+        """
+        request = MagicMock(return_value={'results': [{'mal_id': 1}]})
+        ResponseCache.fetch('jikan_search', ['manga', 'Absolute Boyfriend', None, None], request)
+
+        ResponseCache.close()
+        ResponseCache.initialize()
+
+        self.assertEqual({'results': [{'mal_id': 1}]},
+                         ResponseCache.fetch('jikan_search', ['manga', 'Absolute Boyfriend', None, None], request))
+        request.assert_called_once()
+
+    @patch('MangaTaggerLib.response_cache.time')
+    def test_expired_response_refetched(self, time):
+        time.time.return_value = 0
+        self.addCleanup(setattr, ResponseCache, 'ttl', ResponseCache.ttl)
+        ResponseCache.ttl = {'jikan_manga': 10}
+        request = MagicMock(return_value={'mal_id': 1})
+
+        ResponseCache.fetch('jikan_manga', [1, None, None], request)
+        time.time.return_value = 11
+        ResponseCache.fetch('jikan_manga', [1, None, None], request)
+
+        self.assertEqual(2, request.call_count)
+
+    def test_failed_response_not_cached(self):
+        request = MagicMock(return_value=None)
+        ResponseCache.fetch('anilist', {'query': '', 'variables': {'mal_id': 1}}, request)
+        ResponseCache.fetch('anilist', {'query': '', 'variables': {'mal_id': 1}}, request)
+
+        self.assertEqual(2, request.call_count)
+
+    def test_cache_only_miss(self):
+        ResponseCache.cache_only = True
+        request = MagicMock()
+
+        with self.assertRaises(ResponseNotCachedError):
+            ResponseCache.fetch('jikan_manga', [1, None, None], request)
+        request.assert_not_called()
+
+    def test_bounded(self):
+        """
+        Tests that the least recently used responses are evicted once the cache holds more than max_entries.
+        """
+        ResponseCache.max_entries = 5
+
+        for mal_id in range(20):
+            ResponseCache.put('jikan_manga', [mal_id, None, None], {'mal_id': mal_id})
+
+        self.assertEqual(5, ResponseCache.statistics()['entries'])
+        self.assertIsNotNone(ResponseCache.get('jikan_manga', [19, None, None]))
+        self.assertIsNone(ResponseCache.get('jikan_manga', [0, None, None]))
@@ -0,0 +1,64 @@
+import logging
+import shutil
+import unittest
+from pathlib import Path
+
+from MangaTaggerLib.scanner import DownloadScanner
+
+
+class TestDownloadScanner(unittest.TestCase):
+    download_dir = Path('downloads')
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self) -> None:
+        self.download_dir.mkdir()
+        self.scanner = DownloadScanner(self.download_dir, threads=4)
+
+        for series in ('Absolute Boyfriend', 'Peach Girl', 'G-Maru Edition'):
+            Path(self.download_dir, series).mkdir()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.download_dir)
+
+    def _create_chapter(self, series, chapter):
+        path = Path(self.download_dir, series, f'{series} -.- Chapter {chapter}.cbz')
+        path.write_bytes(b'PK')
+        return path
+
+    def test_scan_diff(self):
+        """
+        Tests that queued and already processed chapters are left out, as are files that are not chapters.
+        """
+        new = self._create_chapter('Absolute Boyfriend', 1)
+        queued = self._create_chapter('Absolute Boyfriend', 2)
+        self._create_chapter('Peach Girl', 1)
+        Path(self.download_dir, 'G-Maru Edition', 'cover.jpg').write_bytes(b'')
+
+        chapters = self.scanner.scan({}, {str(queued.absolute())}, {('Peach Girl', 'Peach Girl -.- Chapter 1.cbz')})
+
+        self.assertEqual([new], chapters)
+
+    def test_unchanged_directories_skipped(self):
+        """
+        Tests that directories recorded in the manifest are only listed again once their contents change.
+        """
+        queued = self._create_chapter('Absolute Boyfriend', 1)
+        manifest = self.scanner.snapshot({str(queued.absolute())})
+
+        self.assertEqual([], self.scanner.scan(manifest, set(), set()))
+
+        new = self._create_chapter('Peach Girl', 1)
+        self.assertEqual([new], self.scanner.scan(manifest, set(), set()))
+
+    def test_snapshot_excludes_unaccounted_chapters(self):
+        """
+        Tests that a directory still holding a chapter that is not in the task queue is never recorded as unchanged.
+        """
+        self._create_chapter('Absolute Boyfriend', 1)
+
+        manifest = self.scanner.snapshot(set())
+
+        self.assertEqual({'Peach Girl', 'G-Maru Edition'}, set(manifest))
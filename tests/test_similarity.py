@@ -0,0 +1,138 @@
+import random
+import unittest
+
+from MangaTaggerLib import utils
+from MangaTaggerLib.similarity import compare, compare_many, same_title, TrigramIndex
+
+
+def reference_compare(s1, s2):
+    s1 = s1.lower().strip('/[^a-zA-Z ]/g", ')
+    s2 = s2.lower().strip('/[^a-zA-Z ]/g", ')
+
+    previous = list(range(len(s2) + 1))
+    for row in range(1, len(s1) + 1):
+        current = [row] + [0] * len(s2)
+        for col in range(1, len(s2) + 1):
+            cost = 0 if s1[row - 1] == s2[col - 1] else 2
+            current[col] = min(previous[col] + 1, current[col - 1] + 1, previous[col - 1] + cost)
+        previous = current
+
+    return ((len(s1) + len(s2)) - previous[-1]) / (len(s1) + len(s2))
+
+
+class TestCompare(unittest.TestCase):
+    def test_compare_matches_reference(self):
+        """
+        Tests that the bit-parallel engine returns exactly the same scores as the dynamic programming matrix.
+        """
+        rng = random.Random(1798)
+        for _ in range(500):
+            s1 = ''.join(rng.choice('abcAB .,xyz') for _ in range(rng.randint(1, 40)))
+            s2 = ''.join(rng.choice('abcAB .,xyz') for _ in range(rng.randint(1, 40)))
+            if not s1.strip('/[^a-zA-Z ]/g", ') or not s2.strip('/[^a-zA-Z ]/g", '):
+                continue
+            self.assertEqual(reference_compare(s1, s2), compare(s1, s2))
+
+    def test_compare_titles(self):
+        """
+        Tests known title pairs against the dynamic programming matrix, including strings longer than a machine word.
+        """
+        pairs = [
+            ('Absolute Boyfriend', 'Zettai Kareshi'),
+            ('(G) Edition', 'G-Maru Edition'),
+            ('Peach Girl Next [EN]', 'Peach Girl NEXT'),
+            ('Tensei Shitara Slime Datta Ken: Mabutachi no Nichijou ' * 3, 'That Time I Got Reincarnated as a Slime')
+        ]
+
+        for s1, s2 in pairs:
+            self.assertEqual(reference_compare(s1, s2), compare(s1, s2))
+
+    def test_compare_many(self):
+        """
+        Tests that the batch entry point returns the same scores as individual comparisons, in order.
+        """
+        candidates = ['Absolute Boyfriend', 'Zettai Kareshi', 'absolute boyfriend', 'Boyfriend']
+        self.assertEqual([compare('Absolute Boyfriend', c) for c in candidates],
+                         compare_many('Absolute Boyfriend', candidates))
+
+    def test_compare_identical(self):
+        self.assertEqual(1, compare('Absolute Boyfriend', 'ABSOLUTE BOYFRIEND'))
+
+
+class TestSimilarityCache(unittest.TestCase):
+    def setUp(self) -> None:
+        utils.SIMILARITY_CACHE.clear()
+
+    def test_cached_compare(self):
+        """
+        Tests that repeated comparisons of the same normalized pair, in either order, are served from the cache.
+        """
+        self.assertEqual(compare('Absolute Boyfriend', 'Zettai Kareshi'),
+                         utils.compare('Absolute Boyfriend', 'Zettai Kareshi'))
+        utils.compare('zettai kareshi', 'ABSOLUTE BOYFRIEND')
+
+        statistics = utils.SIMILARITY_CACHE.statistics()
+        self.assertEqual(1, statistics['misses'])
+        self.assertEqual(1, statistics['hits'])
+
+    def test_cached_compare_many(self):
+        """
+        Tests that the batch entry point only computes the pairs missing from the cache.
+        """
+        candidates = ['Absolute Boyfriend', 'Zettai Kareshi', 'Boyfriend']
+        utils.compare('Absolute Boyfriend', 'Boyfriend')
+
+        self.assertEqual(compare_many('Absolute Boyfriend', candidates),
+                         utils.compare_many('Absolute Boyfriend', candidates))
+        self.assertEqual(1, utils.SIMILARITY_CACHE.statistics()['hits'])
+        self.assertEqual(3, len(utils.SIMILARITY_CACHE))
+
+    def test_cache_bounded(self):
+        utils.SIMILARITY_CACHE.resize(2)
+        self.addCleanup(utils.SIMILARITY_CACHE.resize, 4096)
+
+        for title in ['a', 'b', 'c', 'd']:
+            utils.compare('Absolute Boyfriend', title)
+
+        self.assertEqual(2, len(utils.SIMILARITY_CACHE))
+
+
+class TestSameTitle(unittest.TestCase):
+    def test_punctuation_and_case(self):
+        self.assertTrue(same_title('Peach Girl Next [EN]', 'peach girl next (en)', .95))
+        self.assertTrue(same_title('Shingeki no Kyojin', 'Shingeki no Kyoujin', .95))
+
+    def test_sequels_and_parts(self):
+        """
+        Tests that titles differing only by their part, season or volume number are never the same title, however
+        similar they are.
+        """
+        self.assertGreater(compare('JoJo no Kimyou na Bouken Part 5', 'JoJo no Kimyou na Bouken Part 4'), .95)
+        self.assertFalse(same_title('JoJo no Kimyou na Bouken Part 5', 'JoJo no Kimyou na Bouken Part 4', .95))
+        self.assertFalse(same_title('Tokyo Ghoul:re 2', 'Tokyo Ghoul:re', .95))
+        self.assertFalse(same_title('Overlord III', 'Overlord II', .95))
+        self.assertTrue(same_title('Kingdom Vol. 2', 'Kingdom Vol 2', .95))
+
+
+class TestTrigramIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = TrigramIndex()
+        self.index.add(1, ['Absolute Boyfriend', 'Zettai Kareshi', None])
+        self.index.add(2, ['Peach Girl NEXT', 'Peach Girl Next'])
+        self.index.add(3, ['G-Maru Edition'])
+
+    def test_search_punctuation_and_case(self):
+        """
+        Tests that a title differing only by punctuation and case resolves to the indexed series first.
+        """
+        score, key = self.index.search('absolute boyfriend!')[0]
+        self.assertEqual(1, key)
+        self.assertEqual(compare('absolute boyfriend!', 'Absolute Boyfriend'), score)
+
+    def test_search_unknown_title(self):
+        self.assertEqual([], self.index.search('qqqq'))
+
+    def test_remove(self):
+        self.index.remove(3)
+        self.assertNotIn(3, [key for _, key in self.index.search('G-Maru Edition')])
+        self.assertEqual(2, len(self.index))
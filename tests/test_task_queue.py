@@ -0,0 +1,283 @@
+import logging
+import os
+import shutil
+import time
+import unittest
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Thread
+from unittest.mock import MagicMock, patch
+
+from MangaTaggerLib import MangaTaggerLib  # Imported first to resolve the circular import with task_queue
+from MangaTaggerLib.task_queue import DelayedRetryQueue, DownloadSettler, QueueEvent, QueueEventOrigin, \
+    QueueWorker, SeriesBatchQueue
+
+
+class TestDownloadSettler(unittest.TestCase):
+    download_dir = Path('downloads')
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self) -> None:
+        self.download_dir.mkdir()
+        self.queue = Queue()
+        self.settler = DownloadSettler(self.queue)
+        self.settler.tick_seconds = .05
+
+    def tearDown(self) -> None:
+        self.settler.stop()
+        shutil.rmtree(self.download_dir)
+
+    def _create_chapter(self, chapter, age=0):
+        path = Path(self.download_dir, f'Absolute Boyfriend -.- Chapter {chapter}.cbz')
+        path.write_bytes(b'PK')
+        if age:
+            os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_finished_file_promoted_immediately(self):
+        """
+        Tests that a file that has not been modified for the settle interval skips the settler entirely.
+        """
+        path = self._create_chapter(1, age=60)
+        self.settler.put(QueueEvent(path, QueueEventOrigin.SCAN))
+
+        self.assertEqual(path, self.queue.get_nowait().src_path)
+        self.assertEqual(0, len(self.settler))
+
+    def test_closed_file_promoted(self):
+        """
+        Tests that a file still being written is held until it is closed.
+        """
+        path = self._create_chapter(1)
+        self.settler.put(QueueEvent(path, QueueEventOrigin.SCAN))
+        self.assertTrue(self.queue.empty())
+
+        self.settler.file_closed(path)
+        self.assertEqual(path, self.queue.get_nowait().src_path)
+
+    def test_growing_file_held_until_settled(self):
+        """
+        Tests that a file is only promoted once its size stops changing.
+        """
+        path = self._create_chapter(1)
+        self.settler.put(QueueEvent(path, QueueEventOrigin.SCAN))
+        self.settler.start()
+
+        with open(path, 'ab') as chapter:
+            for _ in range(5):
+                chapter.write(b'0' * 1024)
+                chapter.flush()
+                time.sleep(self.settler.settle_seconds / 2)
+                self.assertTrue(self.queue.empty())
+
+        self.assertEqual(path, self.queue.get(timeout=5).src_path)
+
+    def test_journal(self):
+        """
+        Tests that events are written to the journal when queued, and acknowledged if the file disappears.
+        """
+        journal = MagicMock()
+        settler = DownloadSettler(self.queue, journal)
+
+        event = QueueEvent(self._create_chapter(1), QueueEventOrigin.SCAN)
+        settler.put(event)
+        journal.enqueue.assert_called_once_with(event)
+
+        missing = QueueEvent(Path(self.download_dir, 'Absolute Boyfriend -.- Chapter 2.cbz'), QueueEventOrigin.SCAN)
+        settler.put(missing)
+        journal.acknowledge.assert_called_once_with(missing)
+
+    def test_stop_returns_pending(self):
+        path = self._create_chapter(1)
+        self.settler.put(QueueEvent(path, QueueEventOrigin.SCAN))
+
+        self.assertEqual([path], [event.src_path for event in self.settler.stop()])
+        with self.assertRaises(Empty):
+            self.queue.get_nowait()
+
+
+class TestDelayedRetryQueue(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self) -> None:
+        self.queue = Queue()
+        self.retry_queue = DelayedRetryQueue(self.queue)
+        self.addCleanup(self.retry_queue.stop)
+
+    @staticmethod
+    def _event(attempt, retry_at=None):
+        return QueueEvent({
+            'event_type': 'tag',
+            'src_path': str(Path('library', 'Absolute Boyfriend', f'Absolute Boyfriend 00{attempt}.cbz')),
+            'manga_title': 'Absolute Boyfriend',
+            'chapter_number': f'00{attempt}',
+            'attempt': attempt,
+            'retry_at': retry_at
+        }, QueueEventOrigin.RETRY)
+
+    def test_exponential_backoff_with_jitter(self):
+        """
+        Tests that the delay doubles with every attempt up to max_delay, with up to half of it randomized.
+        """
+        for attempt, delay in [(1, 30), (2, 60), (3, 120), (6, 900), (8, 900)]:
+            for _ in range(20):
+                self.assertTrue(delay / 2 <= self.retry_queue.delay(attempt) <= delay)
+
+    def test_due_events_promoted(self):
+        """
+        Tests that parked events reach the worker queue once due, earliest first, while later events stay parked.
+        """
+        self.retry_queue.restore(self._event(2, time.time() + .2))
+        self.retry_queue.restore(self._event(1, time.time()))
+        self.retry_queue.restore(self._event(3, time.time() + 3600))
+        self.retry_queue.start()
+
+        self.assertEqual(1, self.queue.get(timeout=5).attempt)
+        self.assertEqual(2, self.queue.get(timeout=5).attempt)
+        self.assertEqual(1, len(self.retry_queue))
+
+    def test_max_attempts(self):
+        self.assertTrue(self.retry_queue.put(self._event(self.retry_queue.max_attempts)))
+        self.assertFalse(self.retry_queue.put(self._event(self.retry_queue.max_attempts + 1)))
+        self.assertEqual(1, len(self.retry_queue))
+
+    def test_stop_returns_parked(self):
+        """
+        Tests that parked events survive a restart with their attempt and retry time through dictionary().
+        """
+        self.retry_queue.put(self._event(1))
+
+        events = self.retry_queue.stop()
+        restored = QueueEvent(events[0].dictionary(), QueueEventOrigin.FROM_DB)
+
+        self.assertEqual(('tag', 1, '001'), (restored.event_type, restored.attempt, restored.chapter_number))
+        self.assertEqual(events[0].retry_at, restored.retry_at)
+        self.assertGreater(restored.retry_at, time.time())
+
+
+class TestSeriesBatchQueue(unittest.TestCase):
+    @staticmethod
+    def _event(series, chapter):
+        return QueueEvent(Path('downloads', series, f'{series} -.- Chapter {chapter}.cbz'), QueueEventOrigin.SCAN)
+
+    def _get_chapters(self, queue):
+        return [event.src_path.parent.name + f' {event.src_path.stem[-1]}' for event in queue.get_nowait()]
+
+    def test_batches_grouped_by_series(self):
+        """
+        Tests that interleaved events are handed out grouped by series, in the order each series was first queued.
+        """
+        queue = SeriesBatchQueue(max_batch_size=10)
+        for chapter in range(1, 4):
+            queue.put(self._event('Absolute Boyfriend', chapter))
+            queue.put(self._event('Peach Girl', chapter))
+
+        self.assertEqual(6, queue.qsize())
+        self.assertEqual(['Absolute Boyfriend 1', 'Absolute Boyfriend 2', 'Absolute Boyfriend 3'],
+                         self._get_chapters(queue))
+        self.assertEqual(['Peach Girl 1', 'Peach Girl 2', 'Peach Girl 3'], self._get_chapters(queue))
+        self.assertTrue(queue.empty())
+
+    def test_round_robin_fairness(self):
+        """
+        Tests that a series with a backlog larger than the batch size yields to other series between batches.
+        """
+        queue = SeriesBatchQueue(max_batch_size=2)
+        for chapter in range(1, 6):
+            queue.put(self._event('Absolute Boyfriend', chapter))
+        queue.put(self._event('Peach Girl', 1))
+
+        self.assertEqual(['Absolute Boyfriend 1', 'Absolute Boyfriend 2'], self._get_chapters(queue))
+        self.assertEqual(['Peach Girl 1'], self._get_chapters(queue))
+        self.assertEqual(['Absolute Boyfriend 3', 'Absolute Boyfriend 4'], self._get_chapters(queue))
+        self.assertEqual(['Absolute Boyfriend 5'], self._get_chapters(queue))
+
+    def test_sentinels_after_events(self):
+        queue = SeriesBatchQueue()
+        queue.put(None)
+        queue.put(None)
+        queue.put(self._event('Absolute Boyfriend', 1))
+
+        self.assertEqual(1, len(queue.get_nowait()))
+        self.assertIsNone(queue.get_nowait())
+        self.assertIsNone(queue.get_nowait())
+        self.assertTrue(queue.empty())
+
+
+class TestQueueWorkerShutdown(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        logging.disable(logging.CRITICAL)
+
+    def setUp(self) -> None:
+        patcher = patch('MangaTaggerLib.task_queue.TaskQueueTable')
+        self.TaskQueueTable = patcher.start()
+        self.TaskQueueTable.durable = True
+        self.addCleanup(patcher.stop)
+
+        QueueWorker._log = logging.getLogger('test')
+        QueueWorker._settler = MagicMock()
+        QueueWorker._settler.stop.return_value = []
+        QueueWorker._retry_queue = MagicMock()
+        QueueWorker._retry_queue.stop.return_value = []
+
+    def test_stop_workers_after_save_with_bounded_series_queue(self):
+        """
+        Tests that saving the task queue empties a full bounded series queue, so the shutdown sentinels can be put.
+        """
+        QueueWorker._queue = SeriesBatchQueue(maxsize=2)
+        for chapter in range(1, 3):
+            QueueWorker._queue.put(QueueEvent(Path('downloads', 'Absolute Boyfriend',
+                                                   f'Absolute Boyfriend -.- Chapter {chapter}.cbz'),
+                                              QueueEventOrigin.SCAN))
+
+        QueueWorker.save_task_queue()
+        self.assertEqual(0, QueueWorker._queue.qsize())
+
+        QueueWorker._worker_list = [Thread(target=QueueWorker.process, daemon=True) for _ in range(2)]
+        for worker in QueueWorker._worker_list:
+            worker.start()
+
+        stopper = Thread(target=QueueWorker.stop_workers, daemon=True)
+        stopper.start()
+        stopper.join(5)
+
+        self.assertFalse(stopper.is_alive())
+        self.TaskQueueTable.acknowledge.assert_not_called()
+
+    def test_retry_tagging_without_queue(self):
+        """
+        Tests that a chapter cannot be parked without a running retry queue or without a file to come back to.
+        """
+        path = Path('library', 'Absolute Boyfriend', 'Absolute Boyfriend 001.cbz')
+        self.assertIsNone(QueueWorker.retry_tagging(None, 'Absolute Boyfriend', '001', 1))
+
+        QueueWorker._retry_queue = None
+        self.assertIsNone(QueueWorker.retry_tagging(path, 'Absolute Boyfriend', '001', 1))
+
+    def test_events_deferred_after_shutdown(self):
+        """
+        Tests that a worker taking an event once shutdown has begun saves it for the next start instead of processing it.
+        """
+        self.TaskQueueTable.durable = False
+        QueueWorker._running = False
+        QueueWorker._queue = Queue()
+        QueueWorker._worker_list = [Thread(target=QueueWorker.process, daemon=True)]
+
+        event = QueueEvent(Path('downloads', 'Absolute Boyfriend', 'Absolute Boyfriend -.- Chapter 1.cbz'),
+                           QueueEventOrigin.SCAN)
+        QueueWorker._queue.put(event)
+
+        with patch('MangaTaggerLib.MangaTaggerLib.process_manga_chapter') as process_manga_chapter:
+            QueueWorker._worker_list[0].start()
+            QueueWorker.stop_workers()
+
+        process_manga_chapter.assert_not_called()
+        self.TaskQueueTable.save_events.assert_called_once_with([event])
+        self.TaskQueueTable.acknowledge.assert_not_called()
+        self.assertEqual(0, QueueWorker._queue.unfinished_tasks)
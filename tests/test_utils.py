@@ -0,0 +1,44 @@
+import unittest
+
+from MangaTaggerLib import MangaTaggerLib  # Imported first to resolve the circular import with utils
+from MangaTaggerLib.utils import AppSettings
+
+
+class TestSettings(unittest.TestCase):
+    def test_missing_settings_use_defaults(self):
+        """
+        Tests that a settings.json written before newer settings were added is filled in with their defaults, while
+        the values it does have are kept.
+        """
+        settings = {
+            'application': {
+                'debug_mode': True,
+                'multithreading': {
+                    'threads': 4,
+                    'max_queue_size': 0
+                }
+            },
+            'database': {
+                'database_name': 'manga_tagger',
+                'port': 27018
+            },
+            'fmd': {
+                'fmd_dir': 'C:\\Free Manga Downloader',
+                'download_dir': None
+            }
+        }
+        defaults = AppSettings._default_settings()
+
+        merged = AppSettings._merge_settings(defaults, settings)
+
+        self.assertTrue(merged['application']['debug_mode'])
+        self.assertEqual(4, merged['application']['multithreading']['threads'])
+        self.assertEqual(27018, merged['database']['port'])
+        self.assertEqual('C:\\Free Manga Downloader', merged['fmd']['fmd_dir'])
+
+        self.assertEqual(defaults['application']['multithreading']['scheduler'],
+                         merged['application']['multithreading']['scheduler'])
+        self.assertEqual(defaults['application']['retry'], merged['application']['retry'])
+        self.assertEqual(defaults['database']['task_queue'], merged['database']['task_queue'])
+        self.assertEqual(defaults['api'], merged['api'])
+        self.assertEqual(defaults['logger'], merged['logger'])